@@ -0,0 +1,506 @@
+"""Offline analyzer.
+
+This file contains the tool that analyses the logs and captures saved
+by the app (by default, the ones in the saving directory of Saver). It
+computes, for the whole archive:
+
+    - Frames per command and direction
+    - Error and Overflow rates of the frames received
+    - Distribution of the time between frames received
+    - Distribution of the round trip time of each command (time from
+      a command sent to the next response of the same command)
+
+and writes a summary report. The times are only taken from captures:
+the text logs have a 1 second resolution, and their In lines carry the
+clock of the device while the Out lines carry the clock of the host,
+so their frames are counted but left out of the time statistics.
+
+Files are split in chunks of bytes aligned to the lines, and the chunks
+are parsed in a pool of processes, so a single huge file is analysed
+in parallel too. Each chunk returns a partial summary, and the partial
+summaries of a file are joined in order, stitching the inter-arrival
+and round trip times that cross the border between two chunks.
+
+Can be run from a terminal:
+
+    python -m dongle.analyzer [directory] [--jobs N] [--output report.txt]
+"""
+# Standard imports
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Internal imports
+from dongle.utils.capture import CaptureWriter
+from dongle.utils.frames import FrameDecoder
+from dongle.utils.log_store import LogStore
+
+# Extensions of the files analysed
+_extensions = (".log", ".cap")
+
+# Bytes per chunk
+_chunkSize = 64 * 1024 * 1024
+
+# Time of the commands sent when it's unknown
+_missing = object()
+
+def _bucket(ns):
+    """
+    Histogram bucket of a time: bucket "b" holds the
+    times between 2^(b-1) and 2^b microseconds.
+    """
+    return (max(ns, 0) // 1000).bit_length()
+
+def _bucket_limit(bucket):
+    # Upper limit of a bucket, in milliseconds
+    return (1 << bucket) / 1000
+
+class Summary:
+    """
+    Statistics of a part of the archive. Summaries of
+    chunks are joined into the summary of their file,
+    and those into the summary of the whole archive.
+
+    The border data (first response of each command
+    before any command sent, last command without
+    response, last frame received) is only used to
+    join consecutive chunks of the same file.
+    """
+#region Variables
+    # Frames per (direction, command)
+    counts: Counter = None
+    # Frames received per kind
+    kinds: Counter = None
+
+    # Histograms, bucket -> frames
+    interArrival: Counter = None
+    rtt: dict = None
+
+    # Sum and count of the round trip times, per command
+    rttSum: Counter = None
+    rttCount: Counter = None
+
+    # Commands sent without a response
+    unanswered: Counter = None
+
+    # Frames without a usable time (text logs)
+    untimed = 0
+
+    # Border data
+    _firstIn = None
+    _lastIn = None
+    _heads = None
+    _pending = None
+    _sent = None
+#endregion
+
+    def __init__(self):
+        self.counts = Counter()
+        self.kinds = Counter()
+        self.interArrival = Counter()
+        self.rtt = {}
+        self.rttSum = Counter()
+        self.rttCount = Counter()
+        self.unanswered = Counter()
+        self.untimed = 0
+        self.files = 0
+        self.bytes = 0
+
+        self._firstIn = None
+        self._lastIn = None
+        self._heads = {}
+        self._pending = {}
+        self._sent = set()
+
+    def __add_rtt(self, command, ns):
+        histogram = self.rtt.get(command)
+        if histogram is None:
+            histogram = self.rtt[command] = Counter()
+        histogram[_bucket(ns)] += 1
+        self.rttSum[command] += ns
+        self.rttCount[command] += 1
+
+    def Add(self, t, direction, kind, command):
+        """
+        Adds a frame to the summary. Frames must be added
+        in the order they were written in the file.
+
+        Frames without a time are still matched with their
+        responses, to count the commands without an answer,
+        but they are left out of the time statistics.
+
+        Args:
+            t (int): Epoch timestamp (ns), or None if unknown
+            direction (str): "in" or "out"
+            kind (str): Type of the frame
+            command (str): Command name (if any)
+        """
+        self.counts[(direction, command)] += 1
+        if t is None and kind != "error":
+            self.untimed += 1
+
+        if direction == "out":
+            if command is None:
+                return
+            if command in self._pending:
+                # Sent again before any response
+                self.unanswered[command] += 1
+            self._pending[command] = t
+            self._sent.add(command)
+            return
+
+        self.kinds[kind] += 1
+        if t is not None:
+            if self._lastIn is None:
+                self._firstIn = t
+            else:
+                self.interArrival[_bucket(t - self._lastIn)] += 1
+            self._lastIn = t
+
+        if command is None or kind not in ("response", "binary"):
+            return
+
+        sent = self._pending.pop(command, _missing)
+        if sent is not _missing:
+            if sent is not None and t is not None:
+                self.__add_rtt(command, t - sent)
+        elif command not in self._sent and command not in self._heads:
+            # Can be the response of a command of the previous chunk
+            self._heads[command] = t
+
+    def Join(self, other):
+        """
+        Adds the summary of the next chunk of the same file.
+
+        Args:
+            other (Summary): Summary of the following chunk
+        """
+        if other._firstIn is not None:
+            if self._lastIn is not None:
+                self.interArrival[_bucket(other._firstIn - self._lastIn)] += 1
+            else:
+                self._firstIn = other._firstIn
+            self._lastIn = other._lastIn
+
+        for command, t in other._heads.items():
+            sent = self._pending.pop(command, None)
+            if sent is not None and t is not None:
+                self.__add_rtt(command, t - sent)
+
+        for command in other._sent:
+            if command in self._pending:
+                del self._pending[command]
+                self.unanswered[command] += 1
+        self._pending.update(other._pending)
+        self._sent |= other._sent
+
+        self.Merge(other)
+
+    def Merge(self, other):
+        """
+        Adds the statistics of another file. Border data
+        is not joined, the files are not consecutive.
+
+        Args:
+            other (Summary): Summary of another file
+        """
+        self.counts.update(other.counts)
+        self.kinds.update(other.kinds)
+        self.interArrival.update(other.interArrival)
+        for command, histogram in other.rtt.items():
+            self.rtt.setdefault(command, Counter()).update(histogram)
+        self.rttSum.update(other.rttSum)
+        self.rttCount.update(other.rttCount)
+        self.unanswered.update(other.unanswered)
+        self.untimed += other.untimed
+        self.files += other.files
+        self.bytes += other.bytes
+
+    def Close(self):
+        """
+        Ends the summary of a file: commands still
+        waiting for a response are unanswered.
+        """
+        for command in self._pending:
+            self.unanswered[command] += 1
+        self._pending = {}
+
+#region Report
+    def __percentiles(self, histogram, points=(50, 90, 99)):
+        total = sum(histogram.values())
+        result = []
+        for p in points:
+            limit = total * p / 100
+            seen = 0
+            for bucket in sorted(histogram):
+                seen += histogram[bucket]
+                if seen >= limit:
+                    result.append(_bucket_limit(bucket))
+                    break
+        return result
+
+    def __histogram(self, histogram):
+        lines = []
+        total = sum(histogram.values()) or 1
+        for bucket in sorted(histogram):
+            count = histogram[bucket]
+            bar = "#" * max(1, int(40 * count / total))
+            lines.append("    <= {0:>12.3f} ms {1:>10d} {2}".format(
+                _bucket_limit(bucket), count, bar))
+        return lines
+
+    def Report(self):
+        """
+        Writes the summary as text.
+
+        Returns:
+            str: Report
+        """
+        lines = ["DynaLoRa analysis report - "
+                 + time.strftime("%Y-%m-%d %H:%M:%S"),
+                 "Files: {0}   Bytes: {1}".format(self.files, self.bytes),
+                 ""]
+
+        received = sum(self.kinds.values())
+        lines.append("Frames received: " + str(received))
+        for kind, count in sorted(self.kinds.items()):
+            lines.append("    {0:<10} {1:>10d} {2:>8.3f} %".format(
+                kind, count, 100 * count / received))
+        lines.append("")
+
+        lines.append("Frames per command:")
+        lines.append("    {0:<16} {1:>10} {2:>10} {3:>10}".format(
+            "command", "out", "in", "no answer"))
+        commands = sorted({c for _, c in self.counts if c is not None})
+        for command in commands:
+            lines.append("    {0:<16} {1:>10d} {2:>10d} {3:>10d}".format(
+                command, self.counts[("out", command)],
+                self.counts[("in", command)], self.unanswered[command]))
+        lines.append("")
+
+        if self.untimed:
+            lines.append("{0} frames of text logs are not in the time "
+                         "statistics: their times have a 1 s resolution "
+                         "and mix".format(self.untimed))
+            lines.append("the clocks of the device (In) and the host (Out). "
+                         "Use captures to measure them.")
+            lines.append("")
+
+        if self.interArrival:
+            p50, p90, p99 = self.__percentiles(self.interArrival)
+            lines.append("Time between frames received "
+                         "(p50 <= {0} ms, p90 <= {1} ms, p99 <= {2} ms):"
+                         .format(p50, p90, p99))
+            lines.extend(self.__histogram(self.interArrival))
+            lines.append("")
+
+        for command in sorted(self.rtt):
+            histogram = self.rtt[command]
+            mean = self.rttSum[command] / self.rttCount[command] / 1e6
+            p50, p90, p99 = self.__percentiles(histogram)
+            lines.append("Round trip time of {0} (mean {1:.3f} ms, "
+                         "p50 <= {2} ms, p90 <= {3} ms, p99 <= {4} ms):"
+                         .format(command, mean, p50, p90, p99))
+            lines.extend(self.__histogram(histogram))
+            lines.append("")
+
+        return "\n".join(lines) + "\n"
+#endregion
+
+#region Parsing
+def _line_info(store, line):
+    """
+    Direction, type and command of a line of a text log.
+
+    Returns:
+        tuple: (time, direction, kind, command) or None
+    """
+    _, direction, kind, command, t = store.ParseLine(line)
+    if "Overflow" in line:
+        return t, "in", "overflow", None
+    if direction == "system":
+        if "rror" in line:
+            return t, "in", "error", None
+        return None
+    return t, direction, kind, command
+
+def _is_capture(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.readline() == CaptureWriter.HEADER.encode()
+    except OSError:
+        return False
+
+def analyze_chunk(path, start, end, capture):
+    """
+    Parses the lines of a file that begin between two
+    byte offsets. Runs in the processes of the pool.
+
+    Args:
+        path (str): File to analyse
+        start (int): First byte of the chunk
+        end (int): Byte after the chunk
+        capture (bool): Whether the file is a capture
+
+    Returns:
+        Summary: Summary of the chunk
+    """
+    summary = Summary()
+    store = LogStore()
+    decoder = FrameDecoder()
+    with open(path, 'rb') as f:
+        if start > 0:
+            # Skip the line that began in the previous chunk
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+
+            if line.startswith(b"#"):
+                continue
+
+            if capture:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                try:
+                    data = bytes.fromhex(fields[2].decode())
+                    t = int(fields[0])
+                except ValueError:
+                    summary.Add(None, "in", "error", None)
+                    continue
+                direction = fields[1].decode()
+                kind, command, _ = decoder.Classify(data)
+                summary.Add(t, direction, kind, command)
+            else:
+                info = _line_info(store, line.decode("utf-8", "replace"))
+                if info:
+                    # The time of the line is not used, see the
+                    # docstring of the module
+                    summary.Add(None, *info[1:])
+
+    return summary
+#endregion
+
+def find_files(directory):
+    """
+    Looks for the logs and captures of a directory
+    and its subdirectories.
+
+    Returns:
+        list: Paths of the files, sorted
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(_extensions):
+                files.append(os.path.join(root, name))
+
+    return sorted(files)
+
+def split_file(path, size=_chunkSize):
+    """
+    Chunks of a file, as byte offsets. Lines are assigned
+    to the chunk where they begin.
+
+    Returns:
+        list: (path, start, end, capture) per chunk
+    """
+    length = os.path.getsize(path)
+    capture = _is_capture(path)
+
+    return [(path, start, min(start + size, length), capture)
+            for start in range(0, length, size)]
+
+def analyze(files, jobs=None, size=_chunkSize):
+    """
+    Analyses a list of files in a pool of processes.
+
+    Args:
+        files (list): Paths of the logs and captures
+        jobs (int, optional): Processes. Defaults to the CPU count.
+        size (int, optional): Bytes per chunk. Defaults to 64 MB.
+
+    Returns:
+        Summary: Summary of all the files
+    """
+    chunks = []
+    for path in files:
+        chunks.extend(split_file(path, size))
+
+    total = Summary()
+    current = None
+    currentPath = None
+
+    def finish():
+        if current is not None:
+            current.Close()
+            current.files = 1
+            current.bytes = os.path.getsize(currentPath)
+            total.Merge(current)
+
+    with ProcessPoolExecutor(jobs) as pool:
+        results = pool.map(analyze_chunk, *zip(*chunks)) if chunks else []
+        # Results come in the order of the chunks
+        for (path, _, _, _), summary in zip(chunks, results):
+            if path != currentPath:
+                finish()
+                current, currentPath = summary, path
+            else:
+                current.Join(summary)
+        finish()
+
+    return total
+
+def main(argv=None):
+    """
+    Analyses a directory of logs and captures and writes
+    the report.
+    """
+    # Imported here, only to know the default directory
+    from dongle.utils.file_manager import Saver
+
+    parser = argparse.ArgumentParser(
+        description="Analyse DynaLoRa logs and captures")
+    parser.add_argument("directory", nargs="?",
+                        help="Directory to analyse (default: saved logs)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Processes (default: CPU count)")
+    parser.add_argument("--chunk", type=int, default=_chunkSize >> 20,
+                        help="MB per chunk (default: 64)")
+    parser.add_argument("--output", help="Report file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    directory = args.directory or Saver().GetSavingDir()
+    files = find_files(directory)
+    if not files:
+        print("No logs or captures found in " + directory)
+        return 1
+
+    begin = time.perf_counter()
+    summary = analyze(files, args.jobs, max(args.chunk, 1) << 20)
+    elapsed = time.perf_counter() - begin
+
+    report = summary.Report()
+    report += "Analysed in {0:.2f} s ({1:.1f} MB/s)\n".format(
+        elapsed, summary.bytes / elapsed / 1e6 if elapsed > 0 else 0)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+        print("Report written in " + args.output)
+    else:
+        print(report)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
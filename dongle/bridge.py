@@ -0,0 +1,455 @@
+"""Device bridge.
+
+This file contains the bridge that shares one connected device with
+many local programs. The bridge holds the serial port and sends every
+frame received to all the clients connected to it, over TCP on
+localhost or Unix domain sockets. Frames sent by the clients are
+written to the device in the order they arrive.
+
+Every message, in both directions, is a frame preceded by its length
+as a 4 bytes big-endian integer. Each client has a bounded queue:
+when a client is too slow to read, frames for it are dropped (and
+counted) by the policy of the queue ("drop-newest" by default, see
+dongle.utils.queues) instead of slowing down the device or other
+clients. The frames are queued by the reading thread of the device,
+so the "block" policy can't be used for the clients.
+
+The bridge can be started from the Device menu of the app, or without
+GUI:
+
+    python -m dongle.bridge --tcp 7000 --unix /tmp/dynalora.sock \
+        --policy drop-oldest
+"""
+# Standard imports
+import os
+import sys
+import time
+import stat
+import queue
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+# Internal imports
+from dongle.utils.queues import BoundedQueue, POLICIES
+
+# Length of each message
+_header = struct.Struct(">I")
+
+# Policies of the buffer of each client (a full buffer can't
+# make the reading thread of the device wait)
+CLIENT_POLICIES = tuple(p for p in POLICIES if p != "block")
+
+def _recv_exact(sock, size):
+    """
+    Reads exactly "size" bytes from a socket.
+
+    Returns:
+        bytes: Data read, or None if the socket was closed
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data.extend(chunk)
+
+    return bytes(data)
+
+def _recv_frame(sock):
+    header = _recv_exact(sock, _header.size)
+    if header is None:
+        return None
+
+    return _recv_exact(sock, _header.unpack(header)[0])
+
+class BridgeClient:
+    """
+    Client connected to the bridge. Stores the frames
+    that have to be sent to it in a bounded queue, which
+    is emptied by its own sending thread.
+    """
+    _sock = None
+    _queue: BoundedQueue = None
+    _thread: threading.Thread = None
+
+    def __init__(self, sock, address, size, policy="drop-newest", sample=10):
+        """
+        Args:
+            sock (socket): Connection with the client
+            address (str): Address of the client
+            size (int): Max frames waiting to be sent
+            policy (str, optional): Policy of the queue when full
+            sample (int, optional): Rate of the "sample" policy
+        """
+        self._sock = sock
+        self.address = address
+        self._queue = BoundedQueue(size, policy, sample, address)
+        self.sent = 0
+        self._thread = threading.Thread(name="Bridge client " + address,
+                                        target=self.__send,
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped(self):
+        return self._queue.GetStats()["dropped"]
+
+    def Push(self, frame):
+        """
+        Queues a frame for the client. When the queue is
+        full, its policy decides which frame is dropped.
+
+        Args:
+            frame (bytes): Frame received from the device
+        """
+        self._queue.Put(frame)
+
+    def GetQueueStats(self):
+        return self._queue.GetStats()
+
+    def __send(self):
+        while True:
+            frame = self._queue.Get()
+            if frame is None:
+                break
+
+            try:
+                self._sock.sendall(_header.pack(len(frame)) + frame)
+                self.sent += 1
+            except OSError:
+                break
+
+    def Close(self):
+        # The sending thread ends after the frames queued
+        self._queue.Close()
+        self._thread.join(1.0)
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    Handles one client connection. Registers the client
+    and reads the frames it sends to the device.
+    """
+    def handle(self):
+        bridge = self.server.bridge
+        address = str(self.client_address or "unix")
+        client = BridgeClient(self.request, address, bridge.GetQueueSize(),
+                              *bridge.GetQueuePolicy())
+        bridge._add_client(client)
+
+        try:
+            while True:
+                frame = _recv_frame(self.request)
+                if frame is None:
+                    break
+                bridge.Send(frame)
+        except OSError:
+            pass
+        finally:
+            bridge._remove_client(client)
+            client.Close()
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+class Bridge:
+    """
+    This class shares a connected device with many local
+    clients. Subscribes to the frames received by the
+    device and sends them to every client, and writes the
+    frames sent by the clients to the device with a single
+    writing thread, so they keep their arrival order.
+    """
+#region Variables
+    _device = None
+    _tcp = None
+    _unix = None
+    _size = 1024
+    _policy = "drop-newest"
+    _sample = 10
+
+    _servers = None
+    _clients = ()
+    _lock: threading.Lock = None
+
+    # Frames sent by the clients, waiting to be written
+    _txQueue: queue.Queue = None
+    _writer: threading.Thread = None
+    _stopped: threading.Event = None
+#endregion
+
+    def __init__(self, device, tcp=None, unix=None, size=1024,
+                 policy="drop-newest", sample=10):
+        """
+        Args:
+            device (Device): Connected device to share
+            tcp (int, optional): TCP port on localhost. Defaults to None.
+            unix (str, optional): Unix socket path. Defaults to None.
+            size (int, optional): Buffer of each client. Defaults to 1024.
+            policy (str, optional): Policy of the buffer of each client
+                                    when full (see CLIENT_POLICIES).
+            sample (int, optional): Rate of the "sample" policy.
+
+        Raises:
+            ValueError: The policy is not known, or it's "block"
+        """
+        if policy not in CLIENT_POLICIES:
+            raise ValueError("Not a policy for bridge clients: "
+                             + str(policy))
+        self._device = device
+        self._tcp = tcp
+        self._unix = unix
+        self._size = size
+        self._policy = policy
+        self._sample = sample
+        self._servers = []
+        self._clients = ()
+        self._lock = threading.Lock()
+        self._txQueue = queue.Queue(size)
+        self._stopped = threading.Event()
+
+    def Start(self):
+        """
+        Opens the sockets and begins sharing the device.
+
+        Raises:
+            OSError: When a socket can't be opened. The sockets
+                     already opened are closed.
+        """
+        try:
+            if self._tcp:
+                self._servers.append(_TCPServer(("127.0.0.1", self._tcp),
+                                                _Handler))
+            if self._unix:
+                if _UnixServer is None:
+                    raise OSError("Unix sockets are not available")
+                self.__remove_socket()
+                self._servers.append(_UnixServer(self._unix, _Handler))
+        except OSError:
+            for server in self._servers:
+                server.server_close()
+            self._servers = []
+            raise
+
+        self._stopped.clear()
+
+        for server in self._servers:
+            server.bridge = self
+            threading.Thread(name="Bridge server",
+                             target=server.serve_forever,
+                             daemon=True).start()
+
+        self._writer = threading.Thread(name="Bridge writer",
+                                        target=self.__write,
+                                        daemon=True)
+        self._writer.start()
+        self._device.subscribe(self.__on_frame)
+
+    def Stop(self):
+        """
+        Stops sharing the device, closing every connection.
+        """
+        self._device.unsubscribe(self.__on_frame)
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+        for client in self._clients:
+            client.Close()
+        self._clients = ()
+
+        if self._writer:
+            # The writer may be blocked writing a frame with the
+            # queue full, so it's stopped by the event if there's
+            # no room for the None
+            self._stopped.set()
+            try:
+                self._txQueue.put_nowait(None)
+            except queue.Full:
+                pass
+            self._writer.join(1.0)
+            self._writer = None
+
+        if self._unix:
+            try:
+                self.__remove_socket()
+            except OSError:
+                pass
+
+    def __remove_socket(self):
+        """
+        Removes the Unix socket file left by a previous
+        bridge. Other files with that path are not touched.
+
+        Raises:
+            OSError: The path exists and is not a socket
+        """
+        try:
+            mode = os.lstat(self._unix).st_mode
+        except FileNotFoundError:
+            return
+
+        if not stat.S_ISSOCK(mode):
+            raise OSError("Not a socket: " + self._unix)
+        os.remove(self._unix)
+
+    def _add_client(self, client):
+        with self._lock:
+            self._clients = self._clients + (client,)
+
+    def _remove_client(self, client):
+        with self._lock:
+            self._clients = tuple(c for c in self._clients if c is not client)
+
+    def __on_frame(self, frame):
+        # Called from the reading thread of the device
+        for client in self._clients:
+            client.Push(frame)
+
+    def Send(self, frame):
+        """
+        Queues a frame to be written to the device. Blocks
+        the client when the queue is full, until there's 
+        room or the bridge is stopped.
+
+        Args:
+            frame (bytes): Encoded frame
+        """
+        while not self._stopped.is_set():
+            try:
+                self._txQueue.put(frame, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def __write(self):
+        while not self._stopped.is_set():
+            frame = self._txQueue.get()
+            if frame is None or self._stopped.is_set():
+                break
+            self._device.write_frame(frame)
+
+    def GetQueueSize(self):
+        return self._size
+
+    def GetQueuePolicy(self):
+        """
+        Returns:
+            tuple: (policy, sample) of the buffer of each client
+        """
+        return (self._policy, self._sample)
+
+    def GetQueues(self):
+        """
+        Returns:
+            list: BoundedQueue.GetStats of each connected client
+        """
+        return [c.GetQueueStats() for c in self._clients]
+
+    def GetStats(self):
+        """
+        Statistics of the connected clients.
+
+        Returns:
+            list: (address, frames sent, frames dropped) per client
+        """
+        return [(c.address, c.sent, c.dropped) for c in self._clients]
+
+class BridgeConnection:
+    """
+    Small client of the bridge, for programs that want
+    to receive the frames of the shared device.
+    """
+    _sock = None
+
+    def __init__(self, address):
+        """
+        Args:
+            address (int/str): TCP port on localhost or Unix socket path
+        """
+        if isinstance(address, int):
+            self._sock = socket.create_connection(("127.0.0.1", address))
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(address)
+
+    def Receive(self):
+        """
+        Waits for the next frame received by the device.
+
+        Returns:
+            bytes: Frame, or None when the bridge closed
+        """
+        return _recv_frame(self._sock)
+
+    def Send(self, frame):
+        """
+        Sends a frame to the device.
+
+        Args:
+            frame (bytes): Encoded frame
+        """
+        self._sock.sendall(_header.pack(len(frame)) + frame)
+
+    def Close(self):
+        self._sock.close()
+
+def main(argv=None):
+    """
+    Connects to a device without GUI and shares it until
+    the program is interrupted.
+    """
+    from dongle.device import Device
+    from dongle.utils.config import ConfigCache, AppConfig
+
+    parser = argparse.ArgumentParser(description="Share a DynaLoRa device")
+    parser.add_argument("--tcp", type=int, help="TCP port on localhost")
+    parser.add_argument("--unix", help="Unix socket path")
+    parser.add_argument("--queue", type=int, default=1024,
+                        help="Frames buffered per client")
+    parser.add_argument("--policy", choices=CLIENT_POLICIES,
+                        default="drop-newest",
+                        help="What to drop when a client's buffer is full")
+    args = parser.parse_args(argv)
+    if not args.tcp and not args.unix:
+        parser.error("Use --tcp and/or --unix")
+
+    cnf = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       'data/cnf'))
+    device = Device(ConfigCache().Load(cnf, "app.json", AppConfig), None)
+    if not device.is_connected():
+        print("No devices found.")
+        return 1
+
+    bridge = Bridge(device, args.tcp, args.unix, args.queue, args.policy)
+    bridge.Start()
+    print("Sharing " + device.get_port())
+
+    try:
+        while device.is_connected():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.Stop()
+        if device.is_connected():
+            device.close()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
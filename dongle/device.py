@@ -11,20 +11,30 @@ Controls that the device has not been disconnected abruptly
 or unexpectedly. 
 """
 # Standard libraries
-import struct
 import time
+import struct
 import threading
 import re
+from collections import deque
 
 # External / Third parties libraries
 import serial
 import serial.tools.list_ports as lp 
-import wx
 
 # Local application
 import dongle.utils.events as ev
 from dongle.utils.bytes_data import ByteCodes
 from dongle.utils.trace import Trace
+from dongle.utils.transport import PortProfile
+from dongle.utils.frames import FrameEncoder, FrameDecoder
+from dongle.utils.capture import CaptureWriter
+from dongle.utils.session_db import SessionRecorder
+from dongle.utils.shm_ring import FrameRing
+from dongle.utils.scheduler import TxScheduler
+from dongle.utils.latency import LatencyTracer, to_epoch
+from dongle.utils.clock import ClockEstimator
+from dongle.utils.aggregate import MessageAggregator
+from dongle.utils.queues import BoundedQueue
 
 # Class to manage the connection with the device
 class Device:
@@ -63,9 +73,18 @@ class Device:
     # Port of the device
     _port = None
     
+    # Serial number of the device, to find it again after a glitch
+    _serial = None
+    
+    # Transport profile of the connected device
+    _profile: PortProfile = None
+    
     # Dictionary of registered devices
     _devices = {}
     
+    # Registered device name by (VID, PID)
+    _lookup = {}
+    
     # Connection thread to manage readings
     _connectionThread = None
     
@@ -75,6 +94,94 @@ class Device:
     
     # wx listener
     _listener = None
+    
+    # Bounded queue of the events to the wx listener
+    _pump: ev.EventPump = None
+    
+    # Events with a frame received, dropped by the policy of the 
+    # queue when the listener doesn't keep up (the others never are)
+    _frameEvents = frozenset((ev.SerialREvent, ev.SerialRMessage, 
+                              ev.SerialRFrameErr, ev.SerialRRepeat,
+                              ev.SerialWRepeat))
+    
+    # Configuration of the queues of the consumers
+    _queues = None
+    
+    # Telemetry extraction of the frames received
+    _telemetry = None
+    
+    # Capture of the frames received and sent
+    _capture: CaptureWriter = None
+    
+    # Recording of the frames received and sent in the session database
+    _recorder: SessionRecorder = None
+    
+    # Observers of the frames received (called in the reading thread)
+    _subscribers = ()
+    
+    # Shared memory ring where the frames received are published
+    _ring: FrameRing = None
+    
+    # Frame encoder for the traces sent
+    _encoder = FrameEncoder()
+    
+    # Classification of the frames received
+    _decoder = FrameDecoder()
+    
+    # Event posted for each kind of frame received
+    _events = {
+        "response": ev.SerialREvent,
+        "message": ev.SerialREvent,
+        "binary": ev.SerialREvent,
+        "overflow": ev.SerialRFrameErr,
+        "error": ev.SerialRFrameErr,
+        "command": ev.SerialRMessage,
+        "text": ev.SerialRMessage
+    }
+    
+    # Pacing of the frames sent
+    _scheduler: TxScheduler = None
+    
+    # Latency of the writes to the port
+    _tracer: LatencyTracer = None
+    
+    # Model of the clock of the device
+    _clock: ClockEstimator = None
+    
+    # Collapsing of the repeated frames received
+    _aggregator: MessageAggregator = None
+    
+    # Default values of the automatic reconnection
+    RECONNECT = {
+        "enabled": True,
+        # First and max wait between tries (seconds)
+        "initial": 0.05,
+        "max": 2.0,
+        "factor": 2.0,
+        # Seconds trying before giving up
+        "timeout": 30.0,
+        # Frames buffered while the link is down
+        "buffer": 256
+    }
+    
+    # Reconnection settings (None when disabled)
+    _reconnect = None
+    
+    # Set while the port is usable. The lock is held while the link
+    # state is checked or changed, and the buffer used
+    _linkUp: threading.Event = None
+    _linkLock: threading.Lock = None
+    
+    # Frames sent while the link was down
+    _txBuffer: deque = None
+    _txDropped = 0
+    
+    # Seconds that each reconnection took
+    _reconnects = None
+    
+    # Max seconds waiting for each thread when closing
+    _joinTimeout = 1.0
+    _closeLock: threading.Lock = None
 
 #endregion
 
@@ -84,7 +191,8 @@ class Device:
 
 # region Construction
 
-    def __init__(self, configuration, listener):
+    def __init__(self, configuration, listener, telemetry=None, port=None, 
+                 last=None, protocol=None):
         """Constructor 
 
         Basically search for available devices in serial port
@@ -95,34 +203,87 @@ class Device:
 
         If a registered device is found, connect to it and update
         connected value. 
+        
+        The configuration is the compiled "app.json" (AppConfig),
+        that already has the VID:PID of each device as bytes, a
+        (VID, PID) lookup table and the transport profile of each
+        device, used both for probing and connecting.
+        
+        When a Telemetry object is given, the numeric fields of
+        the frames received are extracted in the reading thread.
+        
+        A port object (like a ReplayPort) can be given instead of
+        searching for a device. It's used as an opened serial port,
+        so its data goes through the same receiving pipeline.
+        
+        When the "shm" entry of the configuration is enabled, the
+        frames received are also published in a shared memory ring.
+        
+        Frames sent go through a TxScheduler, configured by the 
+        "scheduler" entry, that paces them and keeps the airtime 
+        of the radio inside the duty-cycle budget.
+        
+        When the "aggregation" entry is enabled, runs of identical
+        frames (status messages, Overflow) are collapsed into one
+        SerialRRepeat event with their count.
+        
+        When the port fails, the device is searched again (by its
+        serial number, then by the same port) with exponential 
+        backoff, as set in the "reconnect" entry. Frames sent in 
+        the meantime are buffered and sent after reconnecting. 
+        "last" is the (port, serial number) of a device connected
+        before, tried first when searching.
+        
+        With a Protocol (compiled "protocol.json"), the byte-type
+        traces are encoded with the parameter types of their 
+        command.
+        
+        Events reach a wx listener through a bounded queue, with
+        the size and policy of the "ui" entry of "queues". The 
+        "recorder" entry sets the policy of the session recorder.
         """
-        data = {} # Dictionary with the VID:PID
-        for dev in configuration:
-            tempVID = dev["VID"][2:]
-            tempPID = dev["PID"][2:]
-            data["VID"] = bytes.fromhex(tempVID)
-            data["PID"] = bytes.fromhex(tempPID)
-            self._devices[dev["name"]] = data
-
-            # Reset data
-            data = {}
+        self._devices = configuration.devices
+        self._lookup = configuration.lookup
+        self._queues = configuration.queues
             
         self._listener = listener
+        if listener is not None and not callable(listener):
+            conf = self._queues.get("ui", {})
+            self._pump = ev.EventPump(listener, 
+                                      BoundedQueue.FromConf(conf, "ui"), 
+                                      conf.get("batch", 256))
+        self._telemetry = telemetry
+        if protocol is not None:
+            self._encoder = FrameEncoder(protocol)
 
-        # Search for devices
-        self.__search()
+        if port is not None:
+            # Use the port given, already opened
+            self._device = port
+            self._port = port.name
+            self._profile = PortProfile()
+        else:
+            # Search for devices
+            self.__search(last)
+            
+            # Only real ports can be found again
+            conf = dict(self.RECONNECT, **configuration.reconnect)
+            if conf["enabled"]:
+                self._reconnect = conf
+            
         if(self._port != None):
             # Update connection flag
             self._connected = True
             
             # Connect and etc.
-            try:
-                self._device = serial.Serial(self._port, 115200, timeout=1)
-            except serial.SerialException as e:
-                print(e)
+            if self._device is None:
+                try:
+                    self._device = self._profile.Open(self._port)
+                except serial.SerialException as e:
+                    print(e)
             
             # Begin connection thread to manage readings
             self._stopEvent = threading.Event()
+            self._closeLock = threading.Lock()
             self._connectionThread = threading.Thread(name="Reading thread", 
                                                       target=self.__read, 
                                                       args=(self._devices, 
@@ -130,23 +291,77 @@ class Device:
                                                      )
             
             # Then start a daemon thread to check if device is still connected
-            self._portController = threading.Thread(target=self.__check_connection, 
+            self._portController = threading.Thread(name="Port controller", 
+                                                    target=self.__check_connection, 
                                                     args=(self._stopEvent, 
                                                           self, 
                                                           self._port, 
                                                           0.1))
             
+            # Link state and buffer of the frames sent while it's down
+            self._linkUp = threading.Event()
+            self._linkUp.set()
+            self._linkLock = threading.Lock()
+            self._txBuffer = deque()
+            self._txDropped = 0
+            self._reconnects = []
+            
+            self._tracer = LatencyTracer()
+            self._clock = ClockEstimator()
+            
+            if configuration.aggregation.get("enabled"):
+                self._aggregator = MessageAggregator(configuration.aggregation)
+            
+            # Pace the frames sent
+            self._scheduler = TxScheduler(self.__write_port, 
+                                          configuration.scheduler,
+                                          protocol=protocol)
+            
+            shm = configuration.shm
+            if shm.get("enabled"):
+                try:
+                    self.start_publishing(shm.get("name"), 
+                                          shm.get("slots", 65536), 
+                                          shm.get("slotSize", 256))
+                except (OSError, ValueError) as e:
+                    print(e)
+            
             # Start threads
             self._connectionThread.start()
             self._portController.start()
             
-            wx.PostEvent(self._listener, ev.SerialCTrue())
+            self.__post(ev.SerialCTrue)
 
 #endregion   
             
 #region Connection Management  
 
-    def __search(self):
+    def __post(self, event, **data):
+        """Notify the listener.
+
+        Posts an event to the wx listener. Devices without
+        listener (headless tools, benchmarks) skip it. 
+        
+        The listener can also be a function, called with the 
+        event class and its data instead of creating the wx 
+        event (the worker process forwards them to the GUI).
+        
+        Events go through the bounded queue of the listener;
+        only the ones with a frame can be dropped.
+
+        Args:
+            event (class): Event class (from dongle.utils.events)
+            data: Attributes of the event
+        """
+        listener = self._listener
+        if listener is None:
+            return
+        if callable(listener):
+            listener(event, data)
+        else:
+            self._pump.Post(event(**data), event not in self._frameEvents)
+
+    def __search(self, last=None):
         """Search for devices.
 
         This function searches for valid USB devices
@@ -159,8 +374,19 @@ class Device:
 
         If the device is one of the registered ones, then 
         saves the port to which is connected and ends.
+        
+        Args:
+            last (tuple, optional): (port, serial number) of the
+                                    last device, checked first.
         """
-        for e in list(lp.comports()):
+        ports = list(lp.comports())
+        if last:
+            # Last device first, by serial number or by port
+            ports.sort(key=lambda e: not ((last[1] and 
+                                           e.serial_number == last[1])
+                                          or e.device == last[0]))
+        
+        for e in ports:
             # Get the vid and pid from the device
             info = e.hwid.split()
             print(e)
@@ -168,7 +394,7 @@ class Device:
             for d in info:
                 if("VID:PID" in d):
                     print(d)
-                    nStr = re.split(":|=", info[1])
+                    nStr = re.split(":|=", d)
                     vid = bytes.fromhex(nStr[2])
                     pid = bytes.fromhex(nStr[3])
                     
@@ -176,24 +402,26 @@ class Device:
                     print(pid)
 
                     # Check values with registered devices
-                    for dev in self._devices:
-                        print(dev)
-                        if(self._devices[dev]["VID"] == vid and self._devices[dev]["PID"] == pid):
-                            print("Device correct")
-                            # Save port and end loops
-                            try:
-                                print("Dispositivo: " + e.device)
-                                ser = serial.Serial(e.device, 
-                                                    115200, 
-                                                    timeout=1)
-                                self._port = e.device
-                                print(self._port)
-                                ser.close()
-                                print("Everything is fine for now")
-                                break
-                            except serial.SerialException as e:
-                                print(e)
-                                pass
+                    dev = self._lookup.get((vid, pid))
+                    if dev is not None:
+                        print("Device correct")
+                        # Save port and end loops
+                        try:
+                            print("Dispositivo: " + e.device)
+                            profile = self._devices[dev]["profile"]
+                            ser = profile.Open(e.device)
+                            self._port = e.device
+                            self._serial = e.serial_number
+                            self._profile = profile
+                            print(self._port)
+                            ser.close()
+                            print("Everything is fine for now")
+                            break
+                        except serial.SerialException as err:
+                            print(err)
+            
+            if self._port is not None:
+                break
                         
     def __check_connection(self, stop_event, dev, port, interval=0.1):
         """Check if device is disconnected.
@@ -220,10 +448,92 @@ class Device:
         while not stop_event.is_set():
             # Checks if port is open
             if not dev.test_connection():
-                wx.PostEvent(self._listener, ev.SerialCError())
-                dev.close()
+                if self._reconnect is None or not self.__reconnect(stop_event):
+                    self.__post(ev.SerialCError)
+                    dev.close()
+                    
+            # Wakes up at once when closing
+            stop_event.wait(interval)
+    
+    def __find_again(self):
+        """Find the port of the device after a glitch.
+
+        The port name can change when the device is enumerated
+        again, so it's searched by serial number first.
+
+        Returns:
+            str: Port of the device, or None if it's not back yet
+        """
+        ports = list(lp.comports())
+        for e in ports:
+            if self._serial and e.serial_number == self._serial:
+                return e.device
+        
+        for e in ports:
+            if e.device == self._port:
+                return e.device
+        
+        return None
+    
+    def __reconnect(self, stop_event):
+        """Reconnect after losing the port.
+
+        Marks the link as down (frames sent are buffered), and 
+        tries to open the device again with exponential backoff 
+        until it succeeds or the timeout ends. Only the last 
+        device is tried, without probing every port.
+
+        Args:
+            stop_event: Python threading control
+
+        Returns:
+            bool: Whether the device was connected again
+        """
+        with self._linkLock:
+            self._linkUp.clear()
+        self.__post(ev.SerialCLost, data=self._port)
+        try:
+            self._device.close()
+        except Exception as e:
+            print(e)
+        
+        conf = self._reconnect
+        begin = time.monotonic()
+        delay = conf["initial"]
+        while (not stop_event.is_set() 
+               and time.monotonic() - begin < conf["timeout"]):
+            port = self.__find_again()
+            if port is not None:
+                try:
+                    self._device = self._profile.Open(port)
+                    self._port = port
+                    latency = time.monotonic() - begin
+                    self._reconnects.append(latency)
                     
-            time.sleep(interval)
+                    # Send what was buffered, in order, before the
+                    # frames sent once the link is up
+                    lost = 0
+                    with self._linkLock:
+                        while self._txBuffer:
+                            if not self._scheduler.Send(
+                                    self._txBuffer.popleft()):
+                                lost += 1
+                        self._txDropped += lost
+                        self._linkUp.set()
+                    
+                    self.__post(ev.SerialCReconnect, data=latency)
+                    if lost:
+                        self.__post(ev.SerialWErr, data=str(lost) 
+                                    + " frames sent while reconnecting "
+                                    + "were dropped by the TX scheduler")
+                    return True
+                except serial.SerialException as e:
+                    print(e)
+            
+            stop_event.wait(delay)
+            delay = min(delay * conf["factor"], conf["max"])
+        
+        return False
 
     def __close_connection(self):
         """Close port connection.
@@ -232,82 +542,57 @@ class Device:
         the device. Checks that all threads stopped 
         and resets all data from this object, to 
         notify the GUI correctly.
-        """
-        # Set connection to False
-        self._connected = False
-        self._stopEvent.set()
-        
-        # Then wait for connection thread to end
-        self._connectionThread.join()
         
-        # Close device's connection
-        self._device.close()
-        
-        # Remove device and connection data
-        self._device = None
-        self._port = None
+        A read in progress is cancelled, so the reading thread 
+        ends at once instead of waiting for the read timeout, 
+        and every thread is joined with a deadline. Can be 
+        called from any thread, and more than once.
+        """
+        with self._closeLock:
+            if self._device is None:
+                return
+            
+            # Set connection to False
+            self._connected = False
+            self._stopEvent.set()
+            self._linkUp.set()
+            
+            # Interrupt the read in progress
+            cancel = getattr(self._device, "cancel_read", None)
+            if cancel:
+                try:
+                    cancel()
+                except Exception as e:
+                    print(e)
+            
+            # Then wait for the threads to end
+            current = threading.current_thread()
+            for thread in (self._connectionThread, self._portController):
+                if thread is not current:
+                    thread.join(self._joinTimeout)
+                    if thread.is_alive():
+                        print("Thread not stopped: " + thread.name)
+            
+            # Frames not sent yet are discarded
+            self._scheduler.Stop(self._joinTimeout)
+            
+            # Close device's connection
+            self._device.close()
+            self.stop_capture()
+            self.stop_recording()
+            self.stop_publishing()
+            
+            # Remove device and connection data
+            self._device = None
+            self._port = None
         
         # Notify the GUI listener
-        wx.PostEvent(self._listener, ev.SerialCDisconnect())
+        self.__post(ev.SerialCDisconnect)
 
 #endregion
 
 #region Reading data from the device
 
-    def __validate_frame(self, frame):
-        """Check that received data is valid. 
-
-        This function validates a frame received 
-        from the device, checking if some information
-        was corrupted during transmission.
-        
-        This also can be used to check if the frame
-        that is going to be send is correct. This means
-        the information is correctly coded and the
-        bytes that are going to be send are correct. 
-
-        Args:
-            frame (ByteList): The list of bytes 
-                              representing the frame
-            send (Bool): Flag for checking sending message
-                         or received message.
-
-        Returns:
-            Bool: Returns whether frame is valid.
-        """
-        newStr = frame.decode('utf-8')
-        if ";" not in newStr:
-            # Check sending message
-            last = len(frame) - 1
-            
-            if(frame[0] != ByteCodes.SOF_R or frame[last] != ByteCodes.EOF_R):
-                return False
-            else:
-                # Checksum 
-                calculateSum = frame.copy()
-                del calculateSum[0]
-                del calculateSum[(len(calculateSum) - 3):(len(calculateSum) - 1)]
-                checkSum = sum(calculateSum)
-                frameCheck = int.from_bytes(bytes([frame[last - 2], 
-                                                  frame[last - 1]]), 
-                                                  "big")
-                
-                if(checkSum == frameCheck):
-                    # Frame is not corrupted
-                    return True
-                else:
-                    return False
-        else:
-            temp = newStr.split(";")
-            
-            if ((temp[0] == "DLR" or temp[0] == "DLM") 
-                and (temp[len(temp) - 1] == "EOR" 
-                     or temp[len(temp) - 1] == "EOM")):
-                return True
-            else:
-                return False
-
-    
     def __read(self, iter, stop_event):
         """Read available data from the device.
 
@@ -320,10 +605,30 @@ class Device:
         from the USB device. If the frame is corrupted, then 
         throws a self-made error event to notify the GUI to 
         change and show the error. 
+        
+        Each frame is classified once (FrameDecoder.Kind), 
+        without decoding or copying it, and that kind decides 
+        the event posted. This is the hot path of the app.
+        
+        Frame events carry the host stamps (time.monotonic_ns) 
+        of the read ("t") and of the classification ("decoded"),
+        to trace the latency of the frame up to the log. 
+        Responses and messages also carry their device timestamp 
+        converted to host epoch time ("device", in ns) by the 
+        clock model, when it has samples.
         """
         print("Starting read thread")
+        
+        # Bytes asked for on each read, based on the transport profile
+        chunk = self._profile.GetChunkSize()
+        
         while not stop_event.is_set():
             #print("We keep reading")
+            if not self._linkUp.is_set():
+                # Reconnecting, the port is not usable
+                self._linkUp.wait(0.1)
+                continue
+            
             # Controlling an error while reading
             # This one can occur when the device 
             # disconnects abruptly and the controlling
@@ -332,24 +637,96 @@ class Device:
                 # Check if bytes are available on the device
                 # and read them, then notify observers for 
                 # updating info on screen
-                b = self._device.readline(self._device.in_waiting)
+                b = self._device.readline(max(self._device.in_waiting, 
+                                              chunk))
+                t = time.monotonic_ns()
                 if b:
-                    print(b)
-                    if self.__validate_frame(b):
-                        wx.PostEvent(self._listener, ev.SerialREvent(data=b))
-                    else:
-                        message = b.decode('utf-8')
-                        if "Overflow" not in message:
-                            wx.PostEvent(self._listener, 
-                                         ev.SerialRMessage(data=b))
-                        else:
-                            wx.PostEvent(self._listener, 
-                                         ev.SerialRFrameErr(data=b))
+                    kind = self._decoder.Kind(b)
+                    decoded = time.monotonic_ns()
+                    device = None
+                    if kind == "response" or kind == "message":
+                        device = self.__device_time(b, kind, t)
+                    # Epoch time of the read, for the disk
+                    arrived = None
+                    if self._capture or self._recorder:
+                        arrived = to_epoch(t)
+                    if self._capture:
+                        self._capture.Write("in", b, arrived, device=device)
+                    self._scheduler.OnReceived(kind, b)
+                    for callback in self._subscribers:
+                        callback(b)
+                    if kind == "response" and self._telemetry:
+                        self._telemetry.Process(b)
+                    if self._aggregator and not self.__aggregate(kind, b, t):
+                        continue
+                    if self._recorder:
+                        self._recorder.Write("in", b, arrived, stamp=device)
+                    self.__post(self._events[kind], data=b, kind=kind, 
+                                t=t, decoded=decoded, device=device)
+                elif self._aggregator:
+                    self.__aggregate(None, None, t)
             
             except serial.SerialException as e:
                 print("Error")
+                if self._reconnect is not None:
+                    # The connection check will reconnect
+                    stop_event.wait(0.05)
+                    continue
                 # Writing error occured while sending data to USB device
-                wx.PostEvent(self._listener, ev.SerialRError(data=e))
+                self.__post(ev.SerialRError, data=e)
+
+    def __aggregate(self, kind, frame, t):
+        """Collapse the repeated frames.
+
+        Posts the summaries of the runs that ended, with the
+        count of frames collapsed and the host time (monotonic 
+        ns) of the first and last ones, and records them in the
+        session database instead of the frames collapsed. 
+        Without frame, only the runs whose window passed are 
+        ended.
+
+        Returns:
+            bool: Whether the frame is posted
+        """
+        passed, summary = True, None
+        if frame is not None:
+            passed, summary = self._aggregator.Process(kind, frame, t)
+        summaries = self._aggregator.Expire(t)
+        if summary:
+            summaries.insert(0, summary)
+        for kind, data, count, first, last in summaries:
+            self.__post(ev.SerialRRepeat, data=data, kind=kind, count=count, 
+                        t=first, last=last)
+            if self._recorder:
+                self._recorder.Write("in", data, to_epoch(last), count, 
+                                     to_epoch(first))
+        
+        return passed
+    
+    def __device_time(self, frame, kind, t):
+        """Device timestamp of a frame in host time.
+
+        Answers update the clock model with the time of 
+        the command they answer.
+
+        Args:
+            frame (bytes): Response or message received
+            kind (str): Kind of the frame
+            t (int): Host time of the read (monotonic ns)
+
+        Returns:
+            int: Epoch timestamp (ns), or None if unknown
+        """
+        fields = frame.rstrip(b"\r\n").split(b";")
+        try:
+            stamp = float(fields[len(fields) - 2])
+        except (ValueError, IndexError):
+            return None
+        
+        if kind == "response" and len(fields) > 2:
+            self._clock.OnAnswer(fields[2], stamp, t)
+        
+        return self._clock.ToEpoch(stamp)
 
 #endregion 
 
@@ -426,6 +803,118 @@ class Device:
         else:
             return "No device connected"
 
+    def subscribe(self, callback):
+        """Register an observer of the frames received.
+
+        The callback is called from the reading thread with 
+        every frame read, so it must return quickly (usually 
+        it only puts the frame in a queue). 
+
+        Args:
+            callback (function): Function called with the frame
+        """
+        self._subscribers = self._subscribers + (callback,)
+    
+    def unsubscribe(self, callback):
+        """Remove an observer of the frames received.
+
+        Args:
+            callback (function): Function registered before
+        """
+        self._subscribers = tuple(c for c in self._subscribers 
+                                  if c != callback)
+
+    def start_capture(self, path):
+        """Start recording a capture.
+
+        Records every frame received and sent, with its time,
+        into a capture file that can be replayed later.
+
+        Args:
+            path (str): Path of the capture file
+        """
+        self.stop_capture()
+        self._capture = CaptureWriter(path)
+    
+    def stop_capture(self):
+        """Stop recording the capture.
+
+        Returns:
+            CaptureWriter: Capture that was being recorded (or None)
+        """
+        capture = self._capture
+        self._capture = None
+        if capture:
+            capture.Close()
+        
+        return capture
+
+    def start_recording(self, path, conf=None):
+        """Start recording the session in the session database.
+
+        Every frame received and sent is queued, and inserted
+        in the database by the thread of the recorder, so the 
+        reading thread doesn't wait for the disk (unless the 
+        policy of the "recorder" queue is "block").
+
+        Args:
+            path (str): Path of the database
+            conf (dict, optional): "sessionDb" configuration, with 
+                                   the telemetry "fields" rules
+        """
+        self.stop_recording()
+        queue = BoundedQueue.FromConf(self._queues.get("recorder"), 
+                                      "recorder", 
+                                      (conf or {}).get("queue", 200000))
+        self._recorder = SessionRecorder(path, self._serial or self._port, 
+                                         self._port, conf, queue)
+    
+    def stop_recording(self):
+        """Stop recording the session in the database.
+
+        Returns:
+            dict: Frames written and dropped (or None)
+        """
+        recorder = self._recorder
+        self._recorder = None
+        if recorder is None:
+            return None
+        
+        recorder.Close()
+        return recorder.GetStats()
+
+    def start_publishing(self, name=None, slots=65536, slotSize=256):
+        """Start publishing the frames received in shared memory.
+
+        Creates a shared memory ring and writes every frame 
+        received into it, from the reading thread. Other 
+        processes read them with a FrameRingReader, without 
+        copies or sockets. 
+
+        Args:
+            name (str, optional): Name of the shared memory block.
+                                  Defaults to a random one.
+            slots (int, optional): Frames kept. Defaults to 65536.
+            slotSize (int, optional): Bytes per frame. Defaults to 256.
+
+        Returns:
+            str: Name of the shared memory block
+        """
+        self.stop_publishing()
+        self._ring = FrameRing(name, slots, slotSize)
+        self.subscribe(self._ring.Publish)
+        
+        return self._ring.name
+    
+    def stop_publishing(self):
+        """Stop publishing and remove the shared memory block.
+        """
+        ring = self._ring
+        self._ring = None
+        if ring:
+            self.unsubscribe(ring.Publish)
+            ring.Close()
+
 #endregion
 
 #region Writing
@@ -434,72 +923,216 @@ class Device:
         """Send some data to the device. 
 
         This method is used to write some information in the 
-        USB device with a specific command. First checks that
-        is a valid command and then creates the frame to send 
-        to the device. After that, checks that the frame is
-        valid and then writes it on the device. 
+        USB device with a specific command. Creates the frame 
+        to send to the device, in string mode or byte mode 
+        depending on the trace, and then writes it on the device. 
+        Parameters that can't be encoded post a writing error.
+
+        Args:
+            trace (Trace): Trace with the command, parameters
+                           and type of frame to send.
+        """
+        # Encode the trace into the frame to send
+        try:
+            data = self._encoder.Encode(trace)
+        except (ValueError, struct.error) as e:
+            self.__post(ev.SerialWErr, data="Frame not encoded. Error: " 
+                                            + str(e))
+            return
+        
+        self.write_frame(data)
+    
+    def write_frame(self, data):
+        """Send an encoded frame to the device.
+
+        Queues a frame that is already encoded, like the
+        pre-encoded frames of the auto-send commands, without
+        building it again. The scheduler writes it as soon 
+        as the rate and airtime limits allow it.
 
         Args:
-            command (Bytes): Command to send
-            payload (Bytes): Byte array with the command data
-            string (boolean): Flag that indicates if sending 
-                              uses strings or bytes as sending
-                              method.
+            data (bytes): Frame to send
         """
-        data = None        
         # Check connection status
         if self.is_connected():
-            try:
-                # Check if trace is string mode or byte mode
-                if not trace.GetIsString():
-                    
-                    # Check if it is a reboot command
-                    if trace.GetCommandCode() == b'\x04':
-                        # If so, send it without doing anything else
-                        self._device.write(b'\x03')
-                        self._device.write(trace.GetCommandCode())
-                    else:
-                        # First create frame
-                        data = []
-                        
-                        # Add data to byte array
-                        data.extend(struct.pack('<H', 
-                                                len(trace.GetParamsCode())))
-                        data.extend(trace.GetCommandCode())
-                        data.extend(trace.GetParametersBytes())
-                        
-                        # Calculate hash
-                        checksum = ByteCodes.crc16(data) # This converts to byte list
-                        data.extend(checksum)
-                        
-                        # Set values of start and end
-                        data.insert(0, ByteCodes.SOF)
-                        data.append(ByteCodes.EOF)
-                    
-                        self._device.write(data)
+            queued = True
+            with self._linkLock:
+                if not self._linkUp.is_set():
+                    # Reconnecting, send it later
+                    self.__buffer(data)
                 else:
-                    # Calculate the number of parameters
-                    length = trace.GetParams().split(";")
-                    
-                    # Now create frame
-                    data = 'DLC;{leng};{comm};{pld};{tmp}'.format(
-                        leng=len(length),
-                        comm=trace.GetCommand(),
-                        pld=str(trace.GetParams()),
-                        tmp=str(trace.GetTimeStamp())
-                    ) # string.format
-                    # For debugging, print trace
-                    print(data)
-                    print(data.encode())
-                
-                    self._device.write(data.encode())
-                
-                
-            except serial.SerialException as e:
-                # Writing error occured while sending data to USB device
-                wx.PostEvent(self._listener, ev.SerialWErr(data=e))
+                    queued = self._scheduler.Send(data)
+            if not queued:
+                self.__post(ev.SerialWErr, data="Frame dropped (TX queue "
+                            "full or airtime over the duty-cycle budget)")
         else:
             # Device not connected, not sending data, throw an error (tuercebotas)
-            wx.PostEvent(self._listener, ev.SerialCFalse())
+            self.__post(ev.SerialCFalse)
+    
+    def schedule_repeat(self, frame, period):
+        """Send a command periodically.
+
+        The scheduler sends the frame at deadlines of the 
+        monotonic clock, with the timestamp of each send, and
+        a SerialWRepeat event is posted with every frame sent.
+        Repeats end when the device is closed.
+
+        Args:
+            frame (FrameTemplate): Pre-encoded frame of the command
+            period (float): Seconds between sends
+
+        Returns:
+            int: Id of the repeat, to cancel it
+        """
+        def factory(t):
+            data = frame.Stamp(t)
+            self.__post(ev.SerialWRepeat, data=data, command=frame.command,
+                        t=int(t * 1e9))
+            return data
+        
+        return self._scheduler.Schedule(factory, period)
+    
+    def cancel_repeat(self, id):
+        """Stop sending a command periodically.
+
+        Args:
+            id (int): Id returned by schedule_repeat
+        """
+        self._scheduler.Cancel(id)
+    
+    def __write_port(self, data):
+        """Write a frame to the port.
+
+        Called by the scheduler thread when the frame 
+        is due. 
+
+        Args:
+            data (bytes): Frame to send
+        """
+        with self._linkLock:
+            up = self._linkUp.is_set()
+            if not up:
+                self.__buffer(data)
+        if not up:
+            return
+        
+        try:
+            t = time.monotonic_ns()
+            self._device.write(data)
+            written = time.monotonic_ns()
+            self._tracer.Add("write", written - t)
+            if data[:4] == b"DLC;":
+                self._clock.OnSent(data.split(b";", 3)[2], written)
+            if self._capture or self._recorder:
+                sent = to_epoch(written)
+                if self._capture:
+                    self._capture.Write("out", data, sent)
+                if self._recorder:
+                    self._recorder.Write("out", data, sent)
+        except serial.SerialException as e:
+            if self._reconnect is not None:
+                # Lost with the port, send it after reconnecting
+                with self._linkLock:
+                    self.__buffer(data)
+                return
+            # Writing error occured while sending data to USB device
+            self.__post(ev.SerialWErr, data=e)
+    
+    def __buffer(self, data):
+        """Keep a frame until the device reconnects.
+
+        The buffer is bounded, the oldest frames are dropped.
+        Called with the link lock held.
+
+        Args:
+            data (bytes): Frame to send
+        """
+        size = self._reconnect["buffer"] if self._reconnect else 0
+        if len(self._txBuffer) >= size:
+            if not self._txBuffer:
+                self._txDropped += 1
+                return
+            self._txBuffer.popleft()
+            self._txDropped += 1
+        self._txBuffer.append(data)
+    
+    def get_last(self):
+        """Identity of the connected device.
+
+        Returns:
+            tuple: (port, serial number), to find it first next time
+        """
+        return (self._port, self._serial)
+    
+    def get_reconnect_stats(self):
+        """Statistics of the automatic reconnection.
+
+        Returns:
+            dict: Reconnections, last/mean/max seconds they took,
+                  frames buffered now and frames dropped
+        """
+        times = self._reconnects or []
+        return {
+            "reconnects": len(times),
+            "last": times[len(times) - 1] if times else 0.0,
+            "mean": sum(times) / len(times) if times else 0.0,
+            "max": max(times) if times else 0.0,
+            "buffered": len(self._txBuffer or ()),
+            "dropped": self._txDropped
+        }
+    
+    def get_latency(self):
+        """Latency of the writes to the port.
+
+        Returns:
+            dict: Stats of the "write" span (LatencyTracer.GetStats)
+        """
+        return {"write": self._tracer.GetStats()["write"]}
+    
+    def get_aggregation(self):
+        """Frames collapsed by the aggregation.
+
+        Returns:
+            dict: MessageAggregator.GetStats, or None when the 
+                  aggregation is not enabled
+        """
+        if self._aggregator is None:
+            return None
+        return self._aggregator.GetStats()
+    
+    def get_queues(self):
+        """Queues between the reading thread and its consumers.
+
+        Returns:
+            list: BoundedQueue.GetStats of the queue of the listener
+                  and of the session recorder (the ones in use)
+        """
+        stats = []
+        if self._pump is not None:
+            stats.append(self._pump.GetStats())
+        recorder = self._recorder
+        if recorder is not None:
+            stats.append(recorder.GetQueueStats())
+        return stats
+    
+    def get_clock(self):
+        """Model of the clock of the device.
+
+        Returns:
+            dict: Offset (s), drift (ppm), error (s), samples and
+                  resolution (ClockEstimator.GetModel)
+        """
+        return self._clock.GetModel()
+    
+    def get_scheduler(self):
+        """Access the TX scheduler.
+
+        Used to schedule periodic commands and read 
+        the metrics of the frames sent.
+
+        Returns:
+            TxScheduler: Scheduler of the device
+        """
+        return self._scheduler
             
 #endregion
\ No newline at end of file
@@ -6,7 +6,9 @@ that updates the logs and texts.
 """
 # Standard imports
 import os
+import re
 import math
+import threading
 from datetime import datetime
 
 # Third parties
@@ -14,8 +16,11 @@ import wx
 import wx.stc as stc
 
 # Internal imports
-from dongle.utils.file_manager import Opener
+from dongle.utils.file_manager import Opener, Saver
+from dongle.utils.config import ConfigCache
 from dongle.utils.trace import Trace
+from dongle.utils.log_store import LogStore
+from dongle.utils.overload import OverloadMonitor
 import dongle.utils.events as ev
 
 class BasicUI:
@@ -32,7 +37,10 @@ class BasicUI:
 #region Variables
     # Utilities
     _fOpener = Opener()
+    _fSaver = Saver()
+    _configCache = ConfigCache()
     _confFile = ""
+    _confKind = None
     _window = None
     _conf = None
     _dataPath = os.path.abspath(os.path.join(os.path.dirname( __file__ ),
@@ -57,6 +65,26 @@ class BasicUI:
     # Checkboxes
     _traceType: wx.CheckBox = None
     
+    # Log search and filter
+    _logStore: LogStore = None
+    _searchSizer: wx.BoxSizer = None
+    _regexCtrl: wx.TextCtrl = None
+    _commandFilterCtrl: wx.TextCtrl = None
+    _directionChoice: wx.Choice = None
+    _fromCtrl: wx.TextCtrl = None
+    _toCtrl: wx.TextCtrl = None
+    _filterCtrl: wx.TextCtrl = None
+    _searchId = 0
+    _searchBatch = 500
+    _directions = ["All", "In", "Out", "System"]
+    
+    # Overload mode of the log
+    _overload: OverloadMonitor = None
+    _overloadCtrl: wx.TextCtrl = None
+    _overloadTimer: wx.Timer = None
+    # File where the lines are written while overloaded
+    _overloadFile = None
+    
     # Current trace
     _currTrace: Trace = None
     
@@ -72,7 +100,8 @@ class BasicUI:
         self._window = mainWin
         
         # First open configuration file
-        self._conf = self._fOpener.OpenJSONFile(self._dataPath, self._confFile)
+        self._conf = self._configCache.Load(self._dataPath, self._confFile, 
+                                            self._confKind)
         
         # Create UI
         self._mainPanel = wx.Panel(mainWin, wx.ID_ANY, pos=(x, y), 
@@ -82,21 +111,128 @@ class BasicUI:
         # Create Trace Data
         self._currTrace = Trace("", "", [], [])
         
-    def __write_line(self, newLine):
+        # Create the indexed store of the log, with the max 
+        # lines kept in memory
+        self._logStore = LogStore(self._conf["log"].get("capacity"))
+        self._overload = OverloadMonitor()
+        
+    def __write_line(self, newLine, direction="system", kind="system", 
+                     command=None, params=None, raw=None, t=None, 
+                     arrival=None):
         """
         This function writes a line into the log
-        TextCtrl.
+        TextCtrl and stores it, with its data, in 
+        the log store used for searching.
         
         First prepares the text to write it in the
         correct color. Then writes it. (Not implemented yet)
 
         Args:
             line (str): Line to write on the log.
+            direction (str, optional): "in", "out" or "system".
+            kind (str, optional): Type of line.
+            command (str, optional): Command name.
+            params (list, optional): Command parameters.
+            raw (bytes, optional): Frame bytes.
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+            arrival (int, optional): Epoch timestamp (ns) of the 
+                                     arrival of a live frame, to 
+                                     measure the backlog of the log.
         """
+        self._logStore.Append(newLine, direction, kind, command, params, raw,
+                              t)
+        if not self._overload.Line(newLine, kind, arrival):
+            if self._overloadCtrl is not None \
+                    and self._logCtrl.IsShown():
+                self.__enter_overload()
+            if self._overloadFile is not None:
+                self._overloadFile.write(newLine)
+            return
         #self._logCtrl.SetReadOnly(False)
         self._logCtrl.write(newLine)
         #self._logCtrl.SetReadOnly(True)
         self._logCtrl.ScrollLines(1)
+    
+    def __enter_overload(self):
+        """
+        Stops rendering the lines in the log: it's replaced
+        by the rate counters and a sampled tail of the lines,
+        refreshed by a timer. The lines are still stored, and 
+        written to a file in the saving folder until the log 
+        comes back.
+        """
+        path = self._fSaver.GetOverloadLog()
+        try:
+            self._overloadFile = open(path, "a", encoding="utf-8")
+            where = " Lines are written to " + path + "\n"
+        except OSError as e:
+            self._overloadFile = None
+            where = " They can't be written to disk: " + str(e) + "\n"
+        self._logCtrl.write("[System] Too many lines to show, the log is "
+                            "paused." + where)
+        self._logCtrl.ScrollLines(1)
+        self._logCtrl.Hide()
+        self._overloadCtrl.Show()
+        self._logSizer.Layout()
+        self.__show_overload()
+        self._overloadTimer.Start(int(self._overload.refresh * 1000))
+    
+    def __leave_overload(self):
+        """
+        Shows the log again, with a line with the number
+        of lines that weren't rendered.
+        """
+        self._overloadTimer.Stop()
+        self._overloadCtrl.Hide()
+        self._logCtrl.Show()
+        self._logSizer.Layout()
+        where = ""
+        if self._overloadFile is not None:
+            where = ", written to " + self._overloadFile.name
+            self._overloadFile.close()
+            self._overloadFile = None
+        self.__write_line("[System] Log resumed, " 
+                          + str(self._overload.GetPending()) 
+                          + " lines were not shown" + where + ".\n")
+    
+    def __show_overload(self):
+        """
+        Writes the counters and the tail of the overload mode.
+        """
+        stats = self._overload.GetStats()
+        kinds = ", ".join("{0} {1:.0f}/s".format(kind, rate) 
+                          for kind, rate in sorted(stats["kinds"].items()))
+        text = ("Overloaded: {0:.0f} lines/s ({1}), backlog {2:.2f} s, "
+                "{3} lines not shown\n\nLast lines:\n").format(
+                    stats["rate"], kinds or "-", stats["lag"], 
+                    stats["pending"])
+        self._overloadCtrl.SetValue(text + "".join(self._overload.GetTail()))
+    
+    def OnOverloadTimer(self, event):
+        """
+        Refreshes the overload mode, and leaves it when
+        the load dropped.
+
+        Args:
+            event (EVT_TIMER): Timer event
+        """
+        if self._overload.Update():
+            self.__leave_overload()
+        else:
+            self.__show_overload()
+            if self._overloadFile is not None:
+                self._overloadFile.flush()
+        
+    def _apply_configuration(self, conf):
+        """
+        Applies a configuration reloaded while the app is 
+        running. May be overwritten by the different UIs to 
+        update the elements created from the configuration.
+
+        Args:
+            conf (CompiledConfig): New configuration
+        """
+        pass
 #endregion  
    
 #region UI
@@ -190,6 +326,17 @@ class BasicUI:
                                            name=stc.STCNameStr)
         #self._logCtrl.SetReadOnly(True)
         self._logSizer.Add(self._logCtrl, proportion=1, flag=wx.EXPAND)
+        
+        # Counters and tail shown instead while overloaded
+        self._overload.Configure(logData.get("overload"))
+        self._overloadCtrl = wx.TextCtrl(self._mainPanel, wx.ID_ANY, 
+                                         style=wx.TE_READONLY 
+                                         | wx.TE_MULTILINE)
+        self._logSizer.Add(self._overloadCtrl, proportion=1, flag=wx.EXPAND)
+        self._overloadCtrl.Hide()
+        self._overloadTimer = wx.Timer(self._mainPanel)
+        self._mainPanel.Bind(wx.EVT_TIMER, self.OnOverloadTimer, 
+                             self._overloadTimer)
         self._mainSizer.Add(self._logSizer, 
                             proportion=1, 
                             flag=wx.LEFT | wx.RIGHT | wx.EXPAND, 
@@ -197,6 +344,67 @@ class BasicUI:
         # Add some space at the end
         self._mainSizer.Add((-1, 10))  
     
+    def _create_search(self, searchData):
+        """
+        Function that creates the search bar of the log, 
+        with the different filters (regular expression, 
+        command, direction and time range) and the view
+        that shows the filtered lines.
+
+        Args:
+            searchData (hashmap): Decoded data from a JSON.
+        """
+        self._searchBatch = searchData.get("batch", self._searchBatch)
+        
+        # Add title text
+        tBox = wx.BoxSizer(wx.HORIZONTAL)
+        text = wx.StaticText(self._mainPanel, label='Search')
+        tBox.Add(text)
+        self._mainSizer.Add(tBox, flag=wx.LEFT | wx.TOP, 
+                            border=searchData["padding"])
+        self._mainSizer.Add((-1, 5))
+        
+        # Filters
+        self._searchSizer = wx.BoxSizer(wx.HORIZONTAL)
+        self._regexCtrl = wx.TextCtrl(self._mainPanel, wx.ID_ANY, "")
+        self._regexCtrl.SetHint("Regex")
+        self._commandFilterCtrl = wx.TextCtrl(self._mainPanel, wx.ID_ANY, "")
+        self._commandFilterCtrl.SetHint("Command")
+        self._directionChoice = wx.Choice(self._mainPanel, 
+                                          choices=self._directions)
+        self._directionChoice.SetSelection(0)
+        self._fromCtrl = wx.TextCtrl(self._mainPanel, wx.ID_ANY, "")
+        self._fromCtrl.SetHint("From HH:MM:SS")
+        self._toCtrl = wx.TextCtrl(self._mainPanel, wx.ID_ANY, "")
+        self._toCtrl.SetHint("To HH:MM:SS")
+        
+        filterButton = wx.Button(self._mainPanel, label="FILTER")
+        self._window.Bind(wx.EVT_BUTTON, self.OnFilter, filterButton)
+        exportButton = wx.Button(self._mainPanel, label="EXPORT")
+        self._window.Bind(wx.EVT_BUTTON, self._window.OnSaveFilteredAs, 
+                          exportButton)
+        
+        self._searchSizer.Add(self._regexCtrl, proportion=1)
+        for ctrl in [self._commandFilterCtrl, self._directionChoice, 
+                     self._fromCtrl, self._toCtrl, filterButton, 
+                     exportButton]:
+            self._searchSizer.Add(ctrl, flag=wx.LEFT, border=5)
+        self._mainSizer.Add(self._searchSizer, 
+                            flag=wx.RIGHT | wx.LEFT | wx.EXPAND, 
+                            border=searchData["padding"])
+        self._mainSizer.Add((-1, 5))
+        
+        # Filtered view
+        self._filterCtrl = wx.TextCtrl(self._mainPanel, 
+                                       wx.ID_ANY, 
+                                       style=wx.TE_READONLY 
+                                       | wx.TE_MULTILINE | wx.TE_RICH)
+        self._mainSizer.Add(self._filterCtrl, 
+                            proportion=1, 
+                            flag=wx.LEFT | wx.RIGHT | wx.EXPAND, 
+                            border=searchData["padding"])
+        self._mainSizer.Add((-1, 10))
+    
     #------------------------------------------------
     #------------------UI Creation-------------------
     #------------------------------------------------
@@ -231,10 +439,15 @@ class BasicUI:
                             + " (Params): " + self._currTrace.GetParams() 
                             + "                     " 
                             + instant.strftime("%Y-%M-%D %H:%M:%S") 
-                            + "\n") 
+                            + "\n", 
+                            "out", "command", 
+                            self._currTrace.GetCommand(), 
+                            text.split(";")) 
         self._window.WriteDevice(self._currTrace)
         
-    def OnResponse(self, newLine):
+    def OnResponse(self, newLine, direction="system", kind="system", 
+                   command=None, params=None, raw=None, t=None, 
+                   arrival=None):
         """
         Method called when some response is received from 
         the device. Writes the new response into the response
@@ -246,8 +459,44 @@ class BasicUI:
 
         Args:
             data (str/bytes): Data to write, bytes not supported yet
+            direction (str, optional): "in", "out" or "system".
+            kind (str, optional): Type of line.
+            command (str, optional): Command name.
+            params (list, optional): Command parameters.
+            raw (bytes, optional): Frame bytes.
+            t (int, optional): Epoch timestamp (ns) of the line (the
+                               arrival of its frame). Defaults to now.
+            arrival (int, optional): Epoch timestamp (ns) of the 
+                                     arrival of the frame, only for
+                                     live frames (not for query 
+                                     results or summaries).
         """       
-        self.__write_line(newLine)    
+        self.__write_line(newLine, direction, kind, command, params, raw, t,
+                          arrival)
+    
+    def OnFilter(self, event):
+        """
+        Function called when the user filters the log. Reads
+        the filters and searches the log store in a thread,
+        showing the results in the filtered view as they are
+        found. A new search cancels the previous one.
+
+        Args:
+            event (EVT_BUTTON): Filter button event.
+        """
+        self._searchId += 1
+        self._filterCtrl.Clear()
+        
+        try:
+            filters = self.__read_filters()
+        except ValueError as e:
+            self._filterCtrl.AppendText("Wrong filter: " + str(e) + "\n")
+            return
+        
+        threading.Thread(name="Log search", 
+                         target=self.__search_log, 
+                         args=(self._searchId, filters), 
+                         daemon=True).start()
         
     #------------------------------------------------
     #----------------Event Handling------------------
@@ -259,32 +508,103 @@ class BasicUI:
     #-----------------Data Handling------------------
     #------------------------------------------------
 
-    def AutoSendCommand(self):
+    def ReloadConfiguration(self):
+        """Hot reload of the UI configuration.
+
+        Checks if the configuration file of this UI changed 
+        and, if so, compiles it again and applies it.
+        """
+        new = self._configCache.Reload(self._conf)
+        if new:
+            self._conf = new
+            self._overload.Configure(new["log"].get("overload"))
+            self._apply_configuration(new)
+            self.__write_line("[System] Configuration reloaded: " 
+                              + new.path + "\n")
+
+    def __read_time(self, ctrl):
+        """
+        Reads a time filter. Accepts "HH:MM[:SS]" for today 
+        or "YYYY-mm-dd HH:MM:SS".
+
+        Returns:
+            int: Epoch timestamp (ns) or None if empty
+        """
+        text = ctrl.GetValue().strip()
+        if not text:
+            return None
+        
+        for fmt in ["%H:%M:%S", "%H:%M", "%Y-%m-%d %H:%M:%S"]:
+            try:
+                t = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            if t.year == 1900:
+                t = datetime.combine(datetime.now().date(), t.time())
+            return int(t.timestamp()) * 10**9
+        
+        raise ValueError("time " + text)
+        
+    def __read_filters(self):
+        """
+        Reads the values of the search bar.
+
+        Returns:
+            dict: Filters for LogStore.Query
+        """
+        direction = self._directionChoice.GetSelection()
+        regex = self._regexCtrl.GetValue()
+        if regex:
+            # Check the expression before searching
+            try:
+                re.compile(regex)
+            except re.error as e:
+                raise ValueError("expression " + str(e))
+        
+        return {
+            "regex": regex or None,
+            "command": self._commandFilterCtrl.GetValue().strip() or None,
+            "direction": (self._directions[direction].lower() 
+                          if direction > 0 else None),
+            "start": self.__read_time(self._fromCtrl),
+            "end": self.__read_time(self._toCtrl),
+            "batch": self._searchBatch
+        }
+    
+    def __search_log(self, searchId, filters):
+        """
+        Search thread. Sends each batch of results to the
+        GUI thread, stops when a new search begins.
+        """
+        for batch in self._logStore.Query(**filters):
+            if searchId != self._searchId:
+                return
+            wx.CallAfter(self.__show_results, searchId, 
+                         "".join(r.text for r in batch))
+    
+    def __show_results(self, searchId, text):
+        if searchId == self._searchId:
+            self._filterCtrl.AppendText(text)
+
+    def AutoSendCommand(self, frame):
         """Auto-sending a command. 
 
         This function sends a command directly to the dongle, without
-        updating the input log and all. Creates the different parameters 
-        needed and sends it. 
-        """
-        if self._currTrace.GetCommand() == "REBOOT":
-            instant = datetime.now()
-            self._currTrace.SetParameters(None)
-            self._currTrace.SetIsString(False)
-            self._currTrace.SetTimeStamp(datetime.timestamp(instant))       
-            self.__write_line("[Out]: " + self._currTrace.GetCommand() 
-                                + "                     " 
-                                + instant.strftime("%Y-%M-%D %H:%M:%S") 
-                                + "\n")  
-        else:
-            instant = datetime.now()
-            self._currTrace.SetIsString(True)
-            self._currTrace.SetTimeStamp(datetime.timestamp(instant))       
-            self.__write_line("[Out]: " + self._currTrace.GetCommand() 
-                              + "                     " 
-                              + instant.strftime("%Y-%M-%D %H:%M:%S") 
-                              + "\n")
+        updating the input log and all. The frame was encoded when the
+        configuration was loaded, only the timestamp is patched in.
 
-        self._window.WriteDevice(self._currTrace)
+        Args:
+            frame (FrameTemplate): Pre-encoded frame of the command
+        """
+        instant = datetime.now()
+        data = frame.Stamp(datetime.timestamp(instant))
+        self._window.WriteFrame(data)
+        
+        line = ("[Out]: " + frame.command 
+                + "                     " 
+                + instant.strftime("%Y-%M-%D %H:%M:%S") 
+                + "\n")
+        self.__write_line(line, "out", "command", frame.command, raw=data)
     
     def ClearLog(self):
         """Clearing log method.
@@ -293,6 +613,7 @@ class BasicUI:
         to " " and updates. 
         """
         self._logCtrl.Remove(0, self._logCtrl.GetLastPosition())
+        self._logStore.Clear()
     
     def LoadLog(self, data):
         """Load Log with data
@@ -305,28 +626,64 @@ class BasicUI:
         """
         self.ClearLog()
         self._logCtrl.LoadFile(data)
+        
+        # Index the loaded lines for searching
+        with open(data, 'r') as log:
+            for line in log:
+                self._logStore.AppendLine(line)
+    
+    def GetFilteredData(self):
+        """Get data from the filtered view.
+
+        Returns:
+            str: Text of the lines that matched the last search.
+        """
+        return self._filterCtrl.GetValue()
+    
+    def GetLogStats(self):
+        """Get the stats of the log store.
+
+        Returns:
+            dict: Lines kept and dropped (LogStore.GetStats)
+        """
+        return self._logStore.GetStats()
+    
+    def GetLogRecords(self, batch=65536):
+        """Get the records of the log.
+
+        Returns the records stored for every line of the log,
+        with their time, direction, command, parameters and bytes.
+
+        Args:
+            batch (int, optional): Records per batch. Defaults to 65536.
+
+        Yields:
+            list: Records of the log, in order
+        """
+        return self._logStore.Query(batch=batch)
     
     def GetLogData(self):
         """Get data from the log.
 
-        This method gets all text that is currently in the log and then
-        returns it as a string list. 
+        This method gets all text written in the log and then
+        returns it as a string list. It's taken from the log 
+        store, so it includes the lines that weren't shown while 
+        the log was overloaded. If the store was full and dropped 
+        its oldest lines, the first line says how many.
 
         Returns:
             List(str): List with all the text lines in the log.
         """
-        # String list
-        strings = []
-        
-        # Total number of lines in log
-        total = self._logCtrl.GetNumberOfLines()
-        
-        # Read all lines
-        for i in range(total):
-            strings.append(self._logCtrl.GetLineText(i) + "\n")
-        
-        # Return lines
-        return strings
+        lines = []
+        stats = self._logStore.GetStats()
+        if stats["dropped"]:
+            lines.append("[System] %d older lines were dropped, the log "
+                         "keeps the last %d lines (log.capacity)\n" 
+                         % (stats["dropped"], stats["size"]))
+        lines.extend(record.text 
+                     for batch in self._logStore.Query(batch=65536)
+                     for record in batch)
+        return lines
     
     #------------------------------------------------
     #-----------------Data Handling------------------
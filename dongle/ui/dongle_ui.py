@@ -14,6 +14,7 @@ import wx.stc as stc
 
 # Internal imports
 import dongle.ui.basic_ui as bUI
+from dongle.utils.config import UIConfig
 
 class Dongle(bUI.BasicUI):
     """
@@ -38,6 +39,10 @@ class Dongle(bUI.BasicUI):
     _imgH, _imgW = None, None
     _refSize: wx.Size = None
     _sizerRefW, _sizerRefH = None, None
+    
+    # Buttons and ids of the repeating commands (by button index)
+    _buttons = None
+    _repeats = None
 #endregion
     
 #region Construction
@@ -62,7 +67,10 @@ class Dongle(bUI.BasicUI):
             h (int): Height of the Sizer.
         """
         self._confFile = "dongle_ui.json"
+        self._confKind = UIConfig
         super().__init__(mainWin, x, y, w, h)
+        self._buttons = []
+        self._repeats = {}
 
         # Create connection status data
         
@@ -75,21 +83,13 @@ class Dongle(bUI.BasicUI):
                             border=self._conf["input"]["padding"])
         self._mainSizer.Add((-1, 5))
 
-        cols = None 
-        rows = None
-        
-        if len(self._conf["buttons"]) < self._conf["buttonsPerRaw"]:
-            cols = len(self._conf["buttons"])
-            rows = 1
-        else:
-            cols = self._conf["buttonsPerRaw"]
-            rows = math.ceil(len(self._conf["buttons"]) / cols)
+        rows, cols = self.__grid_size(self._conf.buttons)
 
         self._buttonSizer = wx.BoxSizer(wx.HORIZONTAL)
 
         self._buttonGrid = wx.GridSizer(rows, cols, self._conf["verticalGap"], 
                                         self._conf["horizontalGap"])
-        self.__place_buttons(self._conf["buttonsSize"], self._conf["buttons"])
+        self.__place_buttons(self._conf["buttonsSize"], self._conf.buttons)
         
         # Sizers generales
         self._buttonSizer.Add(self._buttonGrid, 
@@ -117,44 +117,101 @@ class Dongle(bUI.BasicUI):
         # Create output console and log box
         self._create_log(self._conf["log"])
         
+        # Create search bar and filtered view of the log
+        self._create_search(self._conf["search"])
+        
         # Add BoxSizer to panel
         #self._mainPanel.SetSizer(self._mainSizer)
         self._mainPanel.SetSizerAndFit(self._mainSizer)
         # self.OnResize(None)
         
+    def __grid_size(self, buttons):
+        """
+        Calculates the rows and columns of the button grid.
+
+        Args:
+            buttons (list): List with all the buttons
+
+        Returns:
+            tuple: Rows and columns
+        """
+        if len(buttons) < self._conf["buttonsPerRaw"]:
+            return 1, len(buttons)
+
+        cols = self._conf["buttonsPerRaw"]
+        return math.ceil(len(buttons) / cols), cols
+
     def __place_buttons(self, bSize, buttons):
         """
         This function instantiates all buttons into the 
         buttonGrid that represents the command sending event.
         
         Sets the label defines in the JSON file and then binds
-        it to an event to make visual changes. 
+        it to an event to make visual changes. Buttons are bound
+        by their index, so a reloaded configuration is used
+        without binding them again.
 
         Args:
-            buttons (list): List with all the buttons to
+            buttons (list): List with all the compiled buttons to
             instantiate.
         """
-        for b in buttons: 
+        for i, b in enumerate(buttons): 
             # First instantiate a new button           
             nButton = wx.Button(self._mainPanel, label=b["txt"], 
                                 size=(bSize["w"], bSize["h"]))
             
-            # Set if the command is auto send
-            if b["auto"] == 1:
-                sendData = [True, b["command"], b["byte"], b["param"]]
-            else:
-                sendData = [False, b["command"], b["byte"]]
+            self._buttons.append(nButton)
             
             # Bind it 
             self._window.Bind(wx.EVT_BUTTON, 
                               lambda evt, 
-                              temp=sendData: self.OnCommandButtonClick(evt, temp),
+                              temp=i: self.OnCommandButtonClick(evt, temp),
                               nButton)
             
             # And add it to the Grid
             self._buttonGrid.Add(nButton, 0, 
                                  wx.LEFT | wx.RIGHT | wx.SHAPED, 5)
 
+    def _apply_configuration(self, conf):
+        """
+        Places the buttons again with the reloaded 
+        configuration.
+
+        Args:
+            conf (UIConfig): New configuration
+        """
+        self.StopRepeats()
+        self._buttons = []
+        self._buttonGrid.Clear(delete_windows=True)
+        rows, cols = self.__grid_size(conf.buttons)
+        self._buttonGrid.SetRows(rows)
+        self._buttonGrid.SetCols(cols)
+        self.__place_buttons(conf["buttonsSize"], conf.buttons)
+        self._mainPanel.Layout()
+
+    def __toggle_repeat(self, index, button):
+        """
+        Starts or stops repeating the command of a button
+        every "repeat" milliseconds. The command is sent by
+        the TX scheduler of the device, so the GUI doesn't 
+        add jitter.
+
+        Args:
+            index (int): Index of the button
+            button (dict): Compiled button
+        """
+        repeat = self._repeats.pop(index, None)
+        if repeat is not None:
+            self._window.CancelRepeat(repeat)
+            self._buttons[index].SetLabel(button["txt"])
+            return
+        
+        repeat = self._window.ScheduleRepeat(button["frame"], 
+                                             button["repeat"] / 1000.0)
+        if repeat is not None:
+            self._repeats[index] = repeat
+            self._buttons[index].SetLabel(button["txt"] + " (on)")
+
     #------------------------------------------------
     #--------------------Private---------------------
     #------------------------------------------------
@@ -165,7 +222,18 @@ class Dongle(bUI.BasicUI):
     #----------------Event Handling------------------
     #------------------------------------------------            
     
-    def OnCommandButtonClick(self, event, data):
+    def StopRepeats(self):
+        """
+        Stops all the commands that are being repeated.
+        """
+        for index, repeat in self._repeats.items():
+            self._window.CancelRepeat(repeat)
+            if index < len(self._buttons):
+                self._buttons[index].SetLabel(
+                    self._conf.buttons[index]["txt"])
+        self._repeats.clear()
+    
+    def OnCommandButtonClick(self, event, index):
         """
         This function is called when a button is pressed and 
         selected. Notifies the different elemments of the UI
@@ -173,22 +241,26 @@ class Dongle(bUI.BasicUI):
 
         Args:
             event (wxEvent): Event 
-            data (list): List containing the command and byte code
+            index (int): Index of the button in the configuration
         """
         # For the moment this function is still here but can be moved 
         # to other class
-        # Update current trace data
-        self._currTrace.SetCommand(data[1])
-        self._currTrace.SetCommandCode(bytes.fromhex(data[2]))
-
-        if data[0]:
-            # Auto send is on
-            self._currTrace.SetParameters(data[3])
-            self.AutoSendCommand()
+        button = self._conf.buttons[index]
+
+        if button["auto"]:
+            # Auto send is on, the frame is already encoded
+            if button["repeat"]:
+                self.__toggle_repeat(index, button)
+            else:
+                self.AutoSendCommand(button["frame"])
         else:        
+            # Update current trace data
+            self._currTrace.SetCommand(button["command"])
+            self._currTrace.SetCommandCode(button["code"])
+            
             # Modify the input terminal.
             self._commandNameCtrl.SetValue("")
-            self._commandNameCtrl.SetValue(data[1])
+            self._commandNameCtrl.SetValue(button["command"])
             
             self._commandParamsCtrl.SetValue("")
             self._traceType.SetValue(wx.CheckBoxState(wx.CHK_CHECKED))
@@ -0,0 +1,133 @@
+"""Binary view UI file.
+
+This file contains the class HexFrame, a window that lists the binary
+frames received with their fields and their hex/ASCII dump. The list is
+virtual: it only asks for the rows on screen, so thousands of frames
+per second don't add work to the GUI besides updating the row count,
+done at a fixed rate by a wx.Timer.
+"""
+# Third parties
+import wx
+
+# Internal imports
+from dongle.utils.hexdump import HexDump, hex_dump
+
+class _HexList(wx.ListCtrl):
+    """
+    Virtual list of the frames of a HexDump.
+    """
+    _dump: HexDump = None
+
+    def __init__(self, parent, dump):
+        wx.ListCtrl.__init__(self, parent,
+                             style=wx.LC_REPORT | wx.LC_VIRTUAL
+                             | wx.LC_SINGLE_SEL)
+        self._dump = dump
+        for i, (name, width) in enumerate(zip(HexDump.COLUMNS,
+                                              (110, 40, 260, 420, 160))):
+            self.InsertColumn(i, name, width=width)
+        self.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL,
+                             wx.FONTWEIGHT_NORMAL))
+
+    def OnGetItemText(self, item, column):
+        return self._dump.GetText(item, column)
+
+class HexFrame(wx.Frame):
+    """
+    Window with the binary frames received. The list
+    follows the last frame unless "Follow" is unchecked,
+    and the selected frame is shown as a full dump.
+
+    Args:
+        wx (wx.Frame): Inherits from wx.Frame
+    """
+#region Variables
+    _dump: HexDump = None
+    _list: _HexList = None
+    _detail: wx.TextCtrl = None
+    _follow: wx.CheckBox = None
+    _timer: wx.Timer = None
+    _fps = 10
+
+    # Frames appended to the dump at the last refresh
+    _total = 0
+#endregion
+
+    def __init__(self, parent, dump):
+        """
+        Args:
+            parent (wx.Frame): Main frame of the App
+            dump (HexDump): Frames to show
+        """
+        wx.Frame.__init__(self, parent, title="Binary Frames",
+                          size=(1050, 650))
+        self._dump = dump
+
+        panel = wx.Panel(self)
+        self._list = _HexList(panel, dump)
+        self._list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnSelect)
+
+        self._detail = wx.TextCtrl(panel, style=wx.TE_MULTILINE
+                                   | wx.TE_READONLY, size=(-1, 150))
+        self._detail.SetFont(self._list.GetFont())
+
+        self._follow = wx.CheckBox(panel, label="Follow")
+        self._follow.SetValue(True)
+        clear = wx.Button(panel, label="Clear")
+        clear.Bind(wx.EVT_BUTTON, self.OnClear)
+
+        buttons = wx.BoxSizer(wx.HORIZONTAL)
+        buttons.Add(self._follow, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        buttons.Add(clear, 0, wx.ALL, 5)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self._list, 1, wx.EXPAND | wx.ALL, 5)
+        sizer.Add(self._detail, 0, wx.EXPAND | wx.ALL, 5)
+        sizer.Add(buttons, 0)
+        panel.SetSizer(sizer)
+
+        self._timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer, self._timer)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+        self._timer.Start(int(1000 / self._fps))
+
+        self.Show()
+
+#region Events
+    def OnTimer(self, event):
+        total = self._dump.GetTotal()
+        if total == self._total:
+            return
+
+        # When the dump is full, the rows move up
+        self._total = total
+        count = len(self._dump)
+        self._list.SetItemCount(count)
+        if count and self._follow.GetValue():
+            self._list.EnsureVisible(count - 1)
+        self._list.Refresh(False)
+
+    def OnSelect(self, event):
+        """
+        Shows the full dump of the selected frame.
+
+        Args:
+            event (EVT_LIST_ITEM_SELECTED): Selection event
+        """
+        self._follow.SetValue(False)
+        time, direction, fields, hexs, _ = self._dump.GetRow(event.GetIndex())
+        data = bytes.fromhex(hexs)
+        self._detail.SetValue("{0} {1} {2}\n{3}".format(time, direction,
+                                                        fields,
+                                                        hex_dump(data)))
+
+    def OnClear(self, event):
+        self._dump.Clear()
+        self._total = self._dump.GetTotal()
+        self._list.SetItemCount(0)
+        self._detail.Clear()
+
+    def OnClose(self, event):
+        self._timer.Stop()
+        self.Destroy()
+#endregion
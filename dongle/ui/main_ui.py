@@ -7,6 +7,9 @@ needed and notifying events.
 """
 # Standard imports
 import os
+import time
+import sqlite3
+import threading
 from datetime import datetime
 import webbrowser
 import platform
@@ -17,11 +20,24 @@ import wx.adv
 
 # Internal imports
 from dongle.device import Device
+from dongle.worker import open_device
+from dongle.bridge import Bridge
 from dongle.utils.file_manager import Saver
 from dongle.utils.file_manager import Opener
+from dongle.utils.config import ConfigCache, AppConfig, ProtocolConfig
+from dongle.utils.telemetry import Telemetry
+from dongle.utils.replay import ReplayPort
+from dongle.utils.export import SessionExporter
+from dongle.utils.merge import write_merged
+from dongle.utils.session_db import SessionDB, parse_query
+from dongle.utils.latency import LatencyTracer, to_epoch, report
+from dongle.utils.hexdump import HexDump, describe
+from dongle.utils.frames import FrameDecoder
 from dongle.utils.trace import Trace
 import dongle.utils.events as ev
 import dongle.ui.dongle_ui as dng
+from dongle.ui.plot_ui import PlotFrame
+from dongle.ui.hex_ui import HexFrame
 
 class MainFrame(wx.Frame):
     """
@@ -57,13 +73,39 @@ class MainFrame(wx.Frame):
     # USB Device instance
     _deviceInstance: Device = None
     
+    # (port, serial number) of the last device, searched first
+    _lastDevice = None
+    
+    # Bridge sharing the device with other programs
+    _bridge: Bridge = None
+    
+    # Telemetry extracted from the frames and its plot
+    _telemetry: Telemetry = None
+    
+    # Latency of the frames received, from the port to the log
+    _latency: LatencyTracer = None
+    _plotFrame: PlotFrame = None
+    
+    # Binary frames received and their view
+    _hexDump: HexDump = None
+    _hexFrame: HexFrame = None
+    _decoder = FrameDecoder()
+    
     # Utilities
     _fileOpener = Opener()
     _fileSaver = Saver()
+    _configCache = ConfigCache()
     
     # App info
     _appInfo = None
     _devices = None
+    
+    # Codecs of the commands ("protocol.json")
+    _protocol: ProtocolConfig = None
+    
+    # Configuration hot reload
+    _reloadTimer: wx.Timer = None
+    _reloadInterval = 2000
 
 #endregion   
 
@@ -74,9 +116,14 @@ class MainFrame(wx.Frame):
     #------------------------------------------------
     
     def __init__(self, parent, path, filename):
-        file = self._fileOpener.OpenJSONFile(path, filename)
-        
-        self._devices = file["devices"]
+        file = self._configCache.Load(path, filename, AppConfig)
+        
+        self._devices = file
+        self._protocol = self._configCache.Load(path, "data/cnf/protocol.json", 
+                                                ProtocolConfig)
+        self._telemetry = Telemetry(file.telemetry)
+        self._latency = LatencyTracer()
+        self._hexDump = HexDump()
         urls = file["urls"]
         self._appInfo = file["info"]
         
@@ -96,7 +143,9 @@ class MainFrame(wx.Frame):
         # Try to connect to a device
         # This is done first to activate some options
         # of the menus
-        self._deviceInstance = Device(self._devices, self)
+        self._deviceInstance = open_device(self._devices, self, 
+                                           self._telemetry, 
+                                           protocol=self._protocol.protocol)
         if not self._deviceInstance.is_connected():
             self._deviceInstance = None
             
@@ -109,6 +158,7 @@ class MainFrame(wx.Frame):
         self._currentUI = dng.Dongle(self, 0, 0, 200, 200)
         
         self.__bind_handlers()
+        self.__start_recording()
         
         self._statusBar = self.CreateStatusBar(2)
         self._statusBar.SetStatusText(" ", 0)
@@ -125,6 +175,11 @@ class MainFrame(wx.Frame):
         icon.CopyFromBitmap(wx.Bitmap(icoPath, wx.BITMAP_TYPE_ANY))
         self.SetIcon(icon)
 
+        # Check periodically if configuration files changed
+        self._reloadTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnReloadConfiguration, self._reloadTimer)
+        self._reloadTimer.Start(self._reloadInterval)
+
         splash.Show()
         self.Show()
         self.Maximize(True)
@@ -177,6 +232,19 @@ class MainFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.OnUserDisconnect, devDisconnect)
         self._deviceMenu.AppendSeparator()
         
+        devShare = self._deviceMenu.Append(wx.ID_ANY, 
+                                           "&Share Device", 
+                                           "Shares the connected device with" 
+                                           + " other programs through a" 
+                                           + " local socket")
+        self.Bind(wx.EVT_MENU, self.OnShareDevice, devShare)
+        
+        devUnshare = self._deviceMenu.Append(wx.ID_ANY, 
+                                             "S&top Sharing", 
+                                             "Stops sharing the device")
+        self.Bind(wx.EVT_MENU, self.OnStopSharing, devUnshare)
+        self._deviceMenu.AppendSeparator()
+        
         devInfo = self._deviceMenu.Append(wx.ID_ANY, 
                                           "&Info.", 
                                           "Shows information about the" 
@@ -248,14 +316,51 @@ class MainFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.OnInfo, infoButton)
         
     def __create_view_menu(self):
-        """Not yet implemented
-
-        This method is in charge to create the menu bar option "View".
-
-        Returns:
-            [type]: [description]
         """
-        return 0
+        This method is in charge to create the menu bar option "View",
+        with the windows that show the data received in other ways.
+        """
+        plotView = self._viewMenu.Append(wx.ID_ANY, 
+                                         "&Telemetry Plot", 
+                                         "Plots live the values received" 
+                                         + " from the device")
+        self.Bind(wx.EVT_MENU, self.OnPlot, plotView)
+        
+        binaryView = self._viewMenu.Append(wx.ID_ANY, 
+                                           "&Binary Frames", 
+                                           "Shows the binary frames" 
+                                           + " received as hex dumps")
+        self.Bind(wx.EVT_MENU, self.OnBinaryView, binaryView)
+        
+        txView = self._viewMenu.Append(wx.ID_ANY, 
+                                       "TX &Statistics", 
+                                       "Shows the frames queued, delayed" 
+                                       + " and the airtime used")
+        self.Bind(wx.EVT_MENU, self.OnTxStatistics, txView)
+        
+        latencyView = self._viewMenu.Append(wx.ID_ANY, 
+                                            "&Latency", 
+                                            "Shows where the time of the" 
+                                            + " frames received goes")
+        self.Bind(wx.EVT_MENU, self.OnLatency, latencyView)
+        
+        clockView = self._viewMenu.Append(wx.ID_ANY, 
+                                          "Device &Clock", 
+                                          "Shows the offset and drift of the" 
+                                          + " clock of the device")
+        self.Bind(wx.EVT_MENU, self.OnDeviceClock, clockView)
+        
+        repeatView = self._viewMenu.Append(wx.ID_ANY, 
+                                           "&Repeated Frames", 
+                                           "Shows the repeated frames" 
+                                           + " collapsed by the aggregation")
+        self.Bind(wx.EVT_MENU, self.OnAggregation, repeatView)
+        
+        queueView = self._viewMenu.Append(wx.ID_ANY, 
+                                          "&Queues", 
+                                          "Shows the frames waiting and" 
+                                          + " dropped by each consumer")
+        self.Bind(wx.EVT_MENU, self.OnQueues, queueView)
         
     def __create_file_menu(self):
         """Create file menu
@@ -284,6 +389,64 @@ class MainFrame(wx.Frame):
                                            + "specified location")
         self.Bind(wx.EVT_MENU, self.OnSaveAs, logAsSaver)
         
+        # Create, add and bind "Save Filtered As" option
+        filteredSaver = self._fileMenu.Append(wx.ID_ANY, 
+                                              "Save &Filtered Log As...", 
+                                              "Saves the lines of the last" 
+                                              + " search into a specified" 
+                                              + " location")
+        self.Bind(wx.EVT_MENU, self.OnSaveFilteredAs, filteredSaver)
+        
+        # Columnar export options
+        sessionExporter = self._fileMenu.Append(wx.ID_ANY, 
+                                                "&Export Session...", 
+                                                "Exports the log into a" 
+                                                + " Parquet, Arrow or NPZ" 
+                                                + " file")
+        self.Bind(wx.EVT_MENU, self.OnExportSession, sessionExporter)
+        
+        captureExporter = self._fileMenu.Append(wx.ID_ANY, 
+                                                "Export Ca&pture...", 
+                                                "Exports a capture into a" 
+                                                + " Parquet, Arrow or NPZ" 
+                                                + " file")
+        self.Bind(wx.EVT_MENU, self.OnExportCapture, captureExporter)
+        
+        captureMerger = self._fileMenu.Append(wx.ID_ANY, 
+                                              "&Merge Captures...", 
+                                              "Merges the captures of" 
+                                              + " several devices by time")
+        self.Bind(wx.EVT_MENU, self.OnMergeCaptures, captureMerger)
+        
+        sessionQuery = self._fileMenu.Append(wx.ID_ANY, 
+                                             "&Query Sessions...", 
+                                             "Searches the frames of the" 
+                                             + " sessions recorded in the" 
+                                             + " session database")
+        self.Bind(wx.EVT_MENU, self.OnQuerySessions, sessionQuery)
+        
+        self._fileMenu.AppendSeparator()
+        
+        # Capture options
+        captureStart = self._fileMenu.Append(wx.ID_ANY, 
+                                             "Start &Capture", 
+                                             "Records the frames received and" 
+                                             + " sent into a capture file at " 
+                                             + self._fileSaver.GetSavingDir())
+        self.Bind(wx.EVT_MENU, self.OnStartCapture, captureStart)
+        
+        captureStop = self._fileMenu.Append(wx.ID_ANY, 
+                                            "S&top Capture", 
+                                            "Stops recording the capture")
+        self.Bind(wx.EVT_MENU, self.OnStopCapture, captureStop)
+        
+        replay = self._fileMenu.Append(wx.ID_ANY, 
+                                       "&Replay Capture...", 
+                                       "Replays a capture through the app" 
+                                       + " as if a device sent it")
+        self.Bind(wx.EVT_MENU, self.OnReplay, replay)
+        self._fileMenu.AppendSeparator()
+        
         # Clear log option
         loggerCleaner = self._fileMenu.Append(wx.ID_ANY, 
                                               "&Clear Log", 
@@ -313,15 +476,21 @@ class MainFrame(wx.Frame):
         # Bind reading error (disconnection) and serial frame error
         self.Bind(ev.EVT_SERIALRE, self.OnReadError)
         self.Bind(ev.EVT_SERIALFE, self.OnReadError)
+        # Summaries of the repeated frames collapsed
+        self.Bind(ev.EVT_SERIALRR, self.OnRepeated)
         
         # Attach writing events
         self.Bind(ev.EVT_SERIALW, self.OnWrite)
         self.Bind(ev.EVT_SERIALWE, self.OnWriteError)
+        self.Bind(ev.EVT_SERIALWR, self.OnRepeatSent)
         
         # Attach connection events
         self.Bind(ev.EVT_SERIALC, self.OnConnect)
         self.Bind(ev.EVT_SERIALCE, self.OnConnectionError)
         self.Bind(ev.EVT_SERIALD, self.OnDisconnect)
+        self.Bind(ev.EVT_SERIALCF, self.OnNotConnected)
+        self.Bind(ev.EVT_SERIALCL, self.OnConnectionLost)
+        self.Bind(ev.EVT_SERIALCR, self.OnReconnect)
         
     #------------------------------------------------
     #-----------------Construction-------------------
@@ -338,36 +507,27 @@ class MainFrame(wx.Frame):
 #region Device Handling
     #---------------DEVICE HANDLER------------------
     
-    def __format_parameters(self, data):
-        """
-        Method to convert the different parameters into 
-        something more readable. 
-
-        Args:
-            data (str/bytes): Parameters
-
-        Returns:
-            str: Formated parameters.
-        """
-        lengthParams = int(data[0])
-        params = ""
-        
-        for i in range(0, lengthParams):
-            params += (data[1 + i] + ";")
-        
-        return params
-     
     def OnRead(self, event):
         """
         Method called when some new line is available 
         to read from the device. 
         Receives this new line and formats it so that 
         the user can understand what message is sent. 
+        
+        The line is logged with the host time of arrival 
+        of the frame, and the latency spans of the frame 
+        are added to the tracer.
 
         Args:
             event (EVT_SERIALR): Serial read event. 
         """
-        # TODO: Manage different types of codification
+        handled = time.monotonic_ns()
+        arrival = to_epoch(event.t)
+        
+        if event.kind == "binary":
+            self.__read_binary(event, handled, arrival)
+            return
+        
         # Extract trace from event.
         # Try to decode into a string
         newStr = event.data.decode('utf-8')
@@ -392,7 +552,8 @@ class MainFrame(wx.Frame):
                 else:
                     message = "[In]: {comm} (Params): {params}                     {timestamp}\n".format(
                         comm=traceData[1],
-                        params=self.__format_parameters(traceData), 
+                        params=self._protocol.protocol.Describe(
+                            traceData[1], traceData[2:len(traceData) - 1]), 
                         timestamp=datetime.fromtimestamp(float(traceData[len(traceData) - 1])).strftime("%Y-%M-%D %H:%M:%S")
                     )
             else:
@@ -401,10 +562,43 @@ class MainFrame(wx.Frame):
                     timestamp=datetime.fromtimestamp(float(traceData[len(traceData) - 1])).strftime("%Y-%M-%D %H:%M:%S")
                 )
                 
-            self._currentUI.OnResponse(message)
-        else:
-            x = 0
-            # Implement Byte processing
+            if messageComm:
+                self._currentUI.OnResponse(message, "in", "message", 
+                                           raw=event.data, t=arrival, 
+                                           arrival=arrival)
+            else:
+                self._currentUI.OnResponse(message, "in", "response", 
+                                           traceData[1], 
+                                           traceData[2:len(traceData) - 1], 
+                                           event.data, arrival, arrival)
+            self._latency.Frame(event.t, event.decoded, handled, 
+                                time.monotonic_ns())
+    
+    def __read_binary(self, event, handled, arrival):
+        """
+        Shows a binary frame received: a line with its fields
+        in the log, and the frame in the binary view, where 
+        its dump is formatted only if it's on screen.
+
+        Args:
+            event (EVT_SERIALR): Serial read event.
+            handled (int): Start of the handler (monotonic ns)
+            arrival (int): Arrival time (epoch ns)
+        """
+        self._hexDump.Append(event.data, "in", arrival)
+        fields = self._decoder.Fields(event.data)
+        command = None
+        if fields is not None and fields.command is not None:
+            command = "0x%02X" % fields.command
+        decoded = self._protocol.protocol.DescribeBinary(fields)
+        if decoded:
+            decoded = " " + decoded
+        self._currentUI.OnResponse("[In]: Binary " + describe(fields) 
+                                   + decoded + "\n",
+                                   "in", "binary", command, [], 
+                                   event.data, arrival, arrival)
+        self._latency.Frame(event.t, event.decoded, handled, 
+                            time.monotonic_ns())
             
     def OnReadMessage(self, event):
         """
@@ -413,6 +607,8 @@ class MainFrame(wx.Frame):
         Args:
             event (EVT_SERIALRM): Message received from serial.
         """
+        handled = time.monotonic_ns()
+        
         # Avoid lines with only \r\n
         if event.data != b'\r\n' and event.data != b'\n':
             # Now transform message into string and clean it from \r\n
@@ -420,7 +616,12 @@ class MainFrame(wx.Frame):
             print("New trace received: ")
             print(event.data)
             message = message.strip()
-            self._currentUI.OnResponse("[System] " + message + "\n")
+            arrival = to_epoch(event.t)
+            self._currentUI.OnResponse("[System] " + message + "\n", 
+                                       "in", "message", raw=event.data, 
+                                       t=arrival, arrival=arrival)
+            self._latency.Frame(event.t, event.decoded, handled, 
+                                time.monotonic_ns())
     
     def WriteDevice(self, dat: Trace):
         """
@@ -441,6 +642,68 @@ class MainFrame(wx.Frame):
             self._currentUI.OnResponse("[System] Device is not connected," 
                                        + "can't send command.\n")
         
+    def WriteFrame(self, frame):
+        """
+        Method called to send a frame that is already encoded.
+        Can be called from outside the GUI thread, so the log 
+        is updated with wx.CallAfter.
+
+        Args:
+            frame (bytes): Frame to send to the device.
+        """
+        device = self._deviceInstance
+        if device:
+            device.write_frame(frame)
+        else:
+            wx.CallAfter(self._currentUI.OnResponse, 
+                         "[System] Device is not connected," 
+                         + "can't send command.\n")
+        
+    def ScheduleRepeat(self, frame, period):
+        """
+        Sends a command periodically with the TX scheduler of
+        the device.
+
+        Args:
+            frame (FrameTemplate): Pre-encoded frame of the command
+            period (float): Seconds between sends
+
+        Returns:
+            int: Id of the repeat, or None if no device is connected
+        """
+        if not self._deviceInstance:
+            self._currentUI.OnResponse("[System] Device is not connected," 
+                                       + "can't send command.\n")
+            return None
+        return self._deviceInstance.schedule_repeat(frame, period)
+    
+    def CancelRepeat(self, id):
+        """
+        Stops a command sent periodically.
+
+        Args:
+            id (int): Id returned by ScheduleRepeat
+        """
+        if self._deviceInstance:
+            self._deviceInstance.cancel_repeat(id)
+    
+    def OnRepeatSent(self, event):
+        """
+        Method called when the scheduler sent a command 
+        that is repeated. Writes it in the log.
+
+        Args:
+            event (EVT_SERIALWR): Frame sent, with its command and
+                                  the epoch time of the send (ns)
+        """
+        instant = datetime.fromtimestamp(event.t / 1e9)
+        self._currentUI.OnResponse("[Out]: " + event.command 
+                                   + "                     " 
+                                   + instant.strftime("%Y-%M-%D %H:%M:%S") 
+                                   + "\n", "out", "command", event.command,
+                                   raw=event.data, t=event.t, 
+                                   arrival=event.t)
+        
     def OnWrite(self, event):
         """
         Method called to notify the user that the command 
@@ -464,7 +727,7 @@ class MainFrame(wx.Frame):
         """
         self._currentUI.OnResponse("[System] Error while writing" 
                                    + "on the device. Error: " 
-                                   + str(event.data) + "\n")
+                                   + str(event.data) + "\n", "out", "error")
         
     def OnReadError(self, event):
         """
@@ -479,7 +742,27 @@ class MainFrame(wx.Frame):
         self._currentUI.OnResponse("[System] Error while reading from" 
                                    + "the device. Error: " 
                                    + str(event.data) 
-                                   + "\n")
+                                   + "\n", "in", "error")
+        
+    def OnRepeated(self, event):
+        """
+        Writes the summary of a run of identical frames that
+        were collapsed: the frame, how many times it was
+        repeated after being shown and the time of the first
+        and last ones.
+
+        Args:
+            event (EVT_SERIALRR): Summary of the repeated frames. 
+        """
+        first = to_epoch(event.t)
+        last = to_epoch(event.last)
+        text = event.data.decode("utf-8", "replace").strip()
+        self._currentUI.OnResponse(
+            "[System] Repeated {0} times: {1} ({2} - {3})\n".format(
+                event.count, text, 
+                datetime.fromtimestamp(first / 1e9).strftime("%H:%M:%S.%f"),
+                datetime.fromtimestamp(last / 1e9).strftime("%H:%M:%S.%f")), 
+            "in", event.kind, raw=event.data, t=last)
         
     # Device status checking    
     def OnConnectionError(self, event):
@@ -494,7 +777,55 @@ class MainFrame(wx.Frame):
         dlg = wx.MessageDialog(self, "Something went wrong with serial connection.")
         dlg.ShowModal()
         dlg.Destroy()
+        if self._deviceInstance:
+            self._lastDevice = self._deviceInstance.get_last()
         self._deviceInstance = None 
+    
+    def OnNotConnected(self, event):
+        """
+        Method called when something is sent to a device 
+        that is not connected anymore.
+
+        Args:
+            event (EVT_SERIALCF): Device not connected.
+        """
+        self._currentUI.OnResponse("[System] Device is not connected, " 
+                                   + "frame not sent.\n", "out", "error")
+    
+    def OnConnectionLost(self, event):
+        """
+        Method called when the port of the device fails. The 
+        device reconnects by itself, meanwhile the frames sent
+        are buffered.
+
+        Args:
+            event (EVT_SERIALCL): Connection lost.
+        """
+        self._currentUI.StopRepeats()
+        self._statusBar.SetStatusText("Reconnecting to " 
+                                      + str(event.data) + "...", 1)
+        self._currentUI.OnResponse("[System] Connection lost with " 
+                                   + str(event.data) 
+                                   + ", reconnecting.\n")
+    
+    def OnReconnect(self, event):
+        """
+        Method called when the device is connected again 
+        after losing the port. 
+
+        Args:
+            event (EVT_SERIALCR): Reconnection, with the seconds 
+                                  that it took.
+        """
+        if not self._deviceInstance:
+            return
+        
+        stats = self._deviceInstance.get_reconnect_stats()
+        self._statusBar.SetStatusText("Device port: " 
+                                      + self._deviceInstance.get_port(), 1)
+        self._currentUI.OnResponse(
+            "[System] Reconnected in {0:.3f} s ({1} frames dropped " 
+            "while disconnected).\n".format(event.data, stats["dropped"]))
         
     def OnConnect(self, event):
         """
@@ -521,6 +852,8 @@ class MainFrame(wx.Frame):
         Args:
             event (EVT_SERIALD): Serial disconnection.
         """
+        self._currentUI.StopRepeats()
+        self.OnStopSharing(event)
         self._statusBar.SetStatusText("No device connected", 1)
         dlg = wx.MessageDialog(self, "Device disconnected!")
         dlg.ShowModal()
@@ -546,13 +879,18 @@ class MainFrame(wx.Frame):
             event (wx.EVT_MENU): Menu event.
         """
         if not self._deviceInstance:
-            self._deviceInstance = Device(self._devices, self)
+            self._deviceInstance = open_device(self._devices, self, 
+                                               self._telemetry, 
+                                               self._lastDevice, 
+                                               self._protocol.protocol)
             if not self._deviceInstance.is_connected():
                 self._deviceInstance = None
                 dlg = wx.MessageDialog(self, 
                                "No devices found.")
                 dlg.ShowModal()
                 dlg.Destroy()
+            else:
+                self.__start_recording()
         else:
             dlg = wx.MessageDialog(self, 
                                "Device already connected.")
@@ -570,6 +908,8 @@ class MainFrame(wx.Frame):
             event (wx.EVT_MENU): Menu event.
         """
         if self._deviceInstance:
+            self.OnStopSharing(event)
+            self._lastDevice = self._deviceInstance.get_last()
             self._deviceInstance.close()
             self._deviceInstance = None
         else:
@@ -578,6 +918,56 @@ class MainFrame(wx.Frame):
             dlg.ShowModal()
             dlg.Destroy()
         
+    def OnShareDevice(self, event):
+        """
+        Method called when the user wants to share the device
+        with other programs. Starts a bridge with the settings 
+        of the "bridge" entry of the configuration.
+
+        Args:
+            event (wx.EVT_MENU): Menu event.
+        """
+        if not self._deviceInstance:
+            dlg = wx.MessageDialog(self, 
+                               "Device is not connected.")
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        if self._bridge:
+            return
+        
+        conf = self._devices.bridge
+        queue = self._devices.queues.get("bridge", {})
+        self._bridge = Bridge(self._deviceInstance, 
+                              conf.get("tcp"), 
+                              conf.get("unix"), 
+                              queue.get("size", conf.get("queue", 1024)),
+                              queue.get("policy", "drop-newest"),
+                              queue.get("sample", 10))
+        try:
+            self._bridge.Start()
+            self._currentUI.OnResponse("[System] Sharing device on " 
+                                       + str(conf) + "\n")
+        except OSError as e:
+            self._bridge.Stop()
+            self._bridge = None
+            self._currentUI.OnResponse("[System] Device can't be shared. " 
+                                       + "Error: " + str(e) + "\n")
+    
+    def OnStopSharing(self, event):
+        """
+        Method called when the user stops sharing the device.
+        Closes the bridge and all its connections.
+
+        Args:
+            event (wx.EVT_MENU): Menu event.
+        """
+        if self._bridge:
+            self._bridge.Stop()
+            self._bridge = None
+            self._currentUI.OnResponse("[System] Device is not shared.\n")
+        
     def OnDeviceInfo(self, event):
         """
         Method called when the user wants to know information 
@@ -624,6 +1014,170 @@ class MainFrame(wx.Frame):
     #-----------------DEVICE MENU-------------------
 #endregion
     
+#region View Menu Option
+    #------------------VIEW MENU--------------------
+    def OnPlot(self, event):
+        """
+        Opens the telemetry plot window, or raises it if
+        it's already open.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        if self._plotFrame:
+            self._plotFrame.Raise()
+        else:
+            self._plotFrame = PlotFrame(self, self._telemetry)
+    
+    def OnBinaryView(self, event):
+        """
+        Opens the binary frames window, or raises it if 
+        it's already open.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        if self._hexFrame:
+            self._hexFrame.Raise()
+        else:
+            self._hexFrame = HexFrame(self, self._hexDump)
+    
+    def OnTxStatistics(self, event):
+        """
+        Shows the metrics of the TX scheduler of the 
+        connected device.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        if not self._deviceInstance:
+            dlg = wx.MessageDialog(self, 
+                               "Device is not connected.")
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        metrics = self._deviceInstance.get_scheduler().GetMetrics()
+        text = ("Queued: {queued}\n"
+                "Sent: {sent}\n"
+                "Pending: {pending}\n"
+                "Delayed: {delayed} (mean {delayMean:.4f} s, " 
+                "max {delayMax:.4f} s)\n"
+                "Dropped (queue full): {dropped}\n"
+                "Rejected (airtime over the budget): {rejected}\n"
+                "Periodic deadlines missed: {missed}\n"
+                "Airtime in window: {airtimeWindow:.3f} s " 
+                "of {airtimeBudget:.3f} s\n"
+                "Flow window: {window:.1f} ({inflight} not answered)\n"
+                "Overflows: {overflows}, answer timeouts: {timeouts}, "
+                "unmatched answers: {unmatched}\n"
+                ).format(**metrics)
+        dlg = wx.MessageDialog(self, text, "TX Statistics")
+        dlg.ShowModal()
+        dlg.Destroy()
+    
+    def OnLatency(self, event):
+        """
+        Shows the latency spans of the frames received, 
+        from the read of the port to the log, and of the 
+        writes to the port. Resets them afterwards.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        stats = self._latency.GetStats()
+        if self._deviceInstance:
+            stats.update(self._deviceInstance.get_latency())
+        
+        text = report(stats) or "No frames yet."
+        dlg = wx.MessageDialog(self, text, "Latency")
+        dlg.ShowModal()
+        dlg.Destroy()
+        self._latency.Reset()
+    
+    def OnDeviceClock(self, event):
+        """
+        Shows the model of the clock of the connected 
+        device, fitted from the commands answered. 
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        if not self._deviceInstance:
+            dlg = wx.MessageDialog(self, 
+                               "Device is not connected.")
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        model = self._deviceInstance.get_clock()
+        if not model.get("samples"):
+            text = "No commands answered yet."
+        else:
+            text = ("Offset: {offset:+.4f} s (+/- {error:.4f} s)\n"
+                    "Drift: {drift:+.1f} ppm\n"
+                    "Samples: {samples}\n"
+                    "Device resolution: {resolution:g} s\n").format(**model)
+        dlg = wx.MessageDialog(self, text, "Device Clock")
+        dlg.ShowModal()
+        dlg.Destroy()
+    
+    def OnAggregation(self, event):
+        """
+        Shows the frames collapsed by the aggregation of 
+        the connected device, by kind.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        if not self._deviceInstance:
+            dlg = wx.MessageDialog(self, 
+                               "Device is not connected.")
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        stats = self._deviceInstance.get_aggregation()
+        if stats is None:
+            text = "Aggregation is not enabled in app.json."
+        else:
+            line = ("{0}: {frames} frames, {collapsed} collapsed in " 
+                    "{summaries} summaries, {saved} events saved\n")
+            text = line.format("Total", **stats)
+            for kind, s in stats["kinds"].items():
+                text += line.format(kind, **s)
+        dlg = wx.MessageDialog(self, text, "Repeated Frames")
+        dlg.ShowModal()
+        dlg.Destroy()
+    
+    def OnQueues(self, event):
+        """
+        Shows the queues between the reading of the device 
+        and its consumers (GUI, session recorder and clients 
+        of the bridge): frames waiting, high-water mark and 
+        frames dropped by their policy. The store of the log
+        is shown too, with the lines it removed when full.
+
+        Args:
+            event (EVT_MENU): wx Event
+        """
+        stats = [self._currentUI.GetLogStats()]
+        if self._deviceInstance:
+            stats += self._deviceInstance.get_queues()
+        if self._bridge:
+            stats += [dict(s, name="bridge " + s["name"]) 
+                      for s in self._bridge.GetQueues()]
+        line = ("{name} ({policy}, {size}): {depth} waiting, high-water " 
+                "{highWater}, {put} queued, {dropped} dropped, " 
+                "{blocked} waits ({waited:.2f} s)\n")
+        text = "".join(line.format(**s) for s in stats)
+        dlg = wx.MessageDialog(self, text, "Queues")
+        dlg.ShowModal()
+        dlg.Destroy()
+    
+    #------------------VIEW MENU--------------------
+#endregion
+    
 #region Help Menu Option
     #------------------HELP MENU--------------------
     def OnHelpMenuButton(self, event, url):
@@ -747,6 +1301,349 @@ class MainFrame(wx.Frame):
             # Save data into file
             self._fileSaver.SaveTextLogAs(dirName, fileName, data)
             
+    def OnSaveFilteredAs(self, event):
+        """
+        Method that saves the lines shown in the filtered 
+        view of the log into a file specified by the user. 
+
+        Args:
+            event (EVT_MENU/EVT_BUTTON): Event produced by a menu 
+                                         or the export button
+        """
+        # Create dialog
+        dlg = wx.FileDialog(self, 
+                            "Save filtered log with name...", 
+                            "", 
+                            "", 
+                            "*.*", 
+                            wx.FD_SAVE)
+
+        if dlg.ShowModal() == wx.ID_OK:
+            # Retrieve data from dialog
+            fileName = dlg.GetFilename()
+            dirName = dlg.GetDirectory()
+            data = self._currentUI.GetFilteredData()
+            
+            # Save data into file
+            self._fileSaver.SaveTextLogAs(dirName, fileName, data)
+        
+        dlg.Destroy()
+    
+    def __ask_export_path(self, capture=False):
+        """
+        Asks the user for the file to export to.
+
+        Args:
+            capture (bool, optional): Offer the capture format too.
+
+        Returns:
+            str: Path of the file, or None if cancelled
+        """
+        wildcard = ("Parquet (*.parquet)|*.parquet|" 
+                    + "Arrow (*.arrow)|*.arrow|" 
+                    + "NumPy (*.npz)|*.npz")
+        if capture:
+            wildcard += "|Capture (*.cap)|*.cap"
+        dlg = wx.FileDialog(self, 
+                            "Export with name...", 
+                            self._fileSaver.GetSavingDir(), 
+                            "", 
+                            wildcard, 
+                            wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        path = None
+        if dlg.ShowModal() == wx.ID_OK:
+            path = dlg.GetPath()
+        dlg.Destroy()
+        
+        return path
+    
+    def __export(self, path, source):
+        """
+        Exports the records of the log (source None) or a
+        capture (source path). Runs in its own thread, so
+        a big capture doesn't block the GUI.
+        """
+        try:
+            exporter = SessionExporter(path)
+            if source is None:
+                for batch in self._currentUI.GetLogRecords():
+                    exporter.WriteRecords(batch)
+            else:
+                exporter.WriteCapture(source)
+            exporter.Close()
+            message = ("[System] Exported " + str(exporter.GetRows()) 
+                       + " rows: " + exporter.path + "\n")
+        except (OSError, ValueError) as e:
+            message = "[System] Export failed. Error: " + str(e) + "\n"
+        
+        wx.CallAfter(self._currentUI.OnResponse, message)
+    
+    def OnExportSession(self, event):
+        """
+        Exports the lines of the log, with their time, 
+        direction, command, parameters and bytes, into a 
+        columnar file (Parquet, Arrow or NPZ).
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        path = self.__ask_export_path()
+        if path:
+            threading.Thread(name="Export", target=self.__export, 
+                             args=(path, None), daemon=True).start()
+    
+    def OnExportCapture(self, event):
+        """
+        Exports the frames of a capture into a columnar 
+        file (Parquet, Arrow or NPZ).
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        dlg = wx.FileDialog(self,
+                            "Choose capture",
+                            self._fileSaver.GetSavingDir(), 
+                            "", 
+                            "*.cap", 
+                            wx.FD_OPEN)
+        source = None
+        if dlg.ShowModal() == wx.ID_OK:
+            source = dlg.GetPath()
+        dlg.Destroy()
+        
+        path = source and self.__ask_export_path()
+        if path:
+            threading.Thread(name="Export", target=self.__export, 
+                             args=(path, source), daemon=True).start()
+            
+    def __merge(self, paths, output):
+        """
+        Merges captures. Runs in its own thread.
+        """
+        try:
+            path, frames = write_merged(paths, output)
+            message = ("[System] Merged " + str(frames) + " frames of " 
+                       + str(len(paths)) + " captures: " + path + "\n")
+        except (OSError, ValueError) as e:
+            message = "[System] Merge failed. Error: " + str(e) + "\n"
+        
+        wx.CallAfter(self._currentUI.OnResponse, message)
+    
+    def OnMergeCaptures(self, event):
+        """
+        Merges the captures of several devices into one 
+        file ordered by time, as a capture or a columnar 
+        file with the source of each frame.
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        dlg = wx.FileDialog(self,
+                            "Choose captures",
+                            self._fileSaver.GetSavingDir(), 
+                            "", 
+                            "*.cap", 
+                            wx.FD_OPEN | wx.FD_MULTIPLE)
+        paths = []
+        if dlg.ShowModal() == wx.ID_OK:
+            paths = dlg.GetPaths()
+        dlg.Destroy()
+        
+        output = paths and self.__ask_export_path(True)
+        if output:
+            threading.Thread(name="Merge", target=self.__merge, 
+                             args=(paths, output), daemon=True).start()
+    
+    def __start_recording(self):
+        """
+        Starts recording the connected device in the session
+        database, when the "sessionDb" entry is enabled.
+        Frames older than the retention are removed first.
+        """
+        conf = self._devices.sessionDb
+        if not self._deviceInstance or not conf.get("enabled"):
+            return
+        
+        conf = dict(conf, fields=self._devices.telemetry.get("fields", {}))
+        path = self._fileSaver.GetSessionDB(conf.get("path"))
+        try:
+            self._deviceInstance.start_recording(path, conf)
+        except (OSError, sqlite3.Error) as e:
+            self._currentUI.OnResponse("[System] Session database not " 
+                                       + "available. Error: " + str(e) 
+                                       + "\n")
+            return
+        self._currentUI.OnResponse("[System] Recording session in " 
+                                   + path + "\n")
+    
+    def __query_sessions(self, path, args, limit):
+        """
+        Runs a query of the session database, in its own 
+        thread, and writes the frames found in the log.
+        """
+        db = None
+        count = 0
+        try:
+            db = SessionDB(path)
+            for batch in db.Query(limit=limit, **args):
+                lines = []
+                for r in batch:
+                    line = ("[Query] " + r.device + " " + r.direction + " " 
+                            + r.raw.decode("utf-8", "replace").strip())
+                    if r.value is not None:
+                        line += " (" + args["field"] + " = " 
+                        line += str(r.value) + ")"
+                    if r.count is not None:
+                        line += " (repeated " + str(r.count) + " times)"
+                    lines.append(line + "\n")
+                count += len(batch)
+                wx.CallAfter(self.__show_query, lines, batch)
+            message = "[System] " + str(count) + " frames found.\n"
+        except Exception as e:
+            message = "[System] Query failed. Error: " + str(e) + "\n"
+        finally:
+            if db:
+                db.Close()
+        
+        wx.CallAfter(self._currentUI.OnResponse, message)
+    
+    def __show_query(self, lines, batch):
+        for line, r in zip(lines, batch):
+            self._currentUI.OnResponse(line, t=r.time)
+    
+    def OnQuerySessions(self, event):
+        """
+        Searches the session database with a query typed
+        as filters (see session_db.parse_query), and shows
+        the frames found in the log. 
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        dlg = wx.TextEntryDialog(self, 
+                                 "Filters (device, command, direction, " 
+                                 + "kind, since, until, limit, field<value):",
+                                 "Query Sessions", 
+                                 "kind=response since=1d")
+        text = None
+        if dlg.ShowModal() == wx.ID_OK:
+            text = dlg.GetValue()
+        dlg.Destroy()
+        if not text:
+            return
+        
+        try:
+            args = parse_query(text)
+        except ValueError as e:
+            dlg = wx.MessageDialog(self, str(e))
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        # Lines written in the log, at most
+        limit = args.pop("limit", 1000)
+        path = self._fileSaver.GetSessionDB(
+            self._devices.sessionDb.get("path"))
+        threading.Thread(name="Session query", target=self.__query_sessions, 
+                         args=(path, args, limit), daemon=True).start()
+    
+    def OnStartCapture(self, event):
+        """
+        Starts recording a capture of the connected device.
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        if self._deviceInstance:
+            path = self._fileSaver.GetCaptureFile()
+            self._deviceInstance.start_capture(path)
+            self._currentUI.OnResponse("[System] Recording capture: " 
+                                       + path + "\n")
+        else:
+            dlg = wx.MessageDialog(self, 
+                               "Device is not connected.")
+            dlg.ShowModal()
+            dlg.Destroy()
+    
+    def OnStopCapture(self, event):
+        """
+        Stops recording the capture.
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        if self._deviceInstance:
+            capture = self._deviceInstance.stop_capture()
+            if capture:
+                self._currentUI.OnResponse("[System] Capture saved: " 
+                                           + capture.path + " (" 
+                                           + str(capture.GetFrames()) 
+                                           + " frames)\n")
+    
+    def OnReplay(self, event):
+        """
+        Replays a capture. The capture is read by a virtual
+        port, so its frames go through the same pipeline of
+        a connected device: validation, events and UI.
+
+        Args:
+            event (EVT_MENU): Event produced by a menu
+        """
+        if self._deviceInstance:
+            dlg = wx.MessageDialog(self, 
+                               "Disconnect the device before replaying.")
+            dlg.ShowModal()
+            dlg.Destroy()
+            return
+        
+        dlg = wx.FileDialog(self,
+                            "Choose capture",
+                            self._fileSaver.GetSavingDir(), 
+                            "", 
+                            "*.cap", 
+                            wx.FD_OPEN)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        path = dlg.GetPath()
+        dlg.Destroy()
+        
+        dlg = wx.TextEntryDialog(self, 
+                                 "Replay speed (1 = real time, " 
+                                 + "0 = as fast as possible)", 
+                                 "Replay", "1")
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        try:
+            speed = float(dlg.GetValue())
+        except ValueError:
+            speed = 1.0
+        dlg.Destroy()
+        
+        port = ReplayPort(path, speed, 
+                          lambda stats: wx.CallAfter(self.OnReplayFinished, 
+                                                     stats))
+        self._deviceInstance = Device(self._devices, self, 
+                                      self._telemetry, port=port, 
+                                      protocol=self._protocol.protocol)
+    
+    def OnReplayFinished(self, stats):
+        """
+        Called when the replay ends. Shows the statistics
+        of the replay and closes the virtual device.
+
+        Args:
+            stats (dict): Statistics of the replay
+        """
+        self._currentUI.OnResponse(
+            "[System] Replay finished: {frames} frames in {seconds:.3f} s " 
+            "({rate:.0f} frames/s)\n".format(**stats))
+        
+        if self._deviceInstance:
+            self._deviceInstance.close()
+            self._deviceInstance = None
+            
     def OnClearLog(self, event):
         """
         This method is used to clear the current log
@@ -780,6 +1677,42 @@ class MainFrame(wx.Frame):
 #endregion
 
 #region App Live Management
+    #---------------CONFIGURATION-------------------
+    
+    def OnReloadConfiguration(self, event):
+        """
+        Hot reload of the configuration files. Called by 
+        a timer, checks if "app.json", "protocol.json" or the UI
+        configuration changed and applies the new values without 
+        restarting.
+        Devices are used the next time the user connects.
+
+        Args:
+            event (EVT_TIMER): Timer event
+        """
+        try:
+            new = self._configCache.Reload(self._devices)
+            if new:
+                self._devices = new
+                self._appInfo = new["info"]
+                self.SetTitle(new["title"])
+                self._currentUI.OnResponse("[System] Configuration reloaded: " 
+                                           + new.path + "\n")
+            
+            new = self._configCache.Reload(self._protocol)
+            if new:
+                self._protocol = new
+                self._currentUI.OnResponse("[System] Protocol reloaded: " 
+                                           + new.path + "\n")
+            
+            self._currentUI.ReloadConfiguration()
+        except Exception as e:
+            # Keep the previous configuration when the new one is wrong
+            self._currentUI.OnResponse("[System] Configuration not reloaded. " 
+                                       + "Error: " + str(e) + "\n")
+    
+    #---------------CONFIGURATION-------------------
+    
     #---------------EXIT MANAGEMENT-----------------
         
     def OnClose(self, event):
@@ -792,6 +1725,11 @@ class MainFrame(wx.Frame):
         Args:
             event (wxEvent): Closing event
         """
+        self._reloadTimer.Stop()
+        self._currentUI.StopRepeats()
+        
+        self.OnStopSharing(event)
+        
         # Check if some device is connected
         if self._deviceInstance and self._deviceInstance._connected:
             self._deviceInstance.close()
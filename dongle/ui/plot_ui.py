@@ -0,0 +1,118 @@
+"""Plot UI file.
+
+This file contains the class PlotFrame, a window that plots live the
+telemetry values extracted from the frames received from the device.
+Each series is drawn in its own lane, reduced to the min/max of each
+pixel column, so the redraw cost doesn't depend on the number of points.
+"""
+# Standard imports
+import time
+
+# Third parties
+import wx
+
+# Internal imports
+from dongle.utils.telemetry import Decimate
+
+class PlotFrame(wx.Frame):
+    """
+    Window with the live telemetry plot. Redraws the
+    last "window" seconds of every series at a fixed
+    frame rate, driven by a wx.Timer.
+
+    Args:
+        wx (wx.Frame): Inherits from wx.Frame
+    """
+#region Variables
+    _telemetry = None
+    _panel: wx.Panel = None
+    _timer: wx.Timer = None
+
+    # Colors of the series
+    _colors = [(8, 0, 255), (220, 40, 40), (20, 150, 60),
+               (200, 120, 0), (120, 0, 160)]
+    _axisC = (160, 160, 160)
+    _margin = 60
+#endregion
+
+    def __init__(self, parent, telemetry):
+        """
+        Args:
+            parent (wx.Frame): Main frame of the App
+            telemetry (Telemetry): Series to plot
+        """
+        wx.Frame.__init__(self, parent, title="Telemetry", size=(900, 600))
+        self._telemetry = telemetry
+
+        self._panel = wx.Panel(self)
+        self._panel.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self._panel.Bind(wx.EVT_PAINT, self.OnPaint)
+
+        self._timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTimer, self._timer)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+        self._timer.Start(int(1000 / telemetry.Get("fps")))
+
+        self.Show()
+
+#region Events
+    def OnTimer(self, event):
+        self._panel.Refresh(False)
+
+    def OnPaint(self, event):
+        """
+        Draws every series in its own lane. Each pixel
+        column is a vertical line from the minimum to the
+        maximum of the points that fall in it.
+
+        Args:
+            event (EVT_PAINT): Paint event
+        """
+        dc = wx.AutoBufferedPaintDC(self._panel)
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+
+        series = self._telemetry.GetSeries()
+        w, h = self._panel.GetClientSize()
+        columns = w - self._margin
+        if not series or columns <= 0:
+            dc.DrawText("No telemetry received", 10, 10)
+            return
+
+        t1 = time.time()
+        t0 = t1 - self._telemetry.Get("window")
+        laneH = h // len(series)
+
+        for i, name in enumerate(sorted(series)):
+            top = i * laneH
+            times, values = series[name].Window(t0)
+            cols, mins, maxs = Decimate(times, values, t0, t1, columns)
+
+            # Lane and label
+            dc.SetPen(wx.Pen(self._axisC))
+            dc.DrawLine(self._margin, top + laneH - 1, w, top + laneH - 1)
+            dc.DrawText(name, 5, top + 5)
+            if len(cols) == 0:
+                continue
+
+            low, high = float(mins.min()), float(maxs.max())
+            dc.DrawText("%.1f" % high, 5, top + 20)
+            dc.DrawText("%.1f" % low, 5, top + laneH - 20)
+            span = (high - low) or 1.0
+            scale = (laneH - 10) / span
+
+            x = cols + self._margin
+            yMin = top + laneH - 5 - ((mins - low) * scale).astype(int)
+            yMax = top + laneH - 5 - ((maxs - low) * scale).astype(int)
+
+            dc.SetPen(wx.Pen(self._colors[i % len(self._colors)]))
+            dc.DrawLineList([(int(a), int(b), int(a), int(c))
+                             for a, b, c in zip(x, yMin, yMax)])
+            if len(x) > 1:
+                dc.DrawLines([wx.Point(int(a), int(b)) 
+                              for a, b in zip(x, yMin)])
+
+    def OnClose(self, event):
+        self._timer.Stop()
+        self.Destroy()
+#endregion
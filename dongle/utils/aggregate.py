@@ -0,0 +1,162 @@
+"""Message aggregation.
+
+This file contains the class MessageAggregator, that collapses the
+repeated frames received (status messages, Overflow) before they become
+events, log lines and writes to disk. The first frame of a run is passed
+on at once; the identical ones that follow it inside the window of its
+kind are only counted, and when the run ends (another frame of the same
+kind, the window passed) one summary with the count and the first and
+last times takes their place.
+
+Runs are kept per kind, so the responses received between two status
+lines don't break their run. The timestamp at the end of the messages
+and responses is not compared, because it changes in every frame.
+"""
+class _Run:
+    """
+    Frames of a kind that are being collapsed.
+    """
+    __slots__ = ("key", "frame", "count", "first", "last")
+
+    def __init__(self, key, frame, t):
+        self.key = key
+        self.frame = frame
+        # Frames collapsed (after the first one)
+        self.count = 0
+        self.first = t
+        self.last = t
+
+class MessageAggregator:
+    """
+    Collapses runs of identical frames of each kind in
+    a time window. Used from the reading thread only.
+    """
+#region Variables
+    # Default values of the "aggregation" configuration
+    DEFAULTS = {
+        "enabled": False,
+        # Window of each kind, in seconds (0 or missing: not collapsed)
+        "kinds": {"message": 1.0, "overflow": 1.0, "text": 1.0}
+    }
+
+    # End of the string-type frames, before the timestamp
+    _ends = {"message": b";EOM", "response": b";EOR"}
+
+    # Window of each kind (ns)
+    _windows = None
+    _runs = None
+
+    # Runs with frames collapsed, waiting for their summary
+    _open = 0
+
+    # Statistics
+    _seen = None
+    _collapsed = None
+    _summaries = None
+#endregion
+
+    def __init__(self, conf=None):
+        """
+        Args:
+            conf (dict, optional): "aggregation" configuration
+        """
+        conf = dict(self.DEFAULTS, **(conf or {}))
+        self._windows = {kind: int(window * 1e9)
+                         for kind, window in conf["kinds"].items() if window}
+        self._runs = {}
+        self._open = 0
+        self._seen = dict.fromkeys(self._windows, 0)
+        self._collapsed = dict.fromkeys(self._windows, 0)
+        self._summaries = dict.fromkeys(self._windows, 0)
+
+    def __key(self, kind, frame):
+        """
+        Part of the frame that must be identical: the whole
+        frame, without the line end and the timestamp.
+        """
+        frame = frame.rstrip(b"\r\n")
+        end = self._ends.get(kind)
+        if end is not None and frame.endswith(end):
+            stamp = frame.rfind(b";", 0, len(frame) - len(end))
+            if stamp > 0:
+                return frame[:stamp]
+        return frame
+
+    def Process(self, kind, frame, t):
+        """
+        Checks a frame received.
+
+        Args:
+            kind (str): Kind of the frame (FrameDecoder)
+            frame (bytes): Frame
+            t (int): Host time of the read (monotonic ns)
+
+        Returns:
+            tuple: (whether the frame is passed on, summary of the
+                    run it ended or None). Summaries are (kind,
+                    frame, count, first, last).
+        """
+        window = self._windows.get(kind)
+        if window is None:
+            return True, None
+
+        self._seen[kind] += 1
+        key = self.__key(kind, frame)
+        run = self._runs.get(kind)
+        if run is not None and run.key == key and t - run.first <= window:
+            if run.count == 0:
+                self._open += 1
+            run.count += 1
+            run.last = t
+            self._collapsed[kind] += 1
+            return False, None
+
+        self._runs[kind] = _Run(key, frame, t)
+        if run is None or run.count == 0:
+            return True, None
+        return True, self.__summary(kind, run)
+
+    def Expire(self, t):
+        """
+        Ends the runs whose window passed. Called by the
+        reading thread after every read, so the summaries
+        arrive even if no other frame comes.
+
+        Args:
+            t (int): Host time now (monotonic ns)
+
+        Returns:
+            list: Summaries (kind, frame, count, first, last)
+        """
+        if not self._open:
+            return []
+
+        summaries = []
+        for kind, run in list(self._runs.items()):
+            if run.count and t - run.first > self._windows[kind]:
+                del self._runs[kind]
+                summaries.append(self.__summary(kind, run))
+        return summaries
+
+    def __summary(self, kind, run):
+        self._open -= 1
+        self._summaries[kind] += 1
+        return (kind, run.frame, run.count, run.first, run.last)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Frames checked, collapsed and summaries sent, and
+                  events saved (collapsed - summaries), in total and
+                  by kind
+        """
+        kinds = {kind: {"frames": self._seen[kind],
+                        "collapsed": self._collapsed[kind],
+                        "summaries": self._summaries[kind],
+                        "saved": self._collapsed[kind]
+                                 - self._summaries[kind]}
+                 for kind in self._windows}
+        total = {name: sum(k[name] for k in kinds.values())
+                 for name in ("frames", "collapsed", "summaries", "saved")}
+        total["kinds"] = kinds
+        return total
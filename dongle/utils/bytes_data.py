@@ -6,7 +6,8 @@ class ByteCodes:
     ACK = bytes([SOF_R, 0, 0, 0, EOF_R])
     
     # Bytes codification and hashing
-    def crc16(self, data, poly=0x8408):
+    @staticmethod
+    def crc16(data, poly=0x8408):
         """
         Method to calculate the checksum of the 
         different traces when they are going to
@@ -20,7 +21,7 @@ class ByteCodes:
             poly (hexadecimal, optional): Type. Defaults to 0x8408.
 
         Returns:
-            bytes: has of the trace as a byte list
+            int: hash of the trace (16 bits)
         """
         data = bytearray(data)
         crc = 0xFFFF
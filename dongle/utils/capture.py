@@ -0,0 +1,142 @@
+"""Captures.
+
+This file contains the classes that record and read captures. A
+capture stores every frame received from and sent to the device,
+with the time it was read or written, so a session can be replayed
+or analysed later. Unlike the text log, it keeps the raw bytes.
+
+Each line of a capture is:
+
+    <epoch timestamp in ns> <in|out> <frame in hexadecimal> [<source>]
+        [@<device timestamp in ns>]
+
+The source is only written in the captures merged from several devices
+(dongle.utils.merge), and is the name of the capture of the frame. The
+device timestamp is the one at the end of the responses and messages,
+converted to the epoch time of the host by the clock model of the
+device (dongle.utils.clock), when the model has samples.
+"""
+# Standard imports
+import time
+import threading
+
+class CaptureWriter:
+    """
+    This class writes the frames of a session into a
+    capture file. Can be used from the reading thread
+    and the writing thread at the same time.
+    """
+    HEADER = "# DynaLoRa capture v1\n"
+
+    _file = None
+    _lock: threading.Lock = None
+    _frames = 0
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the capture file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', buffering=1 << 16)
+        self._file.write(self.HEADER)
+        self._frames = 0
+
+    def Write(self, direction, data, t=None, source=None, device=None):
+        """
+        Adds a frame to the capture.
+
+        Args:
+            direction (str): "in" or "out"
+            data (bytes): Frame
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+            source (str, optional): Source of the frame, without
+                                    spaces. Defaults to None.
+            device (int, optional): Device timestamp in host epoch
+                                    time (ns). Defaults to None.
+        """
+        if t is None:
+            t = time.time_ns()
+
+        line = "%d %s %s" % (t, direction, bytes(data).hex())
+        if source is not None:
+            line += " " + source
+        if device is not None:
+            line += " @%d" % device
+        line += "\n"
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._frames += 1
+
+    def GetFrames(self):
+        return self._frames
+
+    def Close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+class CaptureReader:
+    """
+    This class reads a capture file frame by frame,
+    without loading the whole file in memory.
+    """
+    # Bytes read from the file at a time
+    _buffer = 1 << 20
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the capture file
+        """
+        self.path = path
+
+    def __iter__(self):
+        """
+        Yields:
+            tuple: (timestamp in ns, direction, frame bytes)
+        """
+        for t, direction, data, _, _ in self.ReadSources():
+            yield t, direction, data
+
+    def ReadSources(self):
+        """
+        Reads the frames with their source and device time.
+
+        Yields:
+            tuple: (timestamp in ns, direction, frame bytes,
+                    source or None, device timestamp in ns or None)
+        """
+        with open(self.path, 'r', buffering=self._buffer) as capture:
+            for line in capture:
+                if line.startswith("#"):
+                    continue
+
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+
+                data = bytes.fromhex(fields[2]) if len(fields) > 2 else b""
+                source = device = None
+                for field in fields[3:]:
+                    if field[0] == "@":
+                        device = int(field[1:])
+                    else:
+                        source = field
+                yield int(fields[0]), fields[1], data, source, device
+
+    def IsCapture(self):
+        """
+        Checks if the file is a capture file.
+
+        Returns:
+            bool: Whether it starts with the capture header
+        """
+        try:
+            with open(self.path, 'r') as capture:
+                return capture.readline() == CaptureWriter.HEADER
+        except (OSError, UnicodeDecodeError):
+            return False
@@ -0,0 +1,215 @@
+"""Clock estimation.
+
+This file contains the class ClockEstimator, that relates the clock of
+a dongle with the clock of the host. String frames of the dongle end
+with its timestamp (epoch seconds), so each command sent and answered
+gives a sample:
+
+    host:   sent ---------------------------- received
+    device:              stamp
+
+The offset of the sample is stamp - (sent + received) / 2, with an
+uncertainty of half the round trip (plus the resolution of the device
+stamps, that are taken as truncated: the middle of the interval is
+used). Only the best sample (shortest round trip) of every "spacing"
+seconds is kept, so the samples cover a long time and the drift can
+be measured. The model is a line, offset = a + b * (host - h0), fitted
+with weighted least squares over those samples, weighted by 1 / error^2,
+so samples with a short round trip count the most, and "b" is the
+drift of the device clock.
+
+Host times are time.monotonic_ns() values, so the model isn't broken
+when the wall clock of the host is set; ToEpoch gives the epoch time.
+"""
+# Standard imports
+import time
+from collections import deque
+
+# Internal imports
+from dongle.utils.latency import to_epoch
+
+class ClockEstimator:
+    """
+    Filtered offset/drift model of the clock of a device,
+    fitted from request/response pairs. One per device.
+    """
+#region Variables
+    # Samples kept for the fit, one per "spacing" seconds
+    _window = 64
+    _spacing = 1.0
+
+    # Samples (host mid-point s, offset s, error s)
+    _samples: deque = None
+
+    # Sends waiting for their answer, by command
+    _pending = None
+    _timeout = 5.0
+
+    # Model: offset = a + b * (host - h0)
+    _a = 0.0
+    _b = 0.0
+    _h0 = 0.0
+    _error = 0.0
+
+    # Resolution of the stamps of the device (s)
+    _resolution = 1.0
+#endregion
+
+    def __init__(self, window=64, spacing=1.0, timeout=5.0):
+        """
+        Args:
+            window (int, optional): Samples kept for the fit.
+                                    Defaults to 64.
+            spacing (float, optional): Seconds between samples.
+                                       Defaults to 1.
+            timeout (float, optional): Max seconds between a send and
+                                       its answer. Defaults to 5.
+        """
+        self._window = window
+        self._spacing = spacing
+        self._timeout = timeout
+        self._samples = deque(maxlen=window)
+        self._pending = {}
+        self._resolution = 1.0
+
+    def OnSent(self, command, t):
+        """
+        Registers a command sent.
+
+        Args:
+            command (bytes): Command name
+            t (int): Host time of the write (monotonic ns)
+        """
+        sends = self._pending.get(command)
+        if sends is None:
+            sends = self._pending[command] = deque(maxlen=32)
+        sends.append(t)
+
+    def OnAnswer(self, command, stamp, t):
+        """
+        Registers the answer of a command, and updates the
+        model with the sample of its send, if there's one.
+
+        Args:
+            command (bytes): Command name
+            stamp (float): Device timestamp of the answer (epoch s)
+            t (int): Host time of the read (monotonic ns)
+
+        Returns:
+            bool: Whether the answer gave a sample
+        """
+        sends = self._pending.get(command)
+        limit = t - int(self._timeout * 1e9)
+        while sends and sends[0] < limit:
+            sends.popleft()
+        if not sends:
+            return False
+
+        self.AddSample(sends.popleft(), stamp, t)
+        return True
+
+    def AddSample(self, sent, stamp, received):
+        """
+        Adds a sample and fits the model again.
+
+        Args:
+            sent (int): Host time of the request (monotonic ns)
+            stamp (float): Device timestamp (epoch s)
+            received (int): Host time of the answer (monotonic ns)
+        """
+        if stamp != int(stamp):
+            # Whole seconds until a stamp with decimals arrives
+            self._resolution = 0.001
+
+        stamp += self._resolution / 2
+        host = (sent + received) / 2e9
+        error = (received - sent) / 2e9 + self._resolution / 2
+        samples = self._samples
+        if samples and host - samples[len(samples) - 1][0] < self._spacing:
+            if error >= samples[len(samples) - 1][2]:
+                return
+            # Better sample of the same interval
+            samples.pop()
+        samples.append((host, stamp - host, error))
+        self.__fit()
+
+    def __fit(self):
+        samples = self._samples
+        h0 = samples[len(samples) - 1][0]
+
+        sw = sx = sy = sxx = sxy = 0.0
+        for host, offset, error in samples:
+            w = 1.0 / (error * error)
+            x = host - h0
+            sw += w
+            sx += w * x
+            sy += w * offset
+            sxx += w * x * x
+            sxy += w * x * offset
+
+        det = sw * sxx - sx * sx
+        if len(samples) < 3 or det <= 0:
+            self._a = sy / sw
+            self._b = 0.0
+        else:
+            self._b = (sw * sxy - sx * sy) / det
+            self._a = (sy - self._b * sx) / sw
+
+        self._h0 = h0
+        self._error = (1.0 / sw) ** 0.5
+
+    def IsReady(self):
+        return len(self._samples) > 0
+
+    def ToHost(self, stamp):
+        """
+        Converts a device timestamp into host time.
+
+        Args:
+            stamp (float): Device timestamp (epoch s)
+
+        Returns:
+            int: Host time (monotonic ns), or None without samples
+        """
+        if not self._samples:
+            return None
+
+        # stamp = h + a + b * (h - h0)
+        stamp += self._resolution / 2
+        host = (stamp - self._a + self._b * self._h0) / (1.0 + self._b)
+        return int(host * 1e9)
+
+    def ToEpoch(self, stamp):
+        """
+        Converts a device timestamp into the epoch time of
+        the host clock.
+
+        Args:
+            stamp (float): Device timestamp (epoch s)
+
+        Returns:
+            int: Epoch timestamp (ns), or None without samples
+        """
+        host = self.ToHost(stamp)
+        return None if host is None else to_epoch(host)
+
+    def GetModel(self):
+        """
+        Returns:
+            dict: Offset of the device clock from the epoch time of
+                  the host now (s), drift (ppm), error of the offset
+                  (s), samples used and resolution of the device
+                  stamps (s)
+        """
+        if not self._samples:
+            return {"offset": 0.0, "drift": 0.0, "error": 0.0,
+                    "samples": 0, "resolution": self._resolution}
+
+        now = time.monotonic_ns()
+        epoch = (time.time_ns() - now) / 1e9
+        now /= 1e9
+        return {"offset": self._a + self._b * (now - self._h0) - epoch,
+                "drift": self._b * 1e6,
+                "error": self._error,
+                "samples": len(self._samples),
+                "resolution": self._resolution}
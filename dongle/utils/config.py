@@ -0,0 +1,595 @@
+"""Configuration files.
+
+This file contains the classes that load the configuration files of
+the app ("app.json", "dongle_ui.json" and "protocol.json"). Each file
+is validated against its schema once and compiled into the form the
+app uses: VID/PID lookup table, transport profiles, button codes
+converted to bytes, pre-encoded frames for the auto-send buttons and
+the codecs of the commands.
+
+Compiled configurations are cached on disk, keyed by the modification
+time and hash of the file, so the next startup doesn't parse anything
+while the file stays the same.
+"""
+# Standard imports
+import os
+import errno
+import hashlib
+import pickle
+
+# Third Parties
+import rapidjson
+
+# Internal imports
+from dongle.utils.frames import FrameEncoder
+from dongle.utils.transport import PortProfile
+from dongle.utils.protocol import Protocol
+from dongle.utils.queues import POLICIES
+
+# Schema of each entry of "queues" in "app.json"
+_QUEUE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "size": {"type": "integer", "minimum": 1},
+        "policy": {"enum": list(POLICIES)},
+        "sample": {"type": "integer", "minimum": 1},
+        "batch": {"type": "integer", "minimum": 1}
+    }
+}
+
+# Bridge clients are fed by the reading thread, which can't wait
+_BRIDGE_QUEUE_SCHEMA = dict(_QUEUE_SCHEMA, properties=dict(
+    _QUEUE_SCHEMA["properties"],
+    policy={"enum": [p for p in POLICIES if p != "block"]}))
+
+# Schema of "app.json"
+APP_SCHEMA = {
+    "type": "object",
+    "required": ["title", "size", "info", "devices", "urls"],
+    "properties": {
+        "title": {"type": "string"},
+        "size": {
+            "type": "object",
+            "required": ["x", "y"],
+            "properties": {
+                "x": {"type": "integer"},
+                "y": {"type": "integer"}
+            }
+        },
+        "info": {"type": "object"},
+        "devices": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "VID", "PID"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "VID": {"type": "string",
+                            "pattern": "^0x[0-9A-Fa-f]{4}$"},
+                    "PID": {"type": "string",
+                            "pattern": "^0x[0-9A-Fa-f]{4}$"},
+                    "serial": {"type": "object"}
+                }
+            }
+        },
+        "urls": {"type": "object"},
+        "bridge": {
+            "type": "object",
+            "properties": {
+                "tcp": {"type": ["integer", "null"]},
+                "unix": {"type": ["string", "null"]},
+                "queue": {"type": "integer", "minimum": 1}
+            }
+        },
+        "scheduler": {
+            "type": "object",
+            "properties": {
+                "rate": {"type": "number", "minimum": 0,
+                         "exclusiveMinimum": True},
+                "burst": {"type": "number", "minimum": 1},
+                "queue": {"type": "integer", "minimum": 1},
+                "dutyCycle": {"type": "number", "minimum": 0,
+                              "exclusiveMinimum": True, "maximum": 1},
+                "window": {"type": "number", "minimum": 0,
+                           "exclusiveMinimum": True},
+                "airCommands": {"type": "array",
+                                "items": {"type": "string"}},
+                "lora": {
+                    "type": "object",
+                    "properties": {
+                        "sf": {"type": "integer", "minimum": 6,
+                               "maximum": 12},
+                        "bw": {"type": "number", "minimum": 0,
+                               "exclusiveMinimum": True},
+                        "cr": {"type": "integer", "minimum": 1,
+                               "maximum": 4},
+                        "preamble": {"type": "integer", "minimum": 0},
+                        "crc": {"type": "boolean"},
+                        "header": {"type": "boolean"}
+                    }
+                },
+                "flowControl": {
+                    "type": "object",
+                    "properties": {
+                        "enabled": {"type": "boolean"},
+                        "window": {"type": "number", "minimum": 1},
+                        "minWindow": {"type": "number", "minimum": 1},
+                        "maxWindow": {"type": "number", "minimum": 1},
+                        "increase": {"type": "number", "minimum": 0,
+                                     "exclusiveMinimum": True},
+                        "decrease": {"type": "number", "minimum": 0,
+                                     "exclusiveMinimum": True,
+                                     "maximum": 1,
+                                     "exclusiveMaximum": True},
+                        "ackTimeout": {"type": "number", "minimum": 0,
+                                       "exclusiveMinimum": True},
+                        "commands": {"type": "array",
+                                     "items": {"type": "string"}}
+                    }
+                }
+            }
+        },
+        "reconnect": {
+            "type": "object",
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "initial": {"type": "number", "minimum": 0,
+                            "exclusiveMinimum": True},
+                "max": {"type": "number", "minimum": 0,
+                        "exclusiveMinimum": True},
+                "factor": {"type": "number", "minimum": 1},
+                "timeout": {"type": "number", "minimum": 0},
+                "buffer": {"type": "integer", "minimum": 0}
+            }
+        },
+        "shm": {
+            "type": "object",
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "name": {"type": ["string", "null"]},
+                "slots": {"type": "integer", "minimum": 1},
+                "slotSize": {"type": "integer", "minimum": 32}
+            }
+        },
+        "isolation": {
+            "type": "object",
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "batch": {"type": "integer", "minimum": 1},
+                "interval": {"type": "number", "minimum": 0},
+                "startTimeout": {"type": "number", "minimum": 0,
+                                 "exclusiveMinimum": True},
+                "callTimeout": {"type": "number", "minimum": 0,
+                                "exclusiveMinimum": True}
+            }
+        },
+        "aggregation": {
+            "type": "object",
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "kinds": {
+                    "type": "object",
+                    "additionalProperties": {"type": "number", "minimum": 0}
+                }
+            }
+        },
+        "queues": {
+            "type": "object",
+            "properties": {
+                "ui": _QUEUE_SCHEMA,
+                "recorder": _QUEUE_SCHEMA,
+                "bridge": _BRIDGE_QUEUE_SCHEMA
+            }
+        },
+        "sessionDb": {
+            "type": "object",
+            "properties": {
+                "enabled": {"type": "boolean"},
+                "path": {"type": ["string", "null"]},
+                "batch": {"type": "integer", "minimum": 1},
+                "interval": {"type": "number", "minimum": 0,
+                             "exclusiveMinimum": True},
+                "queue": {"type": "integer", "minimum": 1},
+                "retention": {"type": "number", "minimum": 0}
+            }
+        },
+        "telemetry": {
+            "type": "object",
+            "properties": {
+                "capacity": {"type": "integer", "minimum": 1},
+                "window": {"type": "number", "minimum": 0,
+                           "exclusiveMinimum": True},
+                "fps": {"type": "number", "minimum": 0,
+                        "exclusiveMinimum": True},
+                "fields": {
+                    "type": "object",
+                    "additionalProperties": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["name", "index"],
+                            "properties": {
+                                "name": {"type": "string"},
+                                "index": {"type": "integer", "minimum": 0},
+                                "scale": {"type": "number"}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Schema of "dongle_ui.json"
+UI_SCHEMA = {
+    "type": "object",
+    "required": ["buttonsPerRaw", "verticalGap", "horizontalGap",
+                 "buttonsSize", "buttons", "input", "log", "search"],
+    "properties": {
+        "buttonsPerRaw": {"type": "integer", "minimum": 1},
+        "verticalGap": {"type": "integer"},
+        "horizontalGap": {"type": "integer"},
+        "buttonsSize": {
+            "type": "object",
+            "required": ["w", "h"]
+        },
+        "buttons": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["auto", "command", "txt", "byte"],
+                "properties": {
+                    "auto": {"enum": [0, 1]},
+                    "command": {"type": "string"},
+                    "txt": {"type": "string"},
+                    "byte": {"type": "string",
+                             "pattern": "^([0-9A-Fa-f]{2})+$"},
+                    "param": {"type": "string"},
+                    "repeat": {"type": "integer", "minimum": 1}
+                },
+                "anyOf": [
+                    {"properties": {"auto": {"enum": [0]}}},
+                    {"required": ["param"]}
+                ]
+            }
+        },
+        "input": {"type": "object"},
+        "log": {"type": "object"},
+        "search": {"type": "object"}
+    }
+}
+
+# Schema of a field of "protocol.json"
+_FIELD_SCHEMA = {
+    "type": "object",
+    "required": ["name", "type"],
+    "properties": {
+        "name": {"type": "string"},
+        "type": {"enum": ["int8", "uint8", "int16", "uint16", "int32",
+                          "uint32", "float", "double", "str", "bytes"]}
+    }
+}
+
+# Schema of "protocol.json"
+PROTOCOL_SCHEMA = {
+    "type": "object",
+    "required": ["commands"],
+    "properties": {
+        "commands": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "code": {"type": ["string", "null"],
+                             "pattern": "^[0-9A-Fa-f]{2}$"},
+                    "raw": {"type": "boolean"},
+                    "params": {"type": "array", "items": _FIELD_SCHEMA},
+                    "response": {"type": "array", "items": _FIELD_SCHEMA}
+                }
+            }
+        }
+    }
+}
+
+class CompiledConfig:
+    """
+    Base class of a compiled configuration file. Stores
+    the decoded data and the stamp of the file it was
+    compiled from, to know when it has to be reloaded.
+    """
+    # Schema of the file
+    SCHEMA = None
+
+    def __init__(self, path, stamp, data):
+        """
+        Args:
+            path (str): Path of the configuration file
+            stamp (tuple): Modification time, size and hash
+            data (dict): Decoded JSON data
+        """
+        self.path = path
+        self.stamp = stamp
+        self.data = data
+        self._compile(data)
+
+    def _compile(self, data):
+        """
+        Converts the decoded data into the form used by
+        the app. Overwritten by each configuration.
+
+        Args:
+            data (dict): Decoded JSON data
+        """
+        pass
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+class AppConfig(CompiledConfig):
+    """
+    Compiled "app.json". Has the registered devices
+    with their VID/PID already as bytes, a lookup
+    table from (VID, PID) to the device name, the
+    transport profile of each device, the telemetry
+    extraction rules, the bridge settings, the shared
+    memory ring settings, the TX scheduler settings,
+    the reconnection settings, the settings of the
+    worker process of the device, the settings of the
+    session database, the aggregation of the
+    repeated frames and the queues of the consumers
+    of the frames received.
+    """
+    SCHEMA = APP_SCHEMA
+
+    def _compile(self, data):
+        self.telemetry = data.get("telemetry", {})
+        self.bridge = data.get("bridge", {"tcp": 7000})
+        self.shm = data.get("shm", {"enabled": False})
+        self.scheduler = data.get("scheduler", {})
+        self.reconnect = data.get("reconnect", {})
+        self.isolation = data.get("isolation", {"enabled": False})
+        self.sessionDb = data.get("sessionDb", {"enabled": False})
+        self.aggregation = data.get("aggregation", {"enabled": False})
+        self.queues = data.get("queues", {})
+        self.devices = {}
+        self.lookup = {}
+        for dev in data["devices"]:
+            vid = bytes.fromhex(dev["VID"][2:])
+            pid = bytes.fromhex(dev["PID"][2:])
+            self.devices[dev["name"]] = {
+                "VID": vid,
+                "PID": pid,
+                "profile": PortProfile(dev.get("serial"))
+            }
+            self.lookup[(vid, pid)] = dev["name"]
+
+class UIConfig(CompiledConfig):
+    """
+    Compiled "dongle_ui.json". Buttons have their
+    command code converted to bytes and the auto-send
+    ones have their frame already encoded.
+    """
+    SCHEMA = UI_SCHEMA
+
+    # Frame encoder
+    _encoder = FrameEncoder()
+
+    def _compile(self, data):
+        self.buttons = []
+        for b in data["buttons"]:
+            code = bytes.fromhex(b["byte"])
+            button = {
+                "auto": b["auto"] == 1,
+                "command": b["command"],
+                "txt": b["txt"],
+                "code": code,
+                "param": b.get("param"),
+                "repeat": b.get("repeat"),
+                "frame": None
+            }
+
+            if button["auto"]:
+                # Reboot can only be sent as a byte-type trace
+                string = code != FrameEncoder.REBOOT
+                button["frame"] = self._encoder.Template(b["command"],
+                                                         code,
+                                                         b["param"],
+                                                         string)
+
+            self.buttons.append(button)
+
+class ProtocolConfig(CompiledConfig):
+    """
+    Compiled "protocol.json". Has the codecs of the
+    commands (Protocol), with their structs built.
+    """
+    SCHEMA = PROTOCOL_SCHEMA
+
+    def _compile(self, data):
+        self.protocol = Protocol(data)
+
+class ConfigCache:
+    """
+    This class loads configuration files, validating
+    and compiling them only when they changed since the
+    last time they were compiled.
+
+    The compiled form is kept in memory and in a cache
+    folder, next to the saved logs of the app.
+    """
+    # Increase when the compiled classes change
+    _version = 13
+
+    _cacheDir = None
+
+    # Compiled configurations in memory
+    _loaded = None
+
+    def __init__(self, cacheDir=None):
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.expanduser("~"),
+                                    'BHDYN/DynaLoRa-USBa/data/cache/')
+        self._cacheDir = os.path.abspath(cacheDir)
+        self._loaded = {}
+
+        if not os.path.exists(self._cacheDir):
+            try:
+                os.makedirs(self._cacheDir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def __cache_file(self, path):
+        """
+        Gets the name of the cache file of a configuration.
+
+        Args:
+            path (str): Path of the configuration file
+
+        Returns:
+            str: Path of the cache file
+        """
+        name = hashlib.sha1(path.encode()).hexdigest()[:12]
+        return os.path.join(self._cacheDir,
+                            os.path.basename(path) + "." + name + ".cache")
+
+    def __stat(self, path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def __read_cache(self, path, stat):
+        """
+        Reads the compiled configuration stored in the cache.
+        If the modification time changed but the hash is the
+        same, the cached one is still valid.
+
+        Args:
+            path (str): Path of the configuration file
+            stat (tuple): Modification time and size
+
+        Returns:
+            CompiledConfig: Cached configuration or None
+        """
+        try:
+            with open(self.__cache_file(path), 'rb') as f:
+                version, compiled = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ValueError):
+            return None
+
+        if version != self._version:
+            return None
+
+        if compiled.stamp[:2] == stat:
+            return compiled
+
+        # File touched, check if content changed
+        if compiled.stamp[1] == stat[1]:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if digest == compiled.stamp[2]:
+                compiled.stamp = stat + (digest,)
+                self.__write_cache(compiled)
+                return compiled
+
+        return None
+
+    def __write_cache(self, compiled):
+        try:
+            with open(self.__cache_file(compiled.path), 'wb') as f:
+                pickle.dump((self._version, compiled), f)
+        except OSError as e:
+            # Cache is only an optimization
+            print(e)
+
+    def __compile(self, path, kind, stat):
+        """
+        Validates the configuration file with its schema
+        and compiles it.
+
+        Raises:
+            rapidjson.ValidationError: File doesn't follow the schema.
+
+        Returns:
+            CompiledConfig: Compiled configuration
+        """
+        with open(path, 'rb') as f:
+            raw = f.read()
+
+        text = raw.decode('utf-8')
+        rapidjson.Validator(rapidjson.dumps(kind.SCHEMA))(text)
+        data = rapidjson.loads(text)
+
+        compiled = kind(path, stat + (hashlib.sha256(raw).hexdigest(),), data)
+        self.__write_cache(compiled)
+
+        return compiled
+
+    def Load(self, dirname, filename, kind):
+        """
+        Loads a configuration file. Uses the compiled
+        configuration in memory or in the cache folder
+        if the file didn't change, otherwise validates
+        and compiles it again.
+
+        Args:
+            dirname (str): Directory
+            filename (str): File name
+            kind (class): AppConfig, UIConfig or ProtocolConfig
+
+        Returns:
+            CompiledConfig: Compiled configuration
+        """
+        path = os.path.abspath(os.path.join(dirname, filename))
+        stat = self.__stat(path)
+
+        compiled = self._loaded.get(path)
+        if compiled is None or compiled.stamp[:2] != stat:
+            compiled = self.__read_cache(path, stat)
+            if compiled is None or not isinstance(compiled, kind):
+                compiled = self.__compile(path, kind, stat)
+
+        self._loaded[path] = compiled
+
+        return compiled
+
+    def HasChanged(self, compiled):
+        """
+        Checks if the file of a compiled configuration was
+        modified since it was compiled. Only looks at the file
+        status, so it can be called often.
+
+        Args:
+            compiled (CompiledConfig): Compiled configuration
+
+        Returns:
+            bool: Whether the file changed
+        """
+        try:
+            return self.__stat(compiled.path) != compiled.stamp[:2]
+        except OSError:
+            return False
+
+    def Reload(self, compiled):
+        """
+        Hot reload of a configuration.
+
+        Args:
+            compiled (CompiledConfig): Compiled configuration
+
+        Returns:
+            CompiledConfig: New compiled configuration, or None
+                            when the content didn't change.
+        """
+        if not self.HasChanged(compiled):
+            return None
+
+        dirname, filename = os.path.split(compiled.path)
+        new = self.Load(dirname, filename, type(compiled))
+        if new.stamp[2] == compiled.stamp[2]:
+            return None
+
+        return new
@@ -3,15 +3,28 @@
 This file contains the different events needed for the app to work 
 correctly. This events are self-made and integrated with wxPython's
 events. 
+
+It also contains EventPump, that sends the events of a device to the
+GUI through a bounded queue instead of posting each of them to the wx
+event queue, which has no limit.
 """
+# Standard imports
+import threading
+
 # WX import
 import wx
 import wx.lib.newevent as ne
 
+# Internal imports
+from dongle.utils.queues import BoundedQueue
+
 # Serial CONNECTION events
 SerialCTrue, EVT_SERIALC = ne.NewEvent()
 SerialCError, EVT_SERIALCE = ne.NewEvent()
 SerialCDisconnect, EVT_SERIALD = ne.NewEvent()
+SerialCFalse, EVT_SERIALCF = ne.NewEvent()
+SerialCLost, EVT_SERIALCL = ne.NewEvent()
+SerialCReconnect, EVT_SERIALCR = ne.NewEvent()
 SERIALC = wx.NewEventType()
 
 # Serial READING events
@@ -19,11 +32,13 @@ SerialREvent, EVT_SERIALR = ne.NewEvent()
 SerialRError, EVT_SERIALRE = ne.NewEvent()
 SerialRMessage, EVT_SERIALRM = ne.NewEvent()
 SerialRFrameErr, EVT_SERIALFE = ne.NewEvent()
+SerialRRepeat, EVT_SERIALRR = ne.NewEvent()
 SERIALR = wx.NewEventType()
 
 # Serial WRITING events
 SerialWEvent, EVT_SERIALW = ne.NewEvent()
 SerialWErr, EVT_SERIALWE = ne.NewEvent()
+SerialWRepeat, EVT_SERIALWR = ne.NewEvent()
 SERIALW = wx.NewEventType()
 
 # Device connection MENU events
@@ -37,4 +52,74 @@ TEVENT = wx.NewEventType()
 
 # Button events
 ButtonSelectedEvent, EVT_SELECT = ne.NewEvent()
-BUEVENT = wx.NewEventType()
\ No newline at end of file
+BUEVENT = wx.NewEventType()
+
+class EventPump:
+    """
+    Sends events to a wx listener through a bounded queue.
+    At most one call is waiting in the wx event queue: it
+    processes a batch of the events queued and, if more
+    are left, schedules the next one, so the GUI keeps
+    handling its other events between batches.
+    """
+#region Variables
+    _listener = None
+    _queue: BoundedQueue = None
+    _batch = 256
+    _lock: threading.Lock = None
+    _scheduled = False
+#endregion
+
+    def __init__(self, listener, queue, batch=256):
+        """
+        Args:
+            listener (wx.Window): Listener of the events
+            queue (BoundedQueue): Queue of the events
+            batch (int, optional): Events processed per call.
+        """
+        self._listener = listener
+        self._queue = queue
+        self._batch = batch
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def Post(self, event, force=False):
+        """
+        Queues an event. The "block" policy never waits in
+        the GUI thread, which is the one emptying the queue.
+
+        Args:
+            event (wx.PyEvent): Event
+            force (bool, optional): Never drop it (connection
+                                    and error events).
+        """
+        if self._queue.Put(event, force or wx.IsMainThread()):
+            self.__schedule()
+
+    def __schedule(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        wx.CallAfter(self.__drain)
+
+    def __drain(self):
+        # The window may be closed
+        if not self._listener:
+            return
+
+        # Still scheduled while the batch runs: a handler that opens
+        # a modal dialog runs the event loop, and another call would
+        # handle the newer events before the rest of this batch
+        try:
+            handler = self._listener.GetEventHandler()
+            for event in self._queue.GetBatch(self._batch):
+                handler.ProcessEvent(event)
+        finally:
+            with self._lock:
+                self._scheduled = False
+        if len(self._queue):
+            self.__schedule()
+
+    def GetStats(self):
+        return self._queue.GetStats()
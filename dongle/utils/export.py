@@ -0,0 +1,338 @@
+"""Session export.
+
+This file contains the classes that export a session (the records of
+the log) or a capture to a columnar file, with typed columns, ready to
+be loaded with pandas, polars or numpy without parsing text:
+
+    time       int64       Epoch timestamp (ns)
+    direction  string      "in", "out" or "system"
+    kind       string      Type of the line or frame
+    command    string      Command name (null if none)
+    params     list<str>   Parameters of the command
+    raw        binary      Bytes received or sent (null if none)
+    source     string      Device or capture of the row (null if only one)
+
+Rows are written in groups of a fixed size while they are read, so the
+memory used doesn't depend on the length of the session.
+
+Formats:
+    .parquet   Parquet, one row group per group of rows (needs pyarrow)
+    .arrow     Arrow IPC file, one record batch per group (needs pyarrow)
+    .npz       NumPy archive, used too when pyarrow isn't installed
+
+Strings and lists can't be stored in .npy files without pickle, so in
+the NPZ archive direction, kind, command and source are codes into the
+arrays "directions", "kinds", "commands" and "sources" (-1 is none for
+command and source), and params
+and raw are the bytes of all rows one after the other, with the end
+offset of each row:
+
+    params of row i: params_data[params_end[i-1]:params_end[i]],
+                     utf-8 and separated by ";"
+    raw of row i:    raw_data[raw_end[i-1]:raw_end[i]]
+"""
+# Standard imports
+import os
+import shutil
+import zipfile
+import tempfile
+
+# Third parties
+import numpy as np
+
+# pyarrow is optional, NPZ is used without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Internal imports
+from dongle.utils.capture import CaptureReader
+from dongle.utils.frames import FrameDecoder
+
+class _ArrowWriter:
+    """
+    Writes groups of rows into a Parquet or Arrow IPC
+    file with pyarrow.
+    """
+    def __init__(self, path, parquet):
+        # Parquet encodes the repeated strings as dictionaries itself
+        self._schema = pa.schema([
+            ("time", pa.int64()),
+            ("direction", pa.string()),
+            ("kind", pa.string()),
+            ("command", pa.string()),
+            ("params", pa.list_(pa.string())),
+            ("raw", pa.binary()),
+            ("source", pa.string())
+        ])
+        if parquet:
+            self._writer = pq.ParquetWriter(path, self._schema,
+                                            compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(path, self._schema)
+
+    def WriteGroup(self, times, directions, kinds, commands, params, raws,
+                   sources):
+        batch = pa.record_batch([
+            pa.array(times, pa.int64()),
+            pa.array(directions, pa.string()),
+            pa.array(kinds, pa.string()),
+            pa.array(commands, pa.string()),
+            pa.array(params, pa.list_(pa.string())),
+            pa.array(raws, pa.binary()),
+            pa.array(sources, pa.string())
+        ], schema=self._schema)
+        self._writer.write_batch(batch)
+
+    def Close(self):
+        self._writer.close()
+
+class _NpzWriter:
+    """
+    Writes groups of rows into a NumPy archive. Columns
+    are appended to temporary files, and copied into the
+    archive when it's closed, so only one group of rows
+    is in memory at a time.
+    """
+#region Variables
+    # Columns of fixed size, name -> dtype
+    _columns = {
+        "time": np.int64,
+        "direction": np.int8,
+        "kind": np.int8,
+        "command": np.int32,
+        "params_end": np.int64,
+        "params_data": np.uint8,
+        "raw_end": np.int64,
+        "raw_data": np.uint8,
+        "source": np.int32
+    }
+#endregion
+
+    def __init__(self, path):
+        self._path = path
+        self._tmp = tempfile.mkdtemp(prefix="dynalora-export-")
+        self._files = {name: open(os.path.join(self._tmp, name), 'wb')
+                       for name in self._columns}
+        self._counts = dict.fromkeys(self._columns, 0)
+        self._codes = {"direction": {}, "kind": {}, "command": {},
+                       "source": {}}
+        self._paramsEnd = 0
+        self._rawEnd = 0
+
+    def __code(self, column, value):
+        if value is None:
+            return -1
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def __append(self, name, values):
+        array = np.asarray(values, dtype=self._columns[name])
+        self._files[name].write(array.tobytes())
+        self._counts[name] += len(array)
+
+    def WriteGroup(self, times, directions, kinds, commands, params, raws,
+                   sources):
+        self.__append("time", times)
+        self.__append("direction",
+                      [self.__code("direction", d) for d in directions])
+        self.__append("kind", [self.__code("kind", k) for k in kinds])
+        self.__append("command",
+                      [self.__code("command", c) for c in commands])
+
+        data = [";".join(p).encode() for p in params]
+        ends = np.cumsum([len(d) for d in data], dtype=np.int64) \
+            + self._paramsEnd
+        if len(ends):
+            self._paramsEnd = int(ends[-1])
+        self.__append("params_end", ends)
+        self.__append("params_data", np.frombuffer(b"".join(data),
+                                                   dtype=np.uint8))
+
+        data = [r or b"" for r in raws]
+        ends = np.cumsum([len(d) for d in data], dtype=np.int64) \
+            + self._rawEnd
+        if len(ends):
+            self._rawEnd = int(ends[-1])
+        self.__append("raw_end", ends)
+        self.__append("raw_data", np.frombuffer(b"".join(data),
+                                                dtype=np.uint8))
+        self.__append("source", [self.__code("source", s) for s in sources])
+
+    def __names(self, column):
+        # Names of the codes, sorted by code
+        codes = self._codes[column]
+        return np.array(sorted(codes, key=codes.get), dtype=np.str_)
+
+    def Close(self):
+        for f in self._files.values():
+            f.close()
+
+        try:
+            with zipfile.ZipFile(self._path, 'w', zipfile.ZIP_DEFLATED,
+                                 allowZip64=True) as archive:
+                for name, dtype in self._columns.items():
+                    header = {"descr": np.lib.format.dtype_to_descr(
+                                  np.dtype(dtype)),
+                              "fortran_order": False,
+                              "shape": (self._counts[name],)}
+                    with archive.open(name + ".npy", 'w',
+                                      force_zip64=True) as out, \
+                         open(os.path.join(self._tmp, name), 'rb') as data:
+                        np.lib.format.write_array_header_1_0(out, header)
+                        shutil.copyfileobj(data, out, 1 << 20)
+
+                for column, name in (("direction", "directions"),
+                                     ("kind", "kinds"),
+                                     ("command", "commands"),
+                                     ("source", "sources")):
+                    with archive.open(name + ".npy", 'w') as out:
+                        np.lib.format.write_array(out, self.__names(column))
+        finally:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+class SessionExporter:
+    """
+    This class exports records to a columnar file. The
+    format is chosen from the extension of the file, and
+    falls back to NPZ when pyarrow is not installed (the
+    extension is changed then).
+
+    Rows are buffered and written every "group" rows.
+    """
+#region Variables
+    _writer = None
+    _group = 65536
+    _rows = 0
+
+    # Columns of the group being filled
+    _times = None
+    _directions = None
+    _kinds = None
+    _commands = None
+    _params = None
+    _raws = None
+    _sources = None
+#endregion
+
+    def __init__(self, path, group=65536):
+        """
+        Args:
+            path (str): Path of the file (.parquet, .arrow or .npz)
+            group (int, optional): Rows per group. Defaults to 65536.
+        """
+        root, extension = os.path.splitext(path)
+        extension = extension.lower()
+        if extension not in (".parquet", ".arrow", ".npz"):
+            extension = ".parquet"
+        if pa is None:
+            extension = ".npz"
+
+        self.path = root + extension
+        if extension == ".npz":
+            self._writer = _NpzWriter(self.path)
+        else:
+            self._writer = _ArrowWriter(self.path, extension == ".parquet")
+
+        self._group = group
+        self._rows = 0
+        self.__reset()
+
+    def __reset(self):
+        self._times = []
+        self._directions = []
+        self._kinds = []
+        self._commands = []
+        self._params = []
+        self._raws = []
+        self._sources = []
+
+    def Write(self, t, direction, kind, command=None, params=None, raw=None,
+              source=None):
+        """
+        Adds a row.
+
+        Args:
+            t (int): Epoch timestamp (ns)
+            direction (str): "in", "out" or "system"
+            kind (str): Type of the line or frame
+            command (str, optional): Command name. Defaults to None.
+            params (list, optional): Parameters. Defaults to None.
+            raw (bytes, optional): Frame bytes. Defaults to None.
+            source (str, optional): Device or capture. Defaults to None.
+        """
+        self._times.append(t)
+        self._directions.append(direction)
+        self._kinds.append(kind)
+        self._commands.append(command)
+        self._params.append([str(p) for p in params] if params else [])
+        self._raws.append(bytes(raw) if raw is not None else None)
+        self._sources.append(source)
+        if len(self._times) >= self._group:
+            self.Flush()
+
+    def WriteRecords(self, records):
+        """
+        Adds the records of a log (LogStore).
+
+        Args:
+            records (iterable): LogRecords
+        """
+        for r in records:
+            self.Write(r.time, r.direction, r.kind, r.command,
+                       r.params, r.raw)
+
+    def WriteCapture(self, path):
+        """
+        Adds the frames of a capture, reading it frame by frame.
+
+        Args:
+            path (str): Path of the capture
+        """
+        decoder = FrameDecoder()
+        for t, direction, data in CaptureReader(path):
+            kind, command, params = decoder.Classify(data)
+            self.Write(t, direction, kind, command, params, data)
+
+    def WriteFrames(self, frames):
+        """
+        Adds frames of several sources, like the merged
+        stream of some captures.
+
+        Args:
+            frames (iterable): Tuples (timestamp in ns, source,
+                               direction, frame bytes)
+        """
+        decoder = FrameDecoder()
+        for t, source, direction, data in frames:
+            kind, command, params = decoder.Classify(data)
+            self.Write(t, direction, kind, command, params, data, source)
+
+    def Flush(self):
+        """
+        Writes the rows buffered as a group.
+        """
+        if not self._times:
+            return
+
+        self._writer.WriteGroup(self._times, self._directions, self._kinds,
+                                self._commands, self._params, self._raws,
+                                self._sources)
+        self._rows += len(self._times)
+        self.__reset()
+
+    def GetRows(self):
+        return self._rows
+
+    def Close(self):
+        """
+        Writes the last rows and closes the file.
+        """
+        self.Flush()
+        self._writer.Close()
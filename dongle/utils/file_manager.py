@@ -113,6 +113,50 @@ class Saver:
     def GetSavingDir(self):
         return self._savingDir
         
+    def GetCaptureFile(self):
+        """
+        Creates the name of a new capture file in the saving
+        folder, named after the current time.
+
+        Returns:
+            str: Path of the capture file
+        """
+        t = time.localtime()
+        return os.path.join(self._savingDir, 
+                            time.strftime("%Y%m%d%H%M%S", t) + ".cap")
+    
+    def GetOverloadLog(self):
+        """
+        Creates the name of the file where the lines not
+        shown while the log is overloaded are written, in 
+        the saving folder (created if needed).
+
+        Returns:
+            str: Path of the file
+        """
+        os.makedirs(self._savingDir, exist_ok=True)
+        t = time.localtime()
+        return os.path.join(self._savingDir, 
+                            time.strftime("%Y%m%d%H%M%S", t) 
+                            + "-overload.log")
+    
+    def GetSessionDB(self, path=None):
+        """
+        Path of the session database. By default it's in
+        the saving folder, that is created if needed.
+
+        Args:
+            path (str, optional): Path set in the configuration
+
+        Returns:
+            str: Path of the database
+        """
+        if path:
+            return os.path.expanduser(path)
+        
+        os.makedirs(self._savingDir, exist_ok=True)
+        return os.path.join(self._savingDir, "sessions.db")
+        
     def SaveTextLog(self, data):
         """
         Saves data into a file generated in a specific location
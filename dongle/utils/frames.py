@@ -0,0 +1,340 @@
+"""Frame encoding.
+
+This file contains the classes that build the frames sent to the
+device. FrameEncoder creates the string-type and byte-type frames
+from a Trace, and FrameTemplate stores a frame that was encoded
+once and only needs the timestamp to be sent. FrameDecoder does the
+opposite for tools that read raw frames (captures, exports).
+"""
+# Standard imports
+import struct
+from collections import namedtuple
+
+# Internal imports
+from dongle.utils.bytes_data import ByteCodes
+
+# Fields of a byte-type frame
+#   start: SOF (sent) or SOF_R (received)
+#   length: Length of the parameters (None in short frames, like the ACK)
+#   command: Command code (None in short frames)
+#   params: Parameters
+#   checksum: Checksum of the frame
+#   valid: Whether the checksum is right (sent frames are not checked)
+BinaryFields = namedtuple("BinaryFields", ["start", "length", "command",
+                                           "params", "checksum", "valid"])
+
+class FrameTemplate:
+    """
+    Pre-encoded frame. Stores the bytes of a frame
+    that never changes except for the timestamp at the
+    end of string-type frames, so sending it only needs
+    to patch that value in.
+    """
+    __slots__ = ("command", "prefix", "stamped")
+
+    def __init__(self, command, prefix, stamped):
+        """
+        Args:
+            command (str): Command name of the frame
+            prefix (bytes): Encoded frame, up to the timestamp
+            stamped (bool): Whether the timestamp is appended
+        """
+        self.command = command
+        self.prefix = prefix
+        self.stamped = stamped
+
+    def Stamp(self, t):
+        """
+        Creates the frame to send with the timestamp given.
+
+        Args:
+            t (timestamp): Epoch Unix timestamp
+
+        Returns:
+            bytes: Frame ready to write
+        """
+        if self.stamped:
+            return self.prefix + b"%d" % int(t)
+
+        return self.prefix
+
+class FrameEncoder:
+    """
+    Class that creates the frames that are sent to
+    the device, in string mode or in byte mode.
+
+    With a Protocol, the parameters of byte-type
+    frames are encoded with the types of the command,
+    and the commands marked as "raw" are sent without
+    frame, like the reboot.
+    """
+    # Command code of the reboot, sent without frame
+    REBOOT = b'\x04'
+
+    # Byte sent before the reboot command
+    _interrupt = b'\x03'
+
+    # Codecs of the commands ("protocol.json")
+    _protocol = None
+
+    def __init__(self, protocol=None):
+        """
+        Args:
+            protocol (Protocol, optional): Compiled "protocol.json"
+        """
+        self._protocol = protocol
+
+    def StringPrefix(self, command, params):
+        """
+        Encodes a string-type frame up to the timestamp:
+        'DLC;<number of params>;<command>;<params>;'
+
+        Args:
+            command (str): Command name
+            params (str): Parameters separated by ;
+
+        Returns:
+            bytes: Encoded frame without timestamp
+        """
+        length = len(str(params).split(";"))
+
+        return 'DLC;{leng};{comm};{pld};'.format(
+            leng=length,
+            comm=command,
+            pld=str(params)
+        ).encode()
+
+    def ByteFrame(self, code, params):
+        """
+        Encodes a byte-type frame:
+        SOF | length (<H) | command | params | CRC16 | EOF
+
+        The reboot command is the exception, it's only the
+        interrupt byte and the command code.
+
+        Args:
+            code (bytes): Command code
+            params (bytes): Parameters codified as bytes
+
+        Returns:
+            bytes: Encoded frame
+        """
+        if code == self.REBOOT:
+            return self._interrupt + code
+
+        params = bytes(params or b"")
+        data = struct.pack('<H', len(params)) + bytes(code) + params
+        checksum = ByteCodes.crc16(data)
+
+        return (bytes([ByteCodes.SOF]) + data
+                + checksum.to_bytes(2, "big")
+                + bytes([ByteCodes.EOF]))
+
+    def Template(self, command, code, params, string):
+        """
+        Encodes a frame once, to be reused later.
+
+        Args:
+            command (str): Command name
+            code (bytes): Command code
+            params (str/bytes): Parameters of the command
+            string (bool): String-type or byte-type frame
+
+        Returns:
+            FrameTemplate: Pre-encoded frame
+        """
+        if string:
+            return FrameTemplate(command,
+                                 self.StringPrefix(command, params),
+                                 True)
+
+        return FrameTemplate(command, self.ByteFrame(code, params), False)
+
+    def Encode(self, trace):
+        """
+        Encodes a trace into the frame to send.
+
+        Args:
+            trace (Trace): Trace to send
+
+        Returns:
+            bytes: Encoded frame
+        """
+        if trace.GetIsString():
+            return (self.StringPrefix(trace.GetCommand(), trace.GetParams())
+                    + str(trace.GetTimeStamp()).encode())
+
+        codec = self._protocol and self._protocol.Get(trace.GetCommand())
+        if codec is None:
+            return self.ByteFrame(trace.GetCommandCode(),
+                                  trace.GetParamBytes())
+
+        code = codec.code or trace.GetCommandCode()
+        if codec.raw:
+            return self._interrupt + code
+        return self.ByteFrame(code, codec.PackParams(trace.GetParams()))
+
+def _starts(frame, prefix):
+    # memoryviews don't have startswith, compare a view
+    if type(frame) is memoryview:
+        return frame[:len(prefix)] == prefix
+    return frame.startswith(prefix)
+
+def _ends(frame, suffix, end):
+    if type(frame) is memoryview:
+        return frame[end - len(suffix):end] == suffix
+    return frame.endswith(suffix, 0, end)
+
+class FrameDecoder:
+    """
+    Class that tells the type, command and parameters
+    of a raw frame, sent or received.
+
+    Kind is the check of the reading thread, so it works
+    on bytes and memoryviews without decoding or copying
+    the frame. Classify also reads the command and the
+    parameters, for tools that process saved frames.
+    """
+    # Prefixes and suffixes of the string-type frames
+    _response = b"DLR;"
+    _responseEnd = b";EOR"
+    _message = b"DLM;"
+    _messageEnd = b";EOM"
+    _command = b"DLC;"
+    _overflow = b"Overflow"
+
+    # Trailing bytes of a line
+    _newLine = (0x0A, 0x0D)
+
+    def Kind(self, frame):
+        """
+        Classifies a frame in one pass, ignoring the line end:
+
+            response: DLR;<n>;<command>;<params>;<timestamp>;EOR
+            message:  DLM;...;EOM
+            command:  DLC;<n>;<command>;<params>;<timestamp>
+            binary:   SOF(_R) | length | command | ... | checksum | EOF(_R)
+            overflow: Overflow message of the device
+            error:    Malformed frame, or wrong checksum
+            text:     Any other line
+
+        The checksum of the binary frames received is the sum
+        of the bytes between SOF_R and the checksum (16 bits,
+        big-endian). It's computed over a view of the frame.
+
+        Args:
+            frame (bytes/memoryview): Frame
+
+        Returns:
+            str: Kind of the frame
+        """
+        end = len(frame)
+        while end and frame[end - 1] in self._newLine:
+            end -= 1
+        if end == 0:
+            return "text"
+
+        first = frame[0]
+        if first == ByteCodes.SOF_R:
+            if end < 5 or frame[end - 1] != ByteCodes.EOF_R:
+                return "error"
+            checksum = (frame[end - 3] << 8) | frame[end - 2]
+            # The sum doesn't include EOF_R (the old validation added
+            # it). The device answers with ByteCodes.ACK, whose
+            # checksum is 0, so only this rule accepts it
+            if sum(memoryview(frame)[1:end - 3]) & 0xFFFF != checksum:
+                return "error"
+            return "binary"
+
+        if first == ByteCodes.SOF:
+            # Sent frames, the CRC is not checked
+            if end < 5 or frame[end - 1] != ByteCodes.EOF:
+                return "error"
+            return "binary"
+
+        if _starts(frame, self._response):
+            if _ends(frame, self._responseEnd, end):
+                return "response"
+            return "error"
+
+        if _starts(frame, self._message):
+            if _ends(frame, self._messageEnd, end):
+                return "message"
+            return "error"
+
+        if _starts(frame, self._command):
+            return "command"
+
+        # Rare path, only lines that are not frames get here
+        data = frame.tobytes() if type(frame) is memoryview else frame
+        if self._overflow in data:
+            return "overflow"
+
+        return "text"
+
+    def Classify(self, data):
+        """
+        Reads the type, command and parameters of a frame.
+        Types are the ones of Kind. Binary frames too short
+        to have a command (like the ACK) are named "ACK".
+
+        Args:
+            data (bytes): Frame
+
+        Returns:
+            tuple: (kind, command, params list)
+        """
+        data = bytes(data).rstrip(b"\r\n")
+        kind = self.Kind(data)
+
+        if kind == "binary":
+            if len(data) < 7:
+                # Too short to have a command (see Fields), data[3]
+                # is part of the checksum
+                return kind, "ACK", []
+            return kind, "0x%02X" % data[3], []
+
+        if kind in ("response", "command") or _starts(data, self._response):
+            fields = data.decode("utf-8", "replace").split(";")
+            command = fields[2] if len(fields) > 2 else None
+            if kind == "command":
+                return kind, command, fields[3:len(fields) - 1]
+            if kind == "response":
+                return kind, command, fields[3:len(fields) - 2]
+            return kind, command, []
+
+        return kind, None, []
+
+    def Fields(self, data):
+        """
+        Splits a byte-type frame into its fields:
+
+            SOF(_R) | length (<H) | command | params | checksum | EOF(_R)
+
+        Frames too short to have a length and a command
+        (like the ACK) only have the start, params and
+        checksum. Frames with a wrong checksum are split
+        too, to inspect them.
+
+        Args:
+            data (bytes): Binary frame
+
+        Returns:
+            BinaryFields: Fields of the frame, or None if it's not
+                          a byte-type frame
+        """
+        data = bytes(data).rstrip(b"\r\n")
+        if len(data) < 5 or data[0] not in (ByteCodes.SOF_R, ByteCodes.SOF):
+            return None
+
+        end = len(data)
+        checksum = (data[end - 3] << 8) | data[end - 2]
+        valid = (data[0] == ByteCodes.SOF
+                 or sum(data[1:end - 3]) & 0xFFFF == checksum)
+        if end < 7:
+            return BinaryFields(data[0], None, None, data[1:end - 3],
+                                checksum, valid)
+
+        length = data[1] | (data[2] << 8)
+        return BinaryFields(data[0], length, data[3], data[4:end - 3],
+                            checksum, valid)
@@ -0,0 +1,211 @@
+"""Hex dumps.
+
+This file contains the formatting of raw frames as hex/ASCII dumps and
+the store of the binary frames shown in the binary view. Formatting is
+done by batches: the frames of a batch are joined and converted once
+with bytes.hex and bytes.translate (with a precomputed table of the
+printable characters), so the per-frame work is only slicing the two
+strings, and the cost of a batch doesn't depend on the number of bytes.
+
+The store keeps the last frames received and formats them lazily, by
+blocks of rows, when the view asks for a row of the block. Frames that
+are never on screen are never formatted.
+"""
+# Standard imports
+import time
+import threading
+from collections import deque, OrderedDict
+from itertools import islice
+from datetime import datetime
+
+# Internal imports
+from dongle.utils.frames import FrameDecoder
+
+# Byte -> ASCII character, "." for the ones that are not printable
+_printable = bytes(b if 0x20 <= b < 0x7F else 0x2E for b in range(256))
+
+def hex_ascii(frames):
+    """
+    Formats a batch of frames as hex and ASCII strings,
+    converting the whole batch at once.
+
+    Args:
+        frames (list): Frames (bytes)
+
+    Returns:
+        list: (hex, ascii) strings of each frame
+    """
+    data = b"".join(frames)
+    hexs = data.hex(" ")
+    ascii = data.translate(_printable).decode("ascii")
+
+    rows = []
+    start = 0
+    for frame in frames:
+        end = start + len(frame)
+        # Each byte is two digits and a space, except the last one
+        # (empty frames have no digits)
+        rows.append((hexs[3 * start:max(3 * end - 1, 3 * start)],
+                     ascii[start:end]))
+        start = end
+
+    return rows
+
+def hex_dump(data, width=16):
+    """
+    Formats a frame as the lines of a classic hex dump:
+
+        0000  f1 05 00 12 ...  |......|
+
+    Args:
+        data (bytes): Frame
+        width (int, optional): Bytes per line. Defaults to 16.
+
+    Returns:
+        str: Lines of the dump
+    """
+    data = bytes(data)
+    lines = hex_ascii([data[i:i + width]
+                       for i in range(0, len(data), width)])
+    return "\n".join("%04x  %-*s  |%s|" % (i * width, width * 3 - 1, h, a)
+                     for i, (h, a) in enumerate(lines))
+
+def describe(fields):
+    """
+    Short text of the fields of a binary frame.
+
+    Args:
+        fields (BinaryFields): Fields of the frame (or None)
+
+    Returns:
+        str: Command, length, checksum and whether it's right
+    """
+    if fields is None:
+        return "not a binary frame"
+
+    check = "ok" if fields.valid else "WRONG"
+    if fields.command is None:
+        return "short frame, checksum 0x%04X %s" % (fields.checksum, check)
+    return "cmd 0x%02X, len %d, checksum 0x%04X %s" % (
+        fields.command, fields.length, fields.checksum, check)
+
+class HexDump:
+    """
+    Last binary frames, formatted on demand for a
+    virtual list. Frames are appended from the GUI
+    thread; the rows are formatted by blocks and the
+    last blocks formatted are cached.
+    """
+#region Variables
+    # Columns of each row
+    COLUMNS = ("Time", "Dir", "Fields", "Hex", "ASCII")
+
+    _frames: deque = None
+    _lock: threading.Lock = None
+
+    # Absolute number of the first frame kept
+    _first = 0
+
+    # Rows formatted at once, and blocks kept
+    _block = 64
+    _cache: OrderedDict = None
+    _blocks = 32
+
+    _decoder = FrameDecoder()
+#endregion
+
+    def __init__(self, capacity=100000, block=64):
+        """
+        Args:
+            capacity (int, optional): Frames kept. Defaults to 100000.
+            block (int, optional): Rows formatted at once.
+        """
+        self._frames = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._block = block
+        self._cache = OrderedDict()
+        self._first = 0
+
+    def Append(self, data, direction="in", t=None):
+        """
+        Adds a frame. It isn't formatted until it's shown.
+
+        Args:
+            data (bytes): Frame
+            direction (str, optional): "in" or "out"
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+        """
+        with self._lock:
+            frames = self._frames
+            if len(frames) == frames.maxlen:
+                self._first += 1
+            frames.append((t or time.time_ns(), direction, bytes(data)))
+
+    def __len__(self):
+        return len(self._frames)
+
+    def GetTotal(self):
+        """
+        Returns:
+            int: Frames appended since the start (kept or not)
+        """
+        return self._first + len(self._frames)
+
+    def Clear(self):
+        with self._lock:
+            self._first += len(self._frames)
+            self._frames.clear()
+            self._cache.clear()
+
+    def GetRow(self, index):
+        """
+        Formatted row of a frame. The whole block of the
+        row is formatted when one of its rows is asked.
+
+        Args:
+            index (int): Position of the frame (0 is the oldest kept)
+
+        Returns:
+            tuple: Text of each column (see COLUMNS)
+        """
+        with self._lock:
+            position = self._first + index
+            block = position // self._block
+            row = position - block * self._block
+            rows = self._cache.get(block)
+            if rows is None or row >= len(rows):
+                # New block, or the last one got more frames
+                rows = self.__format(block)
+            else:
+                self._cache.move_to_end(block)
+
+        if row < len(rows):
+            return rows[row]
+        return ("",) * len(self.COLUMNS)
+
+    def GetText(self, index, column):
+        return self.GetRow(index)[column]
+
+    def __format(self, block):
+        """
+        Formats the rows of a block (lock held).
+        """
+        start = max(block * self._block - self._first, 0)
+        end = min((block + 1) * self._block - self._first, len(self._frames))
+        frames = list(islice(self._frames, start, end))
+
+        dumps = hex_ascii([data for _, _, data in frames])
+        rows = [(datetime.fromtimestamp(t / 1e9).strftime("%H:%M:%S.%f"),
+                 direction, describe(self._decoder.Fields(data)), h, a)
+                for (t, direction, data), (h, a) in zip(frames, dumps)]
+
+        # Rows of the block before the first frame kept
+        missing = self._first - block * self._block
+        if missing > 0:
+            rows = [("",) * len(self.COLUMNS)] * missing + rows
+
+        self._cache[block] = rows
+        self._cache.move_to_end(block)
+        if len(self._cache) > self._blocks:
+            self._cache.popitem(last=False)
+        return rows
@@ -0,0 +1,146 @@
+"""Latency tracing.
+
+This file contains the class LatencyTracer, that keeps the latency of
+each step ("span") that a frame goes through, from the host timestamps
+taken with time.monotonic_ns():
+
+    decode:   bytes read from the port -> frame classified
+    dispatch: frame classified -> GUI handler started (subscribers,
+              capture, telemetry, worker channel and wx event queue)
+    render:   GUI handler started -> line written in the log
+    total:    bytes read from the port -> line written in the log
+    write:    write system call of a frame sent
+
+Each span keeps its count, mean and max since it started, and the last
+samples to compute percentiles.
+"""
+# Standard imports
+import time
+from collections import deque
+
+def to_epoch(t):
+    """
+    Converts a monotonic timestamp (ns) of this boot into an
+    epoch timestamp (ns), for logs and captures.
+
+    Args:
+        t (int): time.monotonic_ns() value
+
+    Returns:
+        int: Epoch timestamp (ns)
+    """
+    return time.time_ns() - time.monotonic_ns() + t
+
+class _Span:
+    """
+    Latencies of one span.
+    """
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self, samples):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.samples = deque(maxlen=samples)
+
+    def Add(self, ns):
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        self.samples.append(ns)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Count, and mean, p50, p99 and max in microseconds
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p99": 0.0,
+                    "max": 0.0}
+
+        last = len(samples) - 1
+        return {"count": self.count,
+                "mean": self.total / self.count / 1000,
+                "p50": samples[last // 2] / 1000,
+                "p99": samples[last * 99 // 100] / 1000,
+                "max": self.max / 1000}
+
+class LatencyTracer:
+    """
+    This class keeps the latency spans of the frames.
+    Spans are added from any thread; a span only
+    has one writer thread, so there's no lock.
+    """
+#region Variables
+    SPANS = ("decode", "dispatch", "render", "total", "write")
+
+    _spans = None
+    _samples = 4096
+#endregion
+
+    def __init__(self, samples=4096):
+        """
+        Args:
+            samples (int, optional): Last samples kept per span,
+                                     for the percentiles.
+        """
+        self._samples = samples
+        self.Reset()
+
+    def Add(self, span, ns):
+        """
+        Adds a latency to a span.
+
+        Args:
+            span (str): Name of the span
+            ns (int): Latency (ns)
+        """
+        self._spans[span].Add(ns)
+
+    def Frame(self, arrival, decoded, handled, rendered):
+        """
+        Adds the spans of a frame received, from its stamps.
+
+        Args:
+            arrival (int): Bytes read from the port (monotonic ns)
+            decoded (int): Frame classified (monotonic ns)
+            handled (int): GUI handler started (monotonic ns)
+            rendered (int): Line written in the log (monotonic ns)
+        """
+        spans = self._spans
+        spans["decode"].Add(decoded - arrival)
+        spans["dispatch"].Add(handled - decoded)
+        spans["render"].Add(rendered - handled)
+        spans["total"].Add(rendered - arrival)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Stats of each span (see _Span.GetStats)
+        """
+        return {name: span.GetStats() for name, span in self._spans.items()}
+
+    def Reset(self):
+        self._spans = {name: _Span(self._samples) for name in self.SPANS}
+
+def report(stats):
+    """
+    Formats the stats of the spans as a table.
+
+    Args:
+        stats (dict): Stats of LatencyTracer.GetStats
+
+    Returns:
+        str: One line per span, in microseconds
+    """
+    lines = []
+    for name, s in stats.items():
+        if not s["count"]:
+            continue
+        lines.append("{0}: {count} frames, mean {mean:.1f} us, "
+                     "p50 {p50:.1f} us, p99 {p99:.1f} us, "
+                     "max {max:.1f} us".format(name, **s))
+
+    return "\n".join(lines)
@@ -0,0 +1,310 @@
+"""Log store.
+
+This file contains the class LogStore, an in-memory store of every
+line written in the session log. Records are indexed by direction,
+command, type of message and time bucket, so the log can be filtered
+and searched without going through the whole text.
+
+The store can have a capacity: when it's full, the oldest lines are
+removed (by chunks, so the indexes are trimmed only once in a while)
+and counted as dropped, so a long session doesn't use all the memory.
+"""
+# Standard imports
+import re
+import time
+import bisect
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+# One line of the log
+#   time: Epoch Unix timestamp in nanoseconds
+#   direction: "in", "out" or "system"
+#   kind: "response", "message", "error", "command" or "system"
+#   command: Command name (if any)
+#   params: List of parameters (if any)
+#   raw: Bytes received or sent (if any)
+#   text: Text shown in the log
+LogRecord = namedtuple("LogRecord", ["time", "direction", "kind", "command",
+                                     "params", "raw", "text"])
+
+class LogStore:
+    """
+    This class stores the lines of the log with their
+    data, and keeps an index of them by direction,
+    command, type and time bucket.
+
+    Records are only appended, so the ids in each index
+    are always sorted. Queries run over a snapshot of
+    the store and return their results in batches, to be
+    used from a thread without blocking the GUI.
+
+    Ids are absolute: the record of an id is at position
+    id - first, where first is the id of the oldest
+    record kept.
+    """
+#region Variables
+    # Size of the time buckets (nanoseconds)
+    _bucketSize = 60 * 10**9
+
+    _records = None
+    _lock: threading.Lock = None
+
+    # Max records kept (None: no limit), id of the oldest one
+    _capacity = None
+    _first = 0
+
+    # Statistics
+    _put = 0
+    _dropped = 0
+    _highWater = 0
+
+    # Indexes, value -> list of record ids
+    _byDirection = None
+    _byCommand = None
+    _byKind = None
+    _byBucket = None
+
+    # Line parsing
+    _prefixes = {"[In]": "in", "[Out]": "out", "[System]": "system"}
+    _stampRe = re.compile(r"(\d{2})/(\d{2})/(\d{2}) (\d{2}):(\d{2}):(\d{2})\s*$")
+#endregion
+
+    def __init__(self, capacity=None):
+        """
+        Args:
+            capacity (int, optional): Max records kept. Defaults to
+                                      None (no limit).
+        """
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self.Clear()
+
+    def __index(self, index, key, rid):
+        ids = index.get(key)
+        if ids is None:
+            index[key] = [rid]
+        else:
+            ids.append(rid)
+
+    def Append(self, text, direction="system", kind="system", command=None,
+               params=None, raw=None, t=None):
+        """
+        Adds a new line to the store and indexes it.
+
+        Args:
+            text (str): Text shown in the log
+            direction (str, optional): "in", "out" or "system".
+            kind (str, optional): Type of the line.
+            command (str, optional): Command name. Defaults to None.
+            params (list, optional): Parameters. Defaults to None.
+            raw (bytes, optional): Frame bytes. Defaults to None.
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+
+        Returns:
+            LogRecord: Stored record
+        """
+        if t is None:
+            t = time.time_ns()
+
+        record = LogRecord(t, direction, kind, command, params, raw, text)
+        with self._lock:
+            self._put += 1
+            if self._capacity and len(self._records) >= self._capacity:
+                self.__trim()
+            rid = self._first + len(self._records)
+            self._records.append(record)
+            if len(self._records) > self._highWater:
+                self._highWater = len(self._records)
+            self.__index(self._byDirection, direction, rid)
+            self.__index(self._byKind, kind, rid)
+            self.__index(self._byBucket, t // self._bucketSize, rid)
+            if command:
+                self.__index(self._byCommand, command, rid)
+
+        return record
+
+    def __trim(self):
+        """
+        Removes the oldest tenth of the records (lock held).
+        New lists are made, so the snapshots taken by the
+        queries running are not changed.
+        """
+        count = max(self._capacity // 10, 1)
+        self._records = self._records[count:]
+        self._first += count
+        self._dropped += count
+        for index in (self._byDirection, self._byCommand, self._byKind,
+                      self._byBucket):
+            for key, ids in list(index.items()):
+                cut = bisect.bisect_left(ids, self._first)
+                if cut == len(ids):
+                    del index[key]
+                elif cut:
+                    index[key] = ids[cut:]
+
+    def AppendLine(self, line):
+        """
+        Adds a line of a saved log, guessing its direction
+        and command from the prefix and its time from the
+        timestamp at the end of the line.
+
+        Args:
+            line (str): Line of a log file
+
+        Returns:
+            LogRecord: Stored record
+        """
+        text, direction, kind, command, t = self.ParseLine(line)
+        return self.Append(text, direction, kind, command, t=t)
+
+    def ParseLine(self, line):
+        """
+        Reads the data of a line written in the log.
+
+        Args:
+            line (str): Line of the log
+
+        Returns:
+            tuple: (text, direction, kind, command, time)
+        """
+        direction, kind, command = "system", "system", None
+        for prefix in self._prefixes:
+            if line.startswith(prefix):
+                direction = self._prefixes[prefix]
+                words = line[len(prefix):].lstrip(": ").split()
+                if direction != "system" and words:
+                    command = words[0]
+                    kind = "command" if direction == "out" else "response"
+                break
+
+        t = None
+        stamp = self._stampRe.search(line)
+        if stamp:
+            m, d, y, hh, mm, ss = (int(x) for x in stamp.groups())
+            try:
+                t = int(datetime(2000 + y, m, d, hh, mm, ss).timestamp()) * 10**9
+            except ValueError:
+                t = None
+
+        return (line, direction, kind, command, t)
+
+    def Clear(self):
+        """
+        Removes all records and indexes.
+        """
+        with self._lock:
+            self._records = []
+            self._first = 0
+            self._byDirection = {}
+            self._byCommand = {}
+            self._byKind = {}
+            self._byBucket = {}
+
+    def GetCommands(self):
+        """
+        Returns:
+            list: Command names with records, sorted
+        """
+        with self._lock:
+            return sorted(self._byCommand)
+
+    def __len__(self):
+        return len(self._records)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Stats with the keys of BoundedQueue.GetStats:
+                  capacity, records kept, high-water mark, lines
+                  appended and removed because the store was full
+        """
+        with self._lock:
+            return {"name": "log",
+                    "size": self._capacity or 0,
+                    "policy": "drop-oldest",
+                    "depth": len(self._records),
+                    "highWater": self._highWater,
+                    "put": self._put,
+                    "dropped": self._dropped,
+                    "blocked": 0,
+                    "waited": 0.0}
+
+    def Query(self, regex=None, command=None, direction=None, kind=None,
+              start=None, end=None, batch=500):
+        """
+        Searches the records that match all the filters given.
+        Candidates are taken from the most selective index and
+        then checked against the other filters.
+
+        This is a generator, it returns lists of up to "batch"
+        records, so the caller can show results while searching.
+
+        Args:
+            regex (str, optional): Regular expression on the text.
+            command (str, optional): Command name.
+            direction (str, optional): "in", "out" or "system".
+            kind (str, optional): Type of the line.
+            start (int, optional): First epoch timestamp (ns).
+            end (int, optional): Last epoch timestamp (ns).
+            batch (int, optional): Records per batch. Defaults to 500.
+
+        Raises:
+            re.error: When the regular expression is not valid.
+
+        Yields:
+            list: Records that match
+        """
+        pattern = re.compile(regex) if regex else None
+
+        # Snapshot of the store and the candidate ids
+        with self._lock:
+            records = self._records
+            offset = self._first
+            total = offset + len(records)
+            candidates = []
+            if direction:
+                candidates.append(self._byDirection.get(direction, []))
+            if command:
+                candidates.append(self._byCommand.get(command, []))
+            if kind:
+                candidates.append(self._byKind.get(kind, []))
+            if start is not None or end is not None:
+                first = (start or 0) // self._bucketSize
+                last = (end if end is not None
+                        else time.time_ns()) // self._bucketSize
+                ids = []
+                for bucket in sorted(self._byBucket):
+                    if first <= bucket <= last:
+                        ids.extend(self._byBucket[bucket])
+                ids.sort()
+                candidates.append(ids)
+
+        if candidates:
+            ids = min(candidates, key=len)
+        else:
+            ids = range(offset, total)
+
+        results = []
+        for rid in ids:
+            if rid < offset:
+                continue
+            if rid >= total:
+                break
+
+            r = records[rid - offset]
+            if ((direction and r.direction != direction)
+                or (command and r.command != command)
+                or (kind and r.kind != kind)
+                or (start is not None and r.time < start)
+                or (end is not None and r.time > end)
+                or (pattern and not pattern.search(r.text))):
+                continue
+
+            results.append(r)
+            if len(results) >= batch:
+                yield results
+                results = []
+
+        if results:
+            yield results
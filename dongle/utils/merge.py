@@ -0,0 +1,182 @@
+"""Capture merging.
+
+This file contains the tool that merges the captures of several devices
+into one stream ordered by time, with a k-way merge: a heap keeps the
+next frame of each capture, so the memory used depends on the number of
+captures and not on their size, and archives of any size are merged in
+a single pass.
+
+Frames are ordered by the device time of the responses and messages
+(their device timestamp converted to host time by the clock model of
+each dongle, when the capture has it), and by the host time of the
+rest, so the events of several dongles are compared by when they
+happened and not by when each port was read.
+
+Captures are almost ordered, but not exactly: frames received and sent
+are stamped by different threads before they are written, and device
+and host times are mixed. Each capture
+is read through a small reordering heap, that holds the frames of the
+last "slack" seconds, so the merged stream is ordered as long as no
+frame is written more than "slack" seconds late.
+
+The merged stream can be written as a capture (with the source of each
+frame) or in any export format (.parquet, .arrow, .npz):
+
+    python -m dongle.utils.merge output.parquet a.cap b.cap [...]
+                                 [--slack S] [--offset NAME=S]
+"""
+# Standard imports
+import os
+import sys
+import time
+import heapq
+import argparse
+
+# Internal imports
+from dongle.utils.capture import CaptureReader, CaptureWriter
+from dongle.utils.export import SessionExporter
+
+def source_name(path):
+    """
+    Name of the source of a capture: its file name without
+    extension and without spaces.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    # "@" marks the device times in the captures
+    return "_".join(name.split()).lstrip("@") or "capture"
+
+def find_captures(paths):
+    """
+    Expands the directories of a list of paths into the
+    captures they contain (recursively).
+
+    Returns:
+        list: Paths of the captures, sorted
+    """
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                captures += [os.path.join(root, n) for n in names
+                             if n.endswith(".cap")]
+        else:
+            captures.append(path)
+
+    return sorted(captures)
+
+def _stream(index, path, source, offset, slack):
+    """
+    Frames of a capture in time order, reordered inside
+    a window of "slack" ns.
+
+    Yields:
+        tuple: (timestamp in ns, index, source, direction, frame)
+    """
+    pending = []
+    seq = 0
+    reader = CaptureReader(path)
+    for t, direction, data, named, device in reader.ReadSources():
+        if device is not None:
+            t = device
+        t += offset
+        heapq.heappush(pending, (t, seq, named or source, direction, data))
+        seq += 1
+        limit = t - slack
+        while pending[0][0] <= limit:
+            t0, _, name, d, frame = heapq.heappop(pending)
+            yield t0, index, name, d, frame
+
+    while pending:
+        t0, _, name, d, frame = heapq.heappop(pending)
+        yield t0, index, name, d, frame
+
+def merge_captures(paths, slack=1.0, offsets=None):
+    """
+    Merges captures into one stream ordered by time. Frames
+    with the same time keep the order of the captures.
+
+    Args:
+        paths (list): Paths of the captures
+        slack (float, optional): Seconds that a frame can be out of
+                                 order in its capture. Defaults to 1.
+        offsets (dict, optional): Seconds added to the times of each
+                                  source (to align the clocks of
+                                  different hosts), by source name.
+
+    Yields:
+        tuple: (timestamp in ns, source, direction, frame bytes)
+    """
+    offsets = offsets or {}
+    slack = int(slack * 1e9)
+    streams = []
+    for index, path in enumerate(paths):
+        source = source_name(path)
+        offset = int(offsets.get(source, 0) * 1e9)
+        streams.append(_stream(index, path, source, offset, slack))
+
+    # (t, index) is unique among the heads, frames are never compared
+    for t, _, source, direction, data in heapq.merge(*streams):
+        yield t, source, direction, data
+
+def write_merged(paths, output, slack=1.0, offsets=None, group=65536):
+    """
+    Merges captures into a capture or an export file,
+    chosen by the extension of "output".
+
+    Returns:
+        tuple: (path written, frames)
+    """
+    frames = merge_captures(paths, slack, offsets)
+    if output.lower().endswith(".cap"):
+        writer = CaptureWriter(output)
+        for t, source, direction, data in frames:
+            writer.Write(direction, data, t, source)
+        writer.Close()
+        return output, writer.GetFrames()
+
+    exporter = SessionExporter(output, group)
+    exporter.WriteFrames(frames)
+    exporter.Close()
+    return exporter.path, exporter.GetRows()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge captures of several devices by time")
+    parser.add_argument("output",
+                        help="Merged file (.cap, .parquet, .arrow or .npz)")
+    parser.add_argument("captures", nargs="+",
+                        help="Captures, or directories with captures")
+    parser.add_argument("--slack", type=float, default=1.0,
+                        help="Seconds a frame can be late in its capture")
+    parser.add_argument("--offset", action="append", default=[],
+                        metavar="NAME=S",
+                        help="Seconds added to the times of a capture")
+    parser.add_argument("--group", type=int, default=65536,
+                        help="Rows per group of the export")
+    args = parser.parse_args(argv)
+
+    offsets = {}
+    for entry in args.offset:
+        name, _, value = entry.partition("=")
+        try:
+            offsets[name] = float(value)
+        except ValueError:
+            parser.error("Wrong offset: " + entry)
+
+    captures = find_captures(args.captures)
+    if not captures:
+        print("No captures found.")
+        return 1
+
+    begin = time.perf_counter()
+    path, frames = write_merged(captures, args.output, args.slack, offsets,
+                                args.group)
+    elapsed = time.perf_counter() - begin
+    print("{0} frames of {1} captures merged in {2:.2f} s "
+          "({3:.0f} frames/s): {4}".format(frames, len(captures), elapsed,
+                                           frames / elapsed if elapsed else 0,
+                                           path))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Overload detection.
+
+This file contains the class OverloadMonitor, used by the GUI to measure
+its own backlog. Every line that arrives to the log is checked: the lag
+between the arrival of its frame and the moment the GUI handles it is
+the time the line waited in the event queue, and the lines handled per
+second are the load. Only the lines of live frames have a lag; the ones
+with old times (query results, summaries of repeated frames) only count
+for the rate. When the lag or the rate go over their limits, the
+log is overloaded: lines are only stored, not rendered. It leaves that
+mode once the lag and the rate stay under the exit limits for some
+seconds, so a burst doesn't make it switch on every line.
+"""
+# Standard imports
+import time
+from collections import deque
+
+class OverloadMonitor:
+    """
+    Backlog, rate and state (normal or overloaded) of
+    the log. Used from the GUI thread only.
+    """
+#region Variables
+    # Default values of the "overload" configuration of the log
+    DEFAULTS = {
+        "enabled": True,
+        # Lag (s) that enters the overload mode, and the one to leave it
+        "enterLag": 0.5,
+        "exitLag": 0.1,
+        # Lines per second that can be rendered
+        "maxRate": 500,
+        # Seconds under the exit limits before leaving the mode
+        "hold": 2.0,
+        # Lines of the sampled tail
+        "tail": 20,
+        # Seconds between refreshes of the counters
+        "refresh": 0.5
+    }
+
+    # Length of the rate windows (ns)
+    _window = 10**9
+
+    _enabled = True
+    _enterLag = 0
+    _exitLag = 0
+    _maxRate = 0
+    _hold = 0
+
+    # True while the lines are not rendered
+    overloaded = False
+
+    # Current window: start, lines by kind and max lag (ns)
+    _start = 0
+    _count = 0
+    _kinds = None
+    _lag = 0
+    # Last full window
+    _rate = 0
+    _rates = None
+    _lastLag = 0
+
+    # Start of the calm period while overloaded (0: not calm)
+    _calm = 0
+
+    # Last lines, not rendered
+    _tail: deque = None
+
+    # Statistics
+    _lines = 0
+    _skipped = 0
+    _entered = 0
+    # Lines skipped since the mode was entered
+    _pending = 0
+#endregion
+
+    def __init__(self, conf=None):
+        """
+        Args:
+            conf (dict, optional): "overload" configuration of the log
+        """
+        self._kinds = {}
+        self._rates = {}
+        self._tail = deque()
+        self.Configure(conf)
+        self._start = time.monotonic_ns()
+
+    def Configure(self, conf=None):
+        """
+        Applies a new configuration, keeping the state.
+
+        Args:
+            conf (dict, optional): "overload" configuration of the log
+        """
+        conf = dict(self.DEFAULTS, **(conf or {}))
+        self._enabled = conf["enabled"]
+        self._enterLag = int(conf["enterLag"] * 1e9)
+        self._exitLag = int(conf["exitLag"] * 1e9)
+        self._maxRate = conf["maxRate"]
+        self._hold = int(conf["hold"] * 1e9)
+        self.refresh = conf["refresh"]
+        self._tail = deque(self._tail, maxlen=conf["tail"])
+
+    def __roll(self, now):
+        """
+        Closes the current window if it ended.
+        """
+        elapsed = now - self._start
+        if elapsed < self._window:
+            return
+        # Windows without lines count as 0
+        if elapsed >= 2 * self._window:
+            self._rate, self._rates, self._lastLag = 0, {}, 0
+        else:
+            scale = 1e9 / elapsed
+            self._rate = self._count * scale
+            self._rates = {k: n * scale for k, n in self._kinds.items()}
+            self._lastLag = self._lag
+        self._start = now
+        self._count = 0
+        self._kinds = {}
+        self._lag = 0
+
+    def Line(self, text, kind="system", arrival=None):
+        """
+        Checks a line that arrived to the log.
+
+        Args:
+            text (str): Text of the line
+            kind (str, optional): Type of line
+            arrival (int, optional): Epoch timestamp (ns) of the
+                                     arrival of its frame, for the
+                                     lines of live frames only
+
+        Returns:
+            bool: Whether the line must be rendered. When it
+                  changes to or from the overload mode, the
+                  caller can see it in "overloaded".
+        """
+        self._lines += 1
+        if not self._enabled:
+            return True
+
+        now = time.monotonic_ns()
+        self.__roll(now)
+        self._count += 1
+        self._kinds[kind] = self._kinds.get(kind, 0) + 1
+        lag = time.time_ns() - arrival if arrival else 0
+        if lag > self._lag:
+            self._lag = lag
+
+        busy = lag > self._enterLag or self._count > self._maxRate
+        if not self.overloaded:
+            if not busy:
+                return True
+            self.overloaded = True
+            self._entered += 1
+            self._pending = 0
+            self._calm = 0
+        elif lag > self._exitLag or self._count > self._maxRate:
+            self._calm = 0
+        elif not self._calm:
+            self._calm = now
+
+        self._skipped += 1
+        self._pending += 1
+        self._tail.append(text)
+        return False
+
+    def Update(self):
+        """
+        Checks if the overload ended. Called periodically
+        while overloaded, because the lines may stop coming.
+
+        Returns:
+            bool: Whether it left the overload mode
+        """
+        if not self.overloaded:
+            return False
+
+        now = time.monotonic_ns()
+        self.__roll(now)
+        # No line in the current window: calm since it started
+        if not self._count and not self._calm:
+            self._calm = self._start
+        if not self._calm or now - self._calm < self._hold:
+            return False
+
+        self.overloaded = False
+        self._tail.clear()
+        return True
+
+    def GetPending(self):
+        """
+        Returns:
+            int: Lines not rendered since the last overload started
+        """
+        return self._pending
+
+    def GetTail(self):
+        """
+        Returns:
+            list: Last lines not rendered
+        """
+        return list(self._tail)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Lines per second (total and by kind, last full
+                  window), max lag of the window (s), lines seen and
+                  not rendered, and times it was overloaded
+        """
+        return {"rate": self._rate,
+                "kinds": dict(self._rates),
+                "lag": self._lastLag / 1e9,
+                "lines": self._lines,
+                "skipped": self._skipped,
+                "pending": self._pending,
+                "entered": self._entered,
+                "overloaded": self.overloaded}
@@ -0,0 +1,319 @@
+"""Protocol schema.
+
+This file contains the classes compiled from "protocol.json", the
+description of the commands of the device: their name, their code in
+byte-type frames, the types of their parameters and the layout of their
+response. Each command is compiled once into a CommandCodec, with a
+precompiled struct.Struct for its binary fields and the converters of
+its string fields, and the codecs are looked up by name and by code.
+Adding a command only needs an entry in the file.
+
+Types of the fields:
+
+    int8, uint8, int16, uint16, int32, uint32: Integers (little-endian)
+    float, double: Floating point numbers
+    str, bytes: Variable length, only as the last field
+
+Binary frames put the fields one after the other; string frames
+separate them with ";".
+"""
+# Standard imports
+import struct
+
+# Struct format of each fixed-size type
+_formats = {
+    "int8": "b", "uint8": "B",
+    "int16": "h", "uint16": "H",
+    "int32": "i", "uint32": "I",
+    "float": "f", "double": "d"
+}
+
+# Types that take the rest of the frame
+_variable = ("str", "bytes")
+
+def _convert(kind):
+    """
+    Converter of a field of a string-type frame.
+    """
+    if kind in ("float", "double"):
+        return float
+    if kind in _formats:
+        return int
+    if kind == "bytes":
+        return bytes.fromhex
+    return str
+
+class _Layout:
+    """
+    Compiled list of fields: a Struct for the fixed-size
+    ones and, maybe, a variable-length field at the end.
+    """
+    __slots__ = ("spec", "names", "struct", "variable", "converters")
+
+    def __init__(self, spec):
+        """
+        Args:
+            spec (list): Fields ({"name", "type"}) in order
+
+        Raises:
+            ValueError: A variable-length field is not the last one
+        """
+        self.spec = spec
+        self.names = tuple(f["name"] for f in spec)
+        self.converters = tuple(_convert(f["type"]) for f in spec)
+
+        fixed = spec
+        self.variable = None
+        if spec and spec[len(spec) - 1]["type"] in _variable:
+            fixed = spec[:len(spec) - 1]
+            self.variable = spec[len(spec) - 1]["type"]
+        for f in fixed:
+            if f["type"] not in _formats:
+                raise ValueError("Variable-length field not at the end: "
+                                 + f["name"])
+        self.struct = struct.Struct("<" + "".join(_formats[f["type"]]
+                                                  for f in fixed))
+
+    def Pack(self, values):
+        """
+        Encodes the values of the fields as bytes.
+
+        Args:
+            values (list): Values, as strings or already converted
+
+        Returns:
+            bytes: Encoded fields
+        """
+        count = len(self.names)
+        if len(values) != count:
+            raise ValueError("Expected {0} parameters, got {1}".format(
+                count, len(values)))
+
+        converted = [c(v) if type(v) is str else v
+                     for c, v in zip(self.converters, values)]
+        if self.variable is None:
+            return self.struct.pack(*converted)
+
+        last = converted[count - 1]
+        if type(last) is str:
+            last = last.encode("utf-8")
+        return self.struct.pack(*converted[:count - 1]) + bytes(last)
+
+    def Unpack(self, data):
+        """
+        Decodes binary fields.
+
+        Args:
+            data (bytes): Encoded fields
+
+        Returns:
+            tuple: Values of the fields
+        """
+        values = self.struct.unpack_from(data)
+        if self.variable is None:
+            return values
+
+        rest = bytes(data[self.struct.size:])
+        if self.variable == "str":
+            rest = rest.decode("utf-8", "replace")
+        return values + (rest,)
+
+    def Parse(self, fields):
+        """
+        Converts the fields of a string-type frame.
+        Fields that can't be converted are kept as text.
+
+        Args:
+            fields (list): Fields (str)
+
+        Returns:
+            tuple: Values of the fields
+        """
+        values = []
+        for convert, text in zip(self.converters, fields):
+            try:
+                values.append(convert(text))
+            except ValueError:
+                values.append(text)
+        return tuple(values)
+
+class CommandCodec:
+    """
+    Encoder and decoder of one command.
+    """
+#region Variables
+    name = None
+    # Code of the byte-type frames (None if it only has string frames)
+    code: bytes = None
+    # Sent as the interrupt byte and the code, without frame
+    raw = False
+
+    _params: _Layout = None
+    _response: _Layout = None
+#endregion
+
+    def __init__(self, spec):
+        """
+        Args:
+            spec (dict): Entry of the command in "protocol.json"
+        """
+        self.name = spec["name"]
+        self.code = bytes.fromhex(spec["code"]) if spec.get("code") else None
+        self.raw = spec.get("raw", False)
+        self._params = _Layout(spec.get("params", []))
+        self._response = _Layout(spec.get("response", []))
+
+    # Structs can't be pickled (cache and worker processes)
+    def __getstate__(self):
+        return {"name": self.name, "code": self.code, "raw": self.raw,
+                "params": self._params.spec,
+                "response": self._response.spec}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.code = state["code"]
+        self.raw = state["raw"]
+        self._params = _Layout(state["params"])
+        self._response = _Layout(state["response"])
+
+    def GetParamNames(self):
+        return self._params.names
+
+    def GetResponseNames(self):
+        return self._response.names
+
+    def PackParams(self, params):
+        """
+        Encodes the parameters typed by the user for a
+        byte-type frame.
+
+        Args:
+            params (str/list): Parameters, separated by ";" if
+                               they are a string
+
+        Returns:
+            bytes: Encoded parameters
+        """
+        if type(params) is str:
+            params = params.split(";") if params else []
+        return self._params.Pack(params)
+
+    def Decode(self, data):
+        """
+        Decodes the parameters of a binary frame of the
+        command: its response layout, or its parameters if
+        it has no response fields.
+
+        Args:
+            data (bytes): Encoded parameters
+
+        Returns:
+            list: (name, value) of each field
+
+        Raises:
+            struct.error: The length doesn't match the layout
+        """
+        layout = self._response if self._response.names else self._params
+        return list(zip(layout.names, layout.Unpack(data)))
+
+    def ParseResponse(self, fields):
+        """
+        Converts the parameters of a string response.
+
+        Args:
+            fields (list): Parameters (str)
+
+        Returns:
+            tuple: Values of the response fields
+        """
+        return self._response.Parse(fields)
+
+class Protocol:
+    """
+    Compiled "protocol.json": the codecs of the commands,
+    by name and by code.
+    """
+    _byName = None
+    _byCode = None
+
+    def __init__(self, data):
+        """
+        Args:
+            data (dict): Decoded "protocol.json"
+        """
+        self._byName = {}
+        self._byCode = {}
+        for spec in data.get("commands", []):
+            codec = CommandCodec(spec)
+            self._byName[codec.name] = codec
+            if codec.code is not None:
+                # Binary frames carry one byte of command
+                self._byCode[codec.code[0]] = codec
+
+    def Get(self, name):
+        """
+        Returns:
+            CommandCodec: Codec of the command, or None
+        """
+        return self._byName.get(name)
+
+    def GetByCode(self, code):
+        """
+        Args:
+            code (int): Command byte of a binary frame
+
+        Returns:
+            CommandCodec: Codec of the command, or None
+        """
+        return self._byCode.get(code)
+
+    def GetNames(self):
+        return list(self._byName)
+
+    def Describe(self, command, values):
+        """
+        Text of the fields of a response.
+
+        Args:
+            command (str): Command name
+            values (list): Parameters of the response (str)
+
+        Returns:
+            str: "name=value;..." for the known fields, or the
+                 parameters as they are
+        """
+        codec = self._byName.get(command)
+        if codec is None or not codec.GetResponseNames():
+            return ";".join(values) + (";" if values else "")
+
+        names = codec.GetResponseNames()
+        parsed = codec.ParseResponse(values)
+        text = "".join("{0}={1};".format(n, v) for n, v in zip(names, parsed))
+        # Fields not in the schema
+        for v in values[len(names):]:
+            text += v + ";"
+        return text
+
+    def DescribeBinary(self, fields):
+        """
+        Text of the parameters of a binary frame.
+
+        Args:
+            fields (BinaryFields): Fields of the frame
+
+        Returns:
+            str: Command name and "name=value" of each field, or
+                 an empty string if the code is not known
+        """
+        if fields is None or fields.command is None:
+            return ""
+        codec = self._byCode.get(fields.command)
+        if codec is None:
+            return ""
+
+        try:
+            values = codec.Decode(fields.params)
+        except struct.error:
+            return codec.name + " (wrong length)"
+        return codec.name + " " + " ".join("{0}={1}".format(n, v)
+                                           for n, v in values)
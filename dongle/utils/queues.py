@@ -0,0 +1,265 @@
+"""Bounded queues.
+
+This file contains the queues between the reading thread of the device
+and the consumers of the frames received (the GUI, the session recorder
+and the clients of the bridge). Each queue has a max size and a policy
+that decides what happens when a consumer doesn't keep up:
+
+    block: The producer waits for room (it slows down the reading)
+    drop-oldest: The oldest item queued is removed to make room
+    drop-newest: The new item is not queued
+    sample: Once the queue is half full, only one of every "sample"
+            items is queued; when it's full, the new item is dropped
+
+Every queue counts the items dropped and keeps the high-water mark (the
+max number of items that were waiting), so memory is capped and the
+data lost is measured.
+"""
+# Standard imports
+import time
+import threading
+from collections import deque
+
+# Policies of the queues
+POLICIES = ("block", "drop-oldest", "drop-newest", "sample")
+
+class BoundedQueue:
+    """
+    Queue with a max size and a policy for the items
+    that don't fit. Thread safe.
+    """
+#region Variables
+    # Default values of the configuration of a queue
+    DEFAULTS = {
+        "size": 10000,
+        "policy": "drop-newest",
+        # One of every "sample" items kept by the "sample" policy
+        "sample": 10
+    }
+
+    name = None
+    policy = None
+    size = 0
+    _sample = 10
+
+    _items: deque = None
+    _cond: threading.Condition = None
+    _closed = False
+
+    # Ids of the forced items queued, and the ones that were the 
+    # oldest when "drop-oldest" made room (taken before the rest)
+    _forced = None
+    _head: deque = None
+
+    # Items seen by the "sample" policy while over half full
+    _skip = 0
+
+    # Statistics
+    _put = 0
+    _dropped = 0
+    _highWater = 0
+    # Times a producer waited for room, and seconds waiting
+    _blocked = 0
+    _waited = 0.0
+#endregion
+
+    def __init__(self, size=10000, policy="drop-newest", sample=10,
+                 name=None):
+        """
+        Args:
+            size (int, optional): Max items. Defaults to 10000.
+            policy (str, optional): Policy when full (see POLICIES).
+            sample (int, optional): Rate of the "sample" policy.
+            name (str, optional): Name shown in the statistics.
+
+        Raises:
+            ValueError: The policy is not known
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        self.name = name
+        self.size = size
+        self.policy = policy
+        self._sample = max(int(sample), 1)
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._forced = set()
+        self._head = deque()
+
+    @classmethod
+    def FromConf(cls, conf=None, name=None, size=None):
+        """
+        Creates a queue from its configuration.
+
+        Args:
+            conf (dict, optional): "size", "policy" and "sample"
+            name (str, optional): Name shown in the statistics.
+            size (int, optional): Size used if "conf" has none.
+        """
+        conf = conf or {}
+        if size is not None and "size" not in conf:
+            conf = dict(conf, size=size)
+        conf = dict(cls.DEFAULTS, **conf)
+        return cls(conf["size"], conf["policy"], conf["sample"], name)
+
+    def __len__(self):
+        return len(self._items) + len(self._head)
+
+    def Put(self, item, force=False, timeout=None):
+        """
+        Queues an item, applying the policy if the queue
+        is full.
+
+        Args:
+            item: Item to queue
+            force (bool, optional): Queue it even if it's full
+                                    (events that can't be lost).
+            timeout (float, optional): Max seconds waiting with the
+                                       "block" policy (None: forever).
+
+        Returns:
+            bool: Whether the item was queued
+        """
+        with self._cond:
+            self._put += 1
+            items = self._items
+            if self._closed:
+                self._dropped += 1
+                return False
+
+            if not force and len(items) >= self.size // 2 \
+                    and self.policy == "sample":
+                self._skip += 1
+                if self._skip % self._sample:
+                    self._dropped += 1
+                    return False
+
+            if not force and len(items) >= self.size:
+                if self.policy == "drop-oldest":
+                    self.__drop_oldest()
+                elif self.policy == "block":
+                    if not self.__wait(timeout):
+                        self._dropped += 1
+                        return False
+                else:
+                    self._dropped += 1
+                    return False
+
+            items.append(item)
+            if force:
+                self._forced.add(id(item))
+            if len(items) > self._highWater:
+                self._highWater = len(items)
+            if len(items) == 1:
+                self._cond.notify_all()
+        return True
+
+    def __drop_oldest(self):
+        """
+        Drops the oldest item that wasn't forced (lock held).
+        """
+        items = self._items
+        while items:
+            item = items.popleft()
+            if id(item) not in self._forced:
+                self._dropped += 1
+                return
+            # All the items before it were dropped: order is kept
+            self._head.append(item)
+
+    def __take(self, count):
+        """
+        Takes up to "count" items (lock held).
+        """
+        batch = []
+        if self._head:
+            while self._head and len(batch) < count:
+                batch.append(self._head.popleft())
+        items = self._items
+        count = min(count - len(batch), len(items))
+        batch += [items.popleft() for _ in range(count)]
+        if self._forced:
+            for item in batch:
+                self._forced.discard(id(item))
+        return batch
+
+    def __wait(self, timeout):
+        """
+        Waits for room (lock held).
+
+        Returns:
+            bool: Whether there is room
+        """
+        self._blocked += 1
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        while len(self._items) >= self.size and not self._closed:
+            left = None if deadline is None else deadline - time.monotonic()
+            if left is not None and left <= 0:
+                break
+            self._cond.wait(left)
+        self._waited += time.monotonic() - start
+        return len(self._items) < self.size and not self._closed
+
+    def Get(self, timeout=None):
+        """
+        Takes the oldest item, waiting for one.
+
+        Args:
+            timeout (float, optional): Max seconds waiting (None:
+                                       until an item or Close).
+
+        Returns:
+            The item, or None if the queue was closed and is
+            empty, or the timeout passed
+        """
+        with self._cond:
+            if not len(self) and not self._closed:
+                self._cond.wait_for(lambda: len(self) or self._closed,
+                                    timeout)
+            if not len(self):
+                return None
+            item = self.__take(1)[0]
+            self._cond.notify_all()
+            return item
+
+    def GetBatch(self, count):
+        """
+        Takes up to "count" items, without waiting.
+
+        Returns:
+            list: Items, oldest first
+        """
+        with self._cond:
+            batch = self.__take(count)
+            if batch:
+                self._cond.notify_all()
+            return batch
+
+    def Close(self):
+        """
+        Closes the queue. Items already queued can still be
+        taken; new ones are dropped and waiting threads wake up.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Size, policy, items waiting, high-water mark,
+                  items put and dropped, and times and seconds
+                  producers waited for room
+        """
+        with self._cond:
+            return {"name": self.name,
+                    "size": self.size,
+                    "policy": self.policy,
+                    "depth": len(self),
+                    "highWater": self._highWater,
+                    "put": self._put,
+                    "dropped": self._dropped,
+                    "blocked": self._blocked,
+                    "waited": self._waited}
@@ -0,0 +1,176 @@
+"""Capture replay.
+
+This file contains the classes that replay a capture through the full
+receiving pipeline of the app. ReplayPort behaves like the serial port
+of a device, returning the frames received in the capture with their
+original timing (1x), N times faster, or as fast as possible (speed 0).
+
+A Device created with a ReplayPort reads, validates and dispatches the
+replayed frames exactly like the ones of a real device. As fast as
+possible, the replay measures the throughput of the pipeline.
+
+Can be run as a benchmark without GUI:
+
+    python -m dongle.utils.replay capture.cap [--speed N]
+"""
+# Standard imports
+import os
+import sys
+import time
+import argparse
+import threading
+
+# Internal imports
+from dongle.utils.capture import CaptureReader
+
+class ReplayPort:
+    """
+    Virtual serial port that returns the frames received
+    in a capture. Implements the part of serial.Serial
+    used by Device. Frames sent to it are only counted.
+    """
+#region Variables
+    # Seconds that readline waits when there's no data
+    timeout = 0.1
+
+    _frames = None
+    _speed = 1.0
+    _start = None
+    _first = None
+    _closed: threading.Event = None
+    _finished: threading.Event = None
+    _onFinished = None
+
+    # Statistics
+    _read = 0
+    _written = 0
+    _begin = None
+    _end = None
+#endregion
+
+    def __init__(self, path, speed=1.0, onFinished=None):
+        """
+        Args:
+            path (str): Path of the capture
+            speed (float, optional): Replay speed, 0 is as fast as
+                                     possible. Defaults to 1.0.
+            onFinished (function, optional): Called with the
+                                             statistics at the end.
+        """
+        self.name = "replay://" + path
+        self._frames = (f for f in CaptureReader(path) if f[1] == "in")
+        self._speed = speed
+        self._onFinished = onFinished
+        self._closed = threading.Event()
+        self._finished = threading.Event()
+        self._read = 0
+        self._written = 0
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def inWaiting(self):
+        return 0
+
+    def readline(self, size=-1):
+        """
+        Returns the next frame of the capture, waiting until
+        its time comes at the replay speed.
+
+        Returns:
+            bytes: Frame received, or empty when there's no data
+        """
+        if self._closed.is_set() or self._finished.is_set():
+            self._closed.wait(self.timeout)
+            return b""
+
+        frame = next(self._frames, None)
+        if frame is None:
+            self.__finish()
+            return b""
+
+        t, _, data = frame
+        if self._start is None:
+            self._start = time.monotonic()
+            self._first = t
+            self._begin = time.perf_counter()
+
+        if self._speed > 0:
+            due = self._start + (t - self._first) / 1e9 / self._speed
+            delay = due - time.monotonic()
+            if delay > 0 and self._closed.wait(delay):
+                return b""
+
+        self._read += 1
+        return data
+
+    def write(self, data):
+        self._written += 1
+        return len(data)
+
+    def cancel_read(self):
+        self._closed.set()
+
+    def close(self):
+        self._closed.set()
+
+    def __finish(self):
+        self._end = time.perf_counter()
+        self._finished.set()
+        if self._onFinished:
+            self._onFinished(self.GetStats())
+
+    def IsFinished(self):
+        return self._finished.is_set()
+
+    def GetStats(self):
+        """
+        Statistics of the replay.
+
+        Returns:
+            dict: Frames read and written, seconds and frames/s
+        """
+        end = self._end or time.perf_counter()
+        elapsed = (end - self._begin) if self._begin else 0.0
+
+        return {
+            "frames": self._read,
+            "written": self._written,
+            "seconds": elapsed,
+            "rate": self._read / elapsed if elapsed > 0 else 0.0
+        }
+
+    def WaitFinished(self, timeout=None):
+        return self._finished.wait(timeout)
+
+def main(argv=None):
+    """
+    Replays a capture through a Device without GUI and
+    prints the throughput of the receiving pipeline.
+    """
+    # Imported here, the port above doesn't need them
+    from dongle.device import Device
+    from dongle.utils.config import ConfigCache, AppConfig
+
+    parser = argparse.ArgumentParser(description="Replay a DynaLoRa capture")
+    parser.add_argument("capture", help="Capture file")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="Replay speed, 0 is as fast as possible")
+    args = parser.parse_args(argv)
+
+    cnf = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       '..', 'data/cnf'))
+    conf = ConfigCache().Load(cnf, "app.json", AppConfig)
+
+    port = ReplayPort(args.capture, args.speed)
+    device = Device(conf, None, port=port)
+    port.WaitFinished()
+    device.close()
+
+    stats = port.GetStats()
+    print("{frames} frames in {seconds:.3f} s: {rate:.0f} frames/s".format(
+        **stats))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,622 @@
+"""TX scheduler.
+
+This file contains the class TxScheduler, which paces the frames sent
+to a device. Every frame written goes through it, and it decides when
+the frame is really written to the port:
+
+    - A token bucket (monotonic clock) limits the frames per second
+      and the length of the bursts, so scripted bursts don't overrun
+      the buffer of the dongle.
+    - An airtime budget limits the time on air of the frames that the
+      dongle transmits by radio in a sliding window, to respect the
+      duty-cycle limits of the region (1% in most EU868 sub-bands).
+    - Periodic commands are kept at absolute deadlines, so their
+      timing doesn't drift with the delays of each send.
+    - Optionally, a flow control window limits the commands sent and
+      not answered yet (only the ones the dongle answers, each answer
+      matched to its command by name). The window grows by one frame per window of
+      answers and is halved (AIMD) when the dongle reports Overflow
+      or an answer doesn't arrive in time, so the sender finds the
+      rate the dongle can take without overrunning its buffer.
+
+Frames wait in queues ordered by due time and are written by a single
+thread. The frames transmitted by radio have their own queue, so the
+rest (REBOOT, F_Q, RX...) don't wait behind them while the airtime
+budget is used up, and the ones that don't fit in the whole budget are
+rejected when they are queued. The scheduler counts what it queued,
+delayed, dropped and rejected.
+"""
+# Standard imports
+import math
+import time
+import heapq
+import threading
+import itertools
+from collections import deque
+
+# Internal imports
+from dongle.utils.frames import FrameDecoder
+
+def lora_airtime(payload, sf=7, bw=125000, cr=1, preamble=8, crc=True,
+                 header=True):
+    """
+    Time on air of a LoRa packet (Semtech AN1200.13).
+
+    Args:
+        payload (int): Bytes of the payload
+        sf (int, optional): Spreading factor (7-12). Defaults to 7.
+        bw (int, optional): Bandwidth in Hz. Defaults to 125000.
+        cr (int, optional): Coding rate 4/(4+cr), 1 to 4. Defaults to 1.
+        preamble (int, optional): Preamble symbols. Defaults to 8.
+        crc (bool, optional): CRC enabled. Defaults to True.
+        header (bool, optional): Explicit header. Defaults to True.
+
+    Returns:
+        float: Seconds on air
+    """
+    symbol = (1 << sf) / bw
+    # Low data rate optimization, mandatory for symbols over 16 ms
+    de = 1 if symbol > 0.016 else 0
+    symbols = 8 + max(math.ceil((8 * payload - 4 * sf + 28 + 16 * crc
+                                 - 20 * (not header))
+                                / (4 * (sf - 2 * de))) * (cr + 4), 0)
+
+    return (preamble + 4.25) * symbol + symbols * symbol
+
+class _Periodic:
+    """
+    Periodic command of the scheduler.
+    """
+    __slots__ = ("id", "factory", "period", "active")
+
+    def __init__(self, id, factory, period):
+        self.id = id
+        self.factory = factory
+        self.period = period
+        self.active = True
+
+class TxScheduler:
+    """
+    Scheduler of the frames sent to a device. Frames
+    are queued with their due time and written, in due
+    order, by the scheduler thread as soon as the token
+    bucket, the airtime budget and the flow control
+    window allow it.
+
+    Every value of the configuration is optional, the
+    ones that are not present take the default value.
+    """
+#region Variables
+    # Default values of the configuration
+    DEFAULTS = {
+        # Frames per second and max burst of the token bucket
+        "rate": 100,
+        "burst": 20,
+        # Max frames waiting
+        "queue": 4096,
+        # Max fraction of the window on air, 1 is no limit
+        "dutyCycle": 1.0,
+        # Window of the airtime budget (seconds)
+        "window": 3600,
+        # Commands transmitted by radio by the dongle
+        "airCommands": ["PLD_Q"],
+        # Radio settings, for the airtime of each frame
+        "lora": {"sf": 7, "bw": 125000, "cr": 1, "preamble": 8,
+                 "crc": True},
+        # AIMD window of frames sent without answer, and the
+        # commands that the dongle answers (the only ones counted),
+        # by name or, for binary commands not in the protocol, by
+        # their code ("0x10")
+        "flowControl": {"enabled": False, "window": 4, "minWindow": 1,
+                        "maxWindow": 64, "increase": 1.0, "decrease": 0.5,
+                        "ackTimeout": 1.0, "commands": ["PLD_Q", "F_Q"]}
+    }
+
+    # Delay over which a frame counts as delayed (s)
+    _tolerance = 0.001
+
+    _settings = None
+    _write = None
+    _decoder = FrameDecoder()
+    # Compiled "protocol.json", for the names of the binary commands
+    _protocol = None
+
+    # Queues ordered by (due, sequence): the frames transmitted
+    # by radio, and the rest with the periodic commands
+    _heap = None
+    _airHeap = None
+    _counter = None
+    _cond: threading.Condition = None
+    _thread: threading.Thread = None
+    _running = False
+
+    # Token bucket
+    _tokens = 0.0
+    _refilled = 0.0
+
+    # Airtime sent in the window, (time, seconds)
+    _airLog = None
+    _airUsed = 0.0
+
+    # Periodic commands by id
+    _periodic = None
+
+    # Flow control: window, send times of the commands not
+    # answered (by command), and end of the current decrease
+    _flow = None
+    _window = 0.0
+    _inflight = None
+    _inflightCount = 0
+    _recoverUntil = 0.0
+
+    # Metrics
+    _metrics = None
+#endregion
+
+    def __init__(self, write, conf=None, name="TX scheduler", protocol=None):
+        """
+        Args:
+            write (function): Writes a frame to the port
+            conf (dict, optional): "scheduler" entry of the
+                                   configuration. Defaults to None.
+            name (str, optional): Thread name.
+            protocol (Protocol, optional): Codecs of the commands, to
+                                           name the binary frames.
+        """
+        self._settings = dict(self.DEFAULTS)
+        if conf:
+            for key in conf:
+                if key not in self.DEFAULTS:
+                    raise ValueError("Unknown scheduler setting: " + key)
+
+                self._settings[key] = conf[key]
+        for key in ("lora", "flowControl"):
+            self._settings[key] = dict(self.DEFAULTS[key],
+                                       **self._settings[key])
+        self._flow = self._settings["flowControl"]
+        if not self._flow["enabled"]:
+            self._flow = None
+
+        self._write = write
+        self._protocol = protocol
+        self._heap = []
+        self._airHeap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._airLog = deque()
+        self._airUsed = 0.0
+        self._periodic = {}
+        self._inflight = {}
+        self._inflightCount = 0
+        self._window = float(self._settings["flowControl"]["window"])
+        self._recoverUntil = 0.0
+        self._tokens = float(self._settings["burst"])
+        self._refilled = time.monotonic()
+        self._metrics = dict.fromkeys(["queued", "sent", "delayed",
+                                       "dropped", "rejected", "discarded",
+                                       "missed",
+                                       "delayTotal", "delayMax",
+                                       "airtimeTotal", "acked",
+                                       "unmatched", "overflows",
+                                       "timeouts", "decreases"], 0)
+
+        self._running = True
+        self._thread = threading.Thread(name=name, target=self.__run,
+                                        daemon=True)
+        self._thread.start()
+
+    def Get(self, key):
+        return self._settings[key]
+
+#region Budgets
+    def GetAirtime(self, frame):
+        """
+        Time on air of a frame, if the dongle transmits it.
+
+        Args:
+            frame (bytes): Encoded frame
+
+        Returns:
+            float: Seconds on air (0 if it's not transmitted)
+        """
+        if self._settings["dutyCycle"] >= 1:
+            return 0.0
+
+        _, command, params = self._decoder.Classify(frame)
+        if command not in self._settings["airCommands"]:
+            return 0.0
+
+        return lora_airtime(len(";".join(params)), **self._settings["lora"])
+
+    def GetBudget(self):
+        """
+        Returns:
+            float: Seconds on air allowed in the window
+        """
+        return self._settings["dutyCycle"] * self._settings["window"]
+
+    def __refill(self, now):
+        rate = self._settings["rate"]
+        self._tokens = min(float(self._settings["burst"]),
+                           self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+    def __air_wait(self, now, airtime):
+        """
+        Seconds to wait until the airtime fits the budget.
+        """
+        window = self._settings["window"]
+        while self._airLog and self._airLog[0][0] <= now - window:
+            self._airUsed -= self._airLog.popleft()[1]
+
+        budget = self.GetBudget()
+        if airtime <= 0 or self._airUsed + airtime <= budget:
+            return 0.0
+
+        # Wait for the oldest transmissions to leave the window
+        used = self._airUsed
+        for sent, seconds in self._airLog:
+            used -= seconds
+            if used + airtime <= budget:
+                return sent + window - now
+
+        return window
+#endregion
+
+#region Flow control
+    def __decrease(self, now):
+        """
+        Multiplicative decrease of the window, once per
+        "ackTimeout" (the losses of one burst count once).
+        """
+        if now < self._recoverUntil:
+            return
+
+        self._window = max(float(self._flow["minWindow"]),
+                           self._window * self._flow["decrease"])
+        self._recoverUntil = now + self._flow["ackTimeout"]
+        self._metrics["decreases"] += 1
+
+    def __expire(self, now):
+        """
+        Commands without answer after "ackTimeout" are lost.
+
+        Returns:
+            float: Seconds until the oldest command expires
+        """
+        timeout = self._flow["ackTimeout"]
+        left = timeout
+        for sent in self._inflight.values():
+            while sent and sent[0] + timeout <= now:
+                sent.popleft()
+                self._inflightCount -= 1
+                self._metrics["timeouts"] += 1
+                self.__decrease(now)
+            if sent:
+                left = min(left, sent[0] + timeout - now)
+
+        return left
+
+    def __command(self, frame):
+        """
+        Kind and command name of a frame. Binary frames are
+        named by the protocol, by their code if it's not there.
+        """
+        kind, command, _ = self._decoder.Classify(frame)
+        if kind == "binary" and self._protocol is not None \
+                and command.startswith("0x"):
+            codec = self._protocol.GetByCode(int(command, 16))
+            if codec is not None:
+                command = codec.name
+        return kind, command
+
+    def __track(self, frame, now):
+        """
+        Adds a command written to the window, if the dongle
+        answers it (raw frames and messages are not answered).
+        """
+        kind, command = self.__command(frame)
+        if kind not in ("command", "binary") \
+                or command not in self._flow["commands"]:
+            return
+
+        self._inflight.setdefault(command, deque()).append(now)
+        self._inflightCount += 1
+
+    def OnReceived(self, kind, frame=None):
+        """
+        Feedback of the frames received, called from the
+        reading thread of the device. Answers open the
+        window, Overflow messages close it. An answer frees
+        the oldest command sent with its name; answers that
+        match no command in flight don't open the window.
+
+        Args:
+            kind (str): Kind of the frame received (FrameDecoder.Kind)
+            frame (bytes, optional): Frame received, to match the
+                                     answer with its command
+        """
+        if self._flow is None:
+            return
+
+        command = None
+        if kind in ("response", "binary") and frame is not None:
+            _, command = self.__command(frame)
+
+        with self._cond:
+            if kind == "overflow":
+                # The frame lost keeps its place in the window until
+                # it expires, so the sender can't refill the buffer
+                self._metrics["overflows"] += 1
+                self.__decrease(time.monotonic())
+            elif kind in ("response", "binary"):
+                sent = self._inflight.get(command)
+                if not sent:
+                    self._metrics["unmatched"] += 1
+                    return
+                sent.popleft()
+                self._inflightCount -= 1
+                self._metrics["acked"] += 1
+                self._window = min(float(self._flow["maxWindow"]),
+                                   self._window
+                                   + self._flow["increase"] / self._window)
+            else:
+                return
+
+            self._cond.notify()
+
+    def GetWindow(self):
+        return self._window
+#endregion
+
+#region Queue
+    def Send(self, frame, due=None):
+        """
+        Queues a frame to be written.
+
+        Args:
+            frame (bytes): Encoded frame
+            due (float, optional): Monotonic time to write it.
+                                   Defaults to now.
+
+        Returns:
+            bool: False if the frame was dropped (the queue is full)
+                  or rejected (its airtime doesn't fit in the budget)
+        """
+        now = time.monotonic()
+        return self.__push(frame, due or now, now)
+
+    def __push(self, frame, due, queued):
+        """
+        Queues a frame in the queue of its class.
+
+        Returns:
+            bool: Whether the frame was queued
+        """
+        airtime = self.GetAirtime(frame)
+        with self._cond:
+            if airtime > self.GetBudget():
+                # It would wait forever
+                self._metrics["rejected"] += 1
+                return False
+            if len(self._heap) + len(self._airHeap) \
+                    >= self._settings["queue"]:
+                self._metrics["dropped"] += 1
+                return False
+
+            heapq.heappush(self._airHeap if airtime > 0 else self._heap,
+                           (due, next(self._counter), frame, airtime,
+                            queued))
+            self._metrics["queued"] += 1
+            self._cond.notify()
+
+        return True
+
+    def Schedule(self, factory, period, start=None):
+        """
+        Sends a command periodically. The frame of each send
+        is created by "factory" with the epoch time of the send
+        (FrameTemplate.Stamp), at deadlines start + k * period.
+        Deadlines that are missed entirely are skipped.
+
+        Args:
+            factory (function): Creates the frame from a timestamp
+            period (float): Seconds between sends
+            start (float, optional): Monotonic time of the first
+                                     send. Defaults to now.
+
+        Returns:
+            int: Id of the periodic command, to cancel it
+        """
+        with self._cond:
+            task = _Periodic(next(self._counter), factory, period)
+            self._periodic[task.id] = task
+            heapq.heappush(self._heap, (start or time.monotonic(), task.id,
+                                        None, task, None))
+            self._cond.notify()
+
+        return task.id
+
+    def Cancel(self, id):
+        """
+        Stops a periodic command.
+
+        Args:
+            id (int): Id returned by Schedule
+        """
+        with self._cond:
+            task = self._periodic.pop(id, None)
+            if task:
+                task.active = False
+
+    def __head(self, now):
+        """
+        First item of the queues: the first one due, where
+        the frames transmitted by radio are due when the
+        airtime budget allows them.
+
+        Returns:
+            tuple: (queue, monotonic time it can be taken), or
+                   (None, None) if both queues are empty
+        """
+        heap, ready = None, None
+        if self._heap:
+            heap, ready = self._heap, self._heap[0][0]
+        if self._airHeap:
+            due, seq, _, airtime, _ = self._airHeap[0]
+            air = max(due, now + self.__air_wait(now, airtime))
+            if heap is None or (air, seq) < (ready, self._heap[0][1]):
+                heap, ready = self._airHeap, air
+
+        return heap, ready
+
+    def __next(self):
+        """
+        Waits until a frame of the queues can be written,
+        and takes it.
+
+        Returns:
+            tuple: (due, frame, airtime, queued time), (due, None,
+                   periodic command, None) when a periodic command
+                   is due, or None when the scheduler stops
+        """
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                heap, ready = self.__head(now)
+                if heap is None:
+                    self._cond.wait()
+                    continue
+                if ready > now:
+                    self._cond.wait(ready - now)
+                    continue
+
+                due, _, frame, extra, queued = heap[0]
+                if frame is None:
+                    # Periodic command, its frame is created by the
+                    # thread without the lock
+                    heapq.heappop(heap)
+                    task = extra
+                    if not task.active:
+                        continue
+
+                    following = due + task.period
+                    if following <= now:
+                        missed = int((now - following) // task.period) + 1
+                        self._metrics["missed"] += missed
+                        following += missed * task.period
+                    heapq.heappush(heap, (following, task.id,
+                                          None, task, None))
+                    return due, None, task, None
+
+                if self._flow is not None:
+                    expires = self.__expire(now)
+                    if self._inflightCount >= int(self._window):
+                        self._cond.wait(expires)
+                        continue
+
+                self.__refill(now)
+                if self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) 
+                                    / self._settings["rate"])
+                    continue
+
+                heapq.heappop(heap)
+                self._tokens -= 1
+                if self._flow is not None:
+                    self.__track(frame, now)
+                if extra > 0:
+                    self._airLog.append((now, extra))
+                    self._airUsed += extra
+                    self._metrics["airtimeTotal"] += extra
+
+                return due, frame, extra, queued
+
+        return None
+
+    def __run(self):
+        while True:
+            item = self.__next()
+            if item is None:
+                break
+
+            due, frame, extra, queued = item
+            if frame is None:
+                self.__produce(extra, due)
+                continue
+
+            sent = time.monotonic()
+            self._write(frame)
+
+            delay = sent - max(due, queued)
+            self._metrics["sent"] += 1
+            self._metrics["delayTotal"] += delay
+            if delay > self._tolerance:
+                self._metrics["delayed"] += 1
+            if delay > self._metrics["delayMax"]:
+                self._metrics["delayMax"] = delay
+#endregion
+
+    def __produce(self, task, due):
+        """
+        Creates and queues the frame of a periodic command
+        (FrameTemplate.Stamp). Called without the lock, the
+        factory can post events that wait for the GUI.
+        """
+        if not task.active:
+            return
+
+        self.__push(task.factory(time.time()), due, due)
+
+    def Stop(self, timeout=1.0):
+        """
+        Stops the scheduler. Frames still waiting are
+        discarded (and counted).
+
+        Args:
+            timeout (float, optional): Max seconds to wait for the
+                                       frame being written.
+        """
+        with self._cond:
+            self._running = False
+            self._metrics["discarded"] += self.GetPending()
+            self._heap = []
+            self._airHeap = []
+            self._periodic = {}
+            self._cond.notify_all()
+
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def GetPending(self):
+        return len(self._airHeap) + sum(1 for item in self._heap
+                                        if item[2] is not None)
+
+    def GetMetrics(self):
+        """
+        Metrics of the scheduler since it started.
+
+        Returns:
+            dict: Frames queued, sent, delayed (by the bucket, the
+                  budget or the window), dropped (queue full),
+                  rejected (airtime over the budget), discarded
+                  (on stop), periodic deadlines missed,
+                  pending, mean and max delay (s), airtime sent, used
+                  in the window and budget of the window (s), and the
+                  flow control answers (and the ones that matched no
+                  command), overflows, timeouts, decreases, current
+                  window and commands in flight
+        """
+        with self._cond:
+            metrics = dict(self._metrics)
+            self.__air_wait(time.monotonic(), 0)
+            metrics["airtimeWindow"] = self._airUsed
+            metrics["window"] = self._window
+            metrics["inflight"] = self._inflightCount
+
+        metrics["pending"] = self.GetPending()
+        metrics["delayMean"] = (metrics["delayTotal"] / metrics["sent"]
+                                if metrics["sent"] else 0.0)
+        metrics["airtimeBudget"] = self.GetBudget()
+
+        return metrics
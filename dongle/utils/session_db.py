@@ -0,0 +1,692 @@
+"""Session database.
+
+This file contains the classes of the persistent session store: every
+frame received and sent by the devices, in a SQLite database, indexed
+to answer questions across sessions ("F_Q responses of last week with
+an SNR below -5") without reading every saved log.
+
+Tables:
+
+    sessions  id | device | port | started | ended
+    frames    id | session | time | device | direction | kind | command
+                 | params | raw | count | first | stamp
+    fields    frame | name | value
+
+Times are epoch timestamps in ns, params are the parameters joined by
+";", and fields are the numeric values extracted from the responses
+with the telemetry rules of "app.json" (so they can be queried).
+Frames are indexed by time, and by device, command and direction (each
+one with the time). When the device collapses runs of identical frames,
+the first frame of a run is stored as usual and the rest of the run is
+one row at the time of its last frame, with the frames it stands for in
+"count" and the time of the first one in "first" (both empty in the
+other rows). "stamp" is the device timestamp of the responses and
+messages in host time (dongle.utils.clock), when it's known.
+
+SessionRecorder is the writer of a device. The reading thread only
+appends the frame to a queue; a thread of the recorder classifies the
+frames and inserts them in batches, one transaction per batch. The
+database is in WAL mode, so the app and the CLI can query it while the
+devices record.
+
+Can be used from a terminal:
+
+    python -m dongle.utils.session_db query [--since 7d] [--command F_Q]
+                                            [--field snr --below -5] ...
+    python -m dongle.utils.session_db ingest capture.cap [...]
+    python -m dongle.utils.session_db compact --days 30
+"""
+# Standard imports
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+# Internal imports
+from dongle.utils.frames import FrameDecoder
+from dongle.utils.telemetry import Telemetry
+from dongle.utils.capture import CaptureReader
+from dongle.utils.queues import BoundedQueue
+
+# One frame of the database
+#   time: Epoch Unix timestamp in nanoseconds
+#   device: Serial number or port of the device
+#   direction: "in" or "out"
+#   kind: Kind of the frame (FrameDecoder)
+#   command: Command name (if any)
+#   params: List of parameters
+#   raw: Bytes received or sent
+#   value: Value of the field queried (if any)
+#   count: Frames collapsed into this one (summaries of runs)
+#   first: Epoch timestamp of the first frame of the run
+#   stamp: Device timestamp in host epoch time (if known)
+FrameRecord = namedtuple("FrameRecord", ["time", "device", "direction",
+                                         "kind", "command", "params", "raw",
+                                         "value", "count", "first", "stamp"],
+                         defaults=(None, None, None))
+
+_schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    device TEXT,
+    port TEXT,
+    started INTEGER NOT NULL,
+    ended INTEGER
+);
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    device TEXT,
+    direction TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    command TEXT,
+    params TEXT,
+    raw BLOB,
+    count INTEGER,
+    first INTEGER,
+    stamp INTEGER
+);
+CREATE TABLE IF NOT EXISTS fields (
+    frame INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (frame, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_time ON frames (time);
+CREATE INDEX IF NOT EXISTS frames_device ON frames (device, time);
+CREATE INDEX IF NOT EXISTS frames_command ON frames (command, time);
+CREATE INDEX IF NOT EXISTS frames_direction ON frames (direction, time);
+CREATE INDEX IF NOT EXISTS fields_name ON fields (name, value);
+"""
+
+def _connect(path):
+    """
+    Opens the database, creating its tables if needed.
+    Each thread needs its own connection.
+    """
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(_schema)
+    # Databases created before the runs were collapsed
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(frames)")}
+    for column in ("count", "first", "stamp"):
+        if column not in columns:
+            try:
+                conn.execute("ALTER TABLE frames ADD COLUMN " + column
+                             + " INTEGER")
+            except sqlite3.OperationalError:
+                # Added by another connection
+                pass
+    return conn
+
+def _open_session(conn, device, port=None):
+    """
+    Returns:
+        int: Id of the new session
+    """
+    return conn.execute(
+        "INSERT INTO sessions (device, port, started) VALUES (?, ?, ?)",
+        (device, port, time.time_ns())).lastrowid
+
+def _close_session(conn, session):
+    conn.execute("UPDATE sessions SET ended = ? WHERE id = ?",
+                 (time.time_ns(), session))
+
+def _insert(conn, session, device, frames, decoder, telemetry):
+    """
+    Inserts frames in one transaction: each frame is
+    classified and the telemetry fields of the responses
+    are extracted.
+
+    Args:
+        conn (sqlite3.Connection): Database
+        session (int): Id of the session
+        device (str): Serial number or port of the device
+        frames (list): (epoch ns, direction, bytes, count, first
+                       epoch ns, device epoch ns) of each frame
+                       (the last three are None except for the
+                       summaries of runs and the device times)
+        decoder (FrameDecoder): Classification of the frames
+        telemetry (Telemetry): Extraction of the fields
+    """
+    rows = []
+    values = []
+    for t, direction, data, count, first, stamp in frames:
+        kind, command, params = decoder.Classify(data)
+        rows.append((session, t, device, direction, kind, command,
+                     ";".join(params), data, count, first, stamp))
+        if kind == "response":
+            values.append((len(rows) - 1, telemetry.Extract(data)))
+
+    # Takes the write lock, so the ids after the last one are ours
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM frames")
+        first = cursor.fetchone()[0] + 1
+        conn.executemany(
+            "INSERT INTO frames (id, session, time, device, direction, "
+            "kind, command, params, raw, count, first, stamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((first + i,) + row for i, row in enumerate(rows)))
+        conn.executemany(
+            "INSERT OR REPLACE INTO fields (frame, name, value) "
+            "VALUES (?, ?, ?)",
+            ((first + i, name, value) for i, fields in values
+             for name, value in fields))
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def parse_time(text):
+    """
+    Reads a time of a query: a time ago ("30m", "12h",
+    "7d") or a date ("2021-02-26" or "2021-02-26 10:30").
+
+    Returns:
+        int: Epoch timestamp (ns)
+    """
+    ago = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text.strip())
+    if ago:
+        units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+        return time.time_ns() - int(float(ago.group(1))
+                                    * units[ago.group(2)] * 1e9)
+
+    return int(datetime.fromisoformat(text.strip()).timestamp() * 1e9)
+
+def parse_query(text):
+    """
+    Reads a query written as words, the way it's typed in
+    the app:
+
+        command=F_Q kind=response snr<-5 since=7d limit=100
+
+    "name=value" sets a filter (device, command, direction,
+    kind, since, until, limit) and "field<value" or
+    "field>value" a condition on a telemetry field.
+
+    Returns:
+        dict: Arguments of SessionDB.Query
+
+    Raises:
+        ValueError: A word of the query is not valid
+    """
+    args = {}
+    for word in text.split():
+        condition = re.fullmatch(r"(\w+)([<>])(-?[\d.]+)", word)
+        if condition:
+            name, op, value = condition.groups()
+            if args.get("field", name) != name:
+                raise ValueError("Only one field can be queried: " + word)
+            args["field"] = name
+            args["below" if op == "<" else "above"] = float(value)
+            continue
+
+        name, _, value = word.partition("=")
+        if not value:
+            raise ValueError("Wrong filter: " + word)
+        if name == "since":
+            args["start"] = parse_time(value)
+        elif name == "until":
+            args["end"] = parse_time(value)
+        elif name == "limit":
+            args["limit"] = int(value)
+        elif name in ("device", "command", "direction", "kind", "field"):
+            args[name] = value
+        else:
+            raise ValueError("Unknown filter: " + name)
+
+    return args
+
+class SessionRecorder:
+    """
+    Writer of the frames of a device into the database.
+    Has the Write method of CaptureWriter, so the device
+    uses it the same way. Frames are queued in a bounded
+    queue and inserted by the thread of the recorder; the
+    policy of the queue decides if Write drops the frames
+    that don't fit (counted) or waits for room.
+
+    Errors of the database are printed and kept in "error".
+    A batch that can't be inserted is dropped; when the
+    database can't be used anymore, the recorder fails: its
+    queue is closed and the frames are dropped (counted).
+    """
+#region Variables
+    # Default values of the "sessionDb" configuration
+    DEFAULTS = {
+        "enabled": False,
+        # Database file (None: sessions.db in the saving directory)
+        "path": None,
+        # Max frames per transaction and seconds between them
+        "batch": 5000,
+        "interval": 0.25,
+        # Frames waiting to be inserted
+        "queue": 200000,
+        # Days of frames kept (0: forever), applied when starting
+        "retention": 30,
+        "fields": {}
+    }
+
+    _conf = None
+    _pending: BoundedQueue = None
+    _session = None
+    _device = None
+    _stop: threading.Event = None
+    _thread: threading.Thread = None
+
+    # Statistics
+    written = 0
+    dropped = 0
+    # Last error of the database, and whether it stopped recording
+    error = None
+    failed = False
+#endregion
+
+    def __init__(self, path, device, port=None, conf=None, queue=None):
+        """
+        Args:
+            path (str): Path of the database
+            device (str): Serial number or port of the device
+            port (str, optional): Port of the device
+            conf (dict, optional): "sessionDb" configuration, with the
+                                   telemetry "fields" rules
+            queue (BoundedQueue, optional): Queue of the frames. 
+                                            Defaults to one of "queue" 
+                                            frames that drops the new 
+                                            ones when full.
+        """
+        self._conf = dict(self.DEFAULTS, **(conf or {}))
+        self.path = path
+        self._device = device
+        self._pending = queue
+        if queue is None:
+            self._pending = BoundedQueue(self._conf["queue"], name="recorder")
+        self._stop = threading.Event()
+        self.written = 0
+        self.dropped = 0
+
+        conn = _connect(path)
+        self._session = _open_session(conn, device, port)
+        conn.close()
+
+        self._thread = threading.Thread(name="Session recorder",
+                                        target=self.__run, daemon=True)
+        self._thread.start()
+
+    def Write(self, direction, data, t=None, count=None, first=None,
+              stamp=None):
+        """
+        Queues a frame. Called from the reading and writing
+        threads of the device.
+
+        Args:
+            direction (str): "in" or "out"
+            data (bytes): Frame
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+            count (int, optional): Frames collapsed, for the summary
+                                   of a run of identical frames.
+            first (int, optional): Epoch timestamp (ns) of the first
+                                   frame of the run.
+            stamp (int, optional): Device timestamp in host epoch
+                                   time (ns).
+        """
+        self._pending.Put((t or time.time_ns(), direction, bytes(data),
+                           count or None, first, stamp))
+
+    def __run(self):
+        try:
+            conn = _connect(self.path)
+        except sqlite3.Error as e:
+            self.__fail(e)
+            return
+
+        decoder = FrameDecoder()
+        telemetry = Telemetry({"fields": self._conf["fields"]})
+        try:
+            if self._conf["retention"]:
+                try:
+                    SessionDB.Purge(conn, self._conf["retention"])
+                except sqlite3.Error as e:
+                    # Old frames are kept, recording goes on
+                    self.__report(e)
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+            while True:
+                # Don't wait while there are full batches
+                stopping = self._stop.is_set()
+                if len(self._pending) < self._conf["batch"]:
+                    stopping = self._stop.wait(self._conf["interval"])
+                while self._pending:
+                    self.__insert(conn, decoder, telemetry)
+                if stopping:
+                    break
+        except Exception as e:
+            self.__fail(e)
+        finally:
+            try:
+                _close_session(conn, self._session)
+            except sqlite3.Error as e:
+                self.__report(e)
+            conn.close()
+
+    def __insert(self, conn, decoder, telemetry):
+        """
+        Inserts a batch of the queued frames.
+        """
+        frames = self._pending.GetBatch(self._conf["batch"])
+        count = len(frames)
+        try:
+            _insert(conn, self._session, self._device, frames, decoder,
+                    telemetry)
+        except (sqlite3.Error, ValueError) as e:
+            self.__report(e)
+            self.dropped += count
+            return
+
+        self.written += count
+
+    def __report(self, e):
+        print("Session database: " + str(e))
+        self.error = str(e)
+
+    def __fail(self, e):
+        """
+        Stops recording: the frames queued and the ones
+        written afterwards are dropped.
+        """
+        self.__report(e)
+        self.failed = True
+        self._pending.Close()
+        while self._pending:
+            self.dropped += len(self._pending.GetBatch(self._conf["batch"]))
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Frames written, dropped (by the queue or by
+                  errors of the database) and waiting, the last
+                  error and whether the recorder failed
+        """
+        return {"written": self.written,
+                "dropped": self.dropped
+                           + self._pending.GetStats()["dropped"],
+                "pending": len(self._pending),
+                "error": self.error,
+                "failed": self.failed}
+
+    def GetQueueStats(self):
+        return self._pending.GetStats()
+
+    def Close(self, timeout=5.0):
+        """
+        Inserts the frames still queued and closes the
+        session.
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+        self._pending.Close()
+
+class SessionDB:
+    """
+    Query side of the database. Queries return their
+    rows in batches, to be used from a thread.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the database
+        """
+        self.path = path
+        self._conn = _connect(path)
+
+    def Query(self, start=None, end=None, device=None, command=None,
+              direction=None, kind=None, field=None, below=None,
+              above=None, limit=None, batch=1000):
+        """
+        Searches frames. Every filter is optional.
+
+        Args:
+            start (int, optional): Epoch ns of the first frame.
+            end (int, optional): Epoch ns of the last frame.
+            device (str, optional): Serial number or port.
+            command (str, optional): Command name.
+            direction (str, optional): "in" or "out".
+            kind (str, optional): Kind of the frame.
+            field (str, optional): Telemetry field that the frames
+                                   must have (its value is returned).
+            below (float, optional): Max value of the field.
+            above (float, optional): Min value of the field.
+            limit (int, optional): Max frames returned.
+            batch (int, optional): Frames per batch. Defaults to 1000.
+
+        Yields:
+            list: FrameRecords, in time order
+        """
+        columns = ("f.time, f.device, f.direction, f.kind, f.command, "
+                   "f.params, f.raw")
+        run = ", f.count, f.first, f.stamp"
+        sql = "SELECT " + columns + ", NULL" + run + " FROM frames f"
+        where = []
+        args = []
+        if field is not None:
+            sql = ("SELECT " + columns + ", v.value" + run
+                   + " FROM fields v JOIN frames f ON f.id = v.frame")
+            where.append("v.name = ?")
+            args.append(field)
+            if below is not None:
+                where.append("v.value < ?")
+                args.append(below)
+            if above is not None:
+                where.append("v.value > ?")
+                args.append(above)
+
+        for column, value in (("f.device", device), ("f.command", command),
+                              ("f.direction", direction), ("f.kind", kind)):
+            if value is not None:
+                where.append(column + " = ?")
+                args.append(value)
+        if start is not None:
+            where.append("f.time >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("f.time <= ?")
+            args.append(end)
+
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY f.time"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+
+        cursor = self._conn.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            yield [FrameRecord(t, dev, d, k, c,
+                               p.split(";") if p else [], raw, value,
+                               count, first, stamp)
+                   for t, dev, d, k, c, p, raw, value, count, first, stamp
+                   in rows]
+
+    def GetSessions(self):
+        """
+        Returns:
+            list: (id, device, port, started, ended, frames) of
+                  each session
+        """
+        return self._conn.execute(
+            "SELECT s.id, s.device, s.port, s.started, s.ended, "
+            "(SELECT COUNT(*) FROM frames f WHERE f.session = s.id) "
+            "FROM sessions s ORDER BY s.started").fetchall()
+
+    def Ingest(self, path, device=None, fields=None, batch=5000):
+        """
+        Adds the frames of a capture as a new session.
+
+        Args:
+            path (str): Path of the capture
+            device (str, optional): Device name. Defaults to the
+                                    name of the capture.
+            fields (dict, optional): Telemetry "fields" rules
+            batch (int, optional): Frames per transaction.
+
+        Returns:
+            int: Frames added
+        """
+        device = device or os.path.splitext(os.path.basename(path))[0]
+        decoder = FrameDecoder()
+        telemetry = Telemetry({"fields": fields or {}})
+        session = _open_session(self._conn, device)
+        frames = []
+        count = 0
+        for t, direction, data, _, stamp in CaptureReader(path).ReadSources():
+            frames.append((t, direction, data, None, None, stamp))
+            if len(frames) == batch:
+                _insert(self._conn, session, device, frames, decoder,
+                        telemetry)
+                count += batch
+                frames = []
+        if frames:
+            _insert(self._conn, session, device, frames, decoder, telemetry)
+            count += len(frames)
+        _close_session(self._conn, session)
+
+        return count
+
+    @staticmethod
+    def Purge(conn, days):
+        """
+        Removes the frames older than "days" days, and the
+        sessions left without frames.
+
+        Returns:
+            int: Frames removed
+        """
+        limit = time.time_ns() - int(days * 86400 * 1e9)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM fields WHERE frame IN "
+                     "(SELECT id FROM frames WHERE time < ?)", (limit,))
+        removed = conn.execute("DELETE FROM frames WHERE time < ?",
+                               (limit,)).rowcount
+        conn.execute("DELETE FROM sessions WHERE ended IS NOT NULL "
+                     "AND ended < ? AND id NOT IN "
+                     "(SELECT DISTINCT session FROM frames)", (limit,))
+        conn.execute("COMMIT")
+
+        return removed
+
+    def Compact(self, days=None):
+        """
+        Applies the retention and gives the free space back
+        to the system.
+
+        Args:
+            days (float, optional): Days of frames kept. Defaults
+                                    to keeping every frame.
+
+        Returns:
+            int: Frames removed
+        """
+        removed = self.Purge(self._conn, days) if days else 0
+        self._conn.execute("PRAGMA incremental_vacuum")
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.execute("PRAGMA optimize")
+
+        return removed
+
+    def Close(self):
+        self._conn.close()
+
+def main(argv=None):
+    # Imported here, only to know the default database
+    from dongle.utils.file_manager import Saver
+
+    parser = argparse.ArgumentParser(
+        description="Query the DynaLoRa session database")
+    parser.add_argument("--db", help="Database (default: sessions.db in "
+                                     "the saving directory)")
+    commands = parser.add_subparsers(dest="action", required=True)
+
+    query = commands.add_parser("query", help="Search frames")
+    query.add_argument("--since", help="Time ago (7d, 12h) or date")
+    query.add_argument("--until", help="Time ago (7d, 12h) or date")
+    for name in ("device", "command", "direction", "kind", "field"):
+        query.add_argument("--" + name)
+    query.add_argument("--below", type=float)
+    query.add_argument("--above", type=float)
+    query.add_argument("--limit", type=int)
+    query.add_argument("--export",
+                       help="Write the frames to a .parquet, .arrow or .npz")
+
+    ingest = commands.add_parser("ingest", help="Add captures")
+    ingest.add_argument("captures", nargs="+")
+
+    compact = commands.add_parser("compact",
+                                  help="Apply the retention and shrink")
+    compact.add_argument("--days", type=float)
+
+    commands.add_parser("sessions", help="List the sessions")
+    args = parser.parse_args(argv)
+
+    path = args.db or Saver().GetSessionDB()
+    db = SessionDB(path)
+    begin = time.perf_counter()
+
+    if args.action == "ingest":
+        for capture in args.captures:
+            print("{0}: {1} frames".format(capture, db.Ingest(capture)))
+    elif args.action == "compact":
+        print("{0} frames removed".format(db.Compact(args.days)))
+    elif args.action == "sessions":
+        for sid, device, port, started, ended, frames in db.GetSessions():
+            print("{0} {1} {2} {3} {4} frames".format(
+                sid, device, port,
+                datetime.fromtimestamp(started / 1e9).isoformat(" ",
+                                                                "seconds"),
+                frames))
+    else:
+        batches = db.Query(
+            args.since and parse_time(args.since),
+            args.until and parse_time(args.until),
+            args.device, args.command, args.direction, args.kind,
+            args.field, args.below, args.above, args.limit)
+        count = 0
+        if args.export:
+            from dongle.utils.export import SessionExporter
+            exporter = SessionExporter(args.export)
+            for batch in batches:
+                for r in batch:
+                    exporter.Write(r.time, r.direction, r.kind, r.command,
+                                   r.params, r.raw, r.device)
+                count += len(batch)
+            exporter.Close()
+            print("Exported to " + exporter.path)
+        else:
+            for batch in batches:
+                for r in batch:
+                    print(datetime.fromtimestamp(r.time / 1e9).isoformat(" "),
+                          r.device, r.direction,
+                          r.raw.decode("utf-8", "replace").strip(),
+                          "" if r.value is None else r.value,
+                          "" if r.count is None
+                          else "(repeated {0} times)".format(r.count))
+                count += len(batch)
+        print("{0} frames".format(count))
+
+    print("Done in {0:.2f} s".format(time.perf_counter() - begin))
+    db.Close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
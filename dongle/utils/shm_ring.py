@@ -0,0 +1,266 @@
+"""Shared memory ring buffer.
+
+This file contains the classes that hand the frames received to other
+processes through shared memory, without sockets or copies. FrameRing
+publishes frames into a ring of fixed size slots, and FrameRingReader
+reads them from another process as memoryviews of the shared memory.
+
+Memory layout:
+
+    header: magic | version | slots | slot size | next sequence
+    slot:   stamp | length | timestamp (ns) | frame data
+
+The stamp of a slot is the sequence of the frame it holds plus one,
+and it's set to 0 while the slot is being written. Every reader keeps
+its own cursor (the sequence of the next frame to read), so a reader
+knows when a frame is not written yet, when it's ready and when the
+publisher already overwrote it (the reader was too slow).
+"""
+# Standard imports
+import struct
+import time
+from multiprocessing import shared_memory
+
+# Header and slot header of the ring
+_header = struct.Struct("<4sIIIQ")
+_slot = struct.Struct("<QIxxxxQ")
+_seq = struct.Struct("<Q")
+_data = struct.Struct("<IxxxxQ")
+
+_magic = b"DLRB"
+_version = 1
+
+# Offset of the next sequence in the header
+_seqOffset = 16
+
+# Blocks created by the rings of this process
+_owned = set()
+
+def _attach(name):
+    """
+    Attaches to an existing shared memory block without
+    letting the resource tracker of this process remove it
+    when the process ends (it belongs to the publisher).
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always tracks the block
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name in _owned:
+            # Tracked once, by the ring that created it
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+class FrameRing:
+    """
+    Publisher side of the ring. Creates the shared memory
+    block and writes the frames into it. Only one process
+    (the reading thread of the device) publishes.
+
+    Frames longer than a slot are truncated, and counted.
+    """
+#region Variables
+    _shm = None
+    _buf = None
+    _slots = 0
+    _slotSize = 0
+    _payload = 0
+    _next = 0
+
+    # Statistics
+    truncated = 0
+#endregion
+
+    def __init__(self, name=None, slots=65536, slotSize=256):
+        """
+        Args:
+            name (str, optional): Name of the shared memory block.
+                                  Defaults to a random one.
+            slots (int, optional): Number of slots. Defaults to 65536.
+            slotSize (int, optional): Bytes per slot. Defaults to 256.
+        """
+        if slotSize <= _slot.size:
+            raise ValueError("Slot size must be bigger than "
+                             + str(_slot.size))
+
+        size = _header.size + slots * slotSize
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=size)
+        self._buf = self._shm.buf
+        _owned.add(self._shm.name)
+        self._slots = slots
+        self._slotSize = slotSize
+        self._payload = slotSize - _slot.size
+        self._next = 0
+        self.truncated = 0
+        _header.pack_into(self._buf, 0, _magic, _version, slots, slotSize, 0)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def Publish(self, frame, t=None):
+        """
+        Writes a frame in the next slot.
+
+        Args:
+            frame (bytes): Frame received
+            t (int, optional): Epoch timestamp (ns). Defaults to now.
+        """
+        if t is None:
+            t = time.time_ns()
+
+        seq = self._next
+        offset = _header.size + (seq % self._slots) * self._slotSize
+        length = len(frame)
+        if length > self._payload:
+            length = self._payload
+            self.truncated += 1
+
+        buf = self._buf
+        # Mark slot as being written, then data, and the stamp the last
+        _seq.pack_into(buf, offset, 0)
+        start = offset + _slot.size
+        buf[start:start + length] = frame[:length]
+        _data.pack_into(buf, offset + _seq.size, length, t)
+        _seq.pack_into(buf, offset, seq + 1)
+
+        self._next = seq + 1
+        _seq.pack_into(buf, _seqOffset, self._next)
+
+    def GetPublished(self):
+        return self._next
+
+    def Close(self):
+        """
+        Closes and removes the shared memory block.
+        Readers attached keep their mapping until they close.
+        """
+        if self._shm:
+            self._buf = None
+            self._shm.close()
+            self._shm.unlink()
+            _owned.discard(self._shm.name)
+            self._shm = None
+
+class FrameRingReader:
+    """
+    Consumer side of the ring. Each reader has its own
+    cursor, so many processes can read the same ring.
+
+    Frames are returned as memoryviews of the shared
+    memory (no copies). A view is only valid while the
+    publisher doesn't write over its slot, so after
+    using it the reader can check it with IsValid. Views
+    must be released before closing the reader.
+    """
+#region Variables
+    _shm = None
+    _buf = None
+    _slots = 0
+    _slotSize = 0
+    _cursor = 0
+
+    # Frames lost because the reader was too slow
+    lost = 0
+#endregion
+
+    def __init__(self, name, fromStart=False):
+        """
+        Args:
+            name (str): Name of the shared memory block
+            fromStart (bool, optional): Read the frames still in the
+                                        ring instead of only new ones.
+        """
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        magic, version, self._slots, self._slotSize, published = \
+            _header.unpack_from(self._buf, 0)
+        if magic != _magic or version != _version:
+            self._shm.close()
+            raise ValueError("Not a DynaLoRa frame ring: " + name)
+
+        self._cursor = published
+        if fromStart:
+            self._cursor = max(0, published - self._slots + 1)
+        self.lost = 0
+
+    def __published(self):
+        return _seq.unpack_from(self._buf, _seqOffset)[0]
+
+    def Read(self):
+        """
+        Reads the next frame, if there's one.
+
+        Returns:
+            tuple: (sequence, timestamp in ns, memoryview) or None
+        """
+        seq = self._cursor
+        offset = _header.size + (seq % self._slots) * self._slotSize
+        stamp = _seq.unpack_from(self._buf, offset)[0]
+
+        if stamp != seq + 1:
+            published = self.__published()
+            if published <= seq:
+                # Nothing new (or still being written)
+                return None
+
+            if published - seq > self._slots - 1 or stamp > seq + 1:
+                # Overwritten, jump to the oldest frame still in the ring
+                oldest = published - self._slots + 1
+                self.lost += oldest - seq
+                self._cursor = oldest
+                return self.Read()
+
+            # Being written right now
+            return None
+
+        length, t = _data.unpack_from(self._buf, offset + _seq.size)
+        self._cursor = seq + 1
+        start = offset + _slot.size
+        return seq, t, self._buf[start:start + length]
+
+    def ReadBatch(self, count=1024):
+        """
+        Reads up to "count" frames.
+
+        Returns:
+            list: Tuples (sequence, timestamp in ns, memoryview)
+        """
+        frames = []
+        while len(frames) < count:
+            frame = self.Read()
+            if frame is None:
+                break
+            frames.append(frame)
+
+        return frames
+
+    def IsValid(self, seq):
+        """
+        Checks that the slot of a frame read was not
+        overwritten while it was being used.
+
+        Args:
+            seq (int): Sequence of the frame
+
+        Returns:
+            bool: Whether the view of the frame is still valid
+        """
+        offset = _header.size + (seq % self._slots) * self._slotSize
+        return _seq.unpack_from(self._buf, offset)[0] == seq + 1
+
+    def GetPending(self):
+        return self.__published() - self._cursor
+
+    def Close(self):
+        if self._shm:
+            self._buf = None
+            self._shm.close()
+            self._shm = None
@@ -0,0 +1,338 @@
+"""Dongle simulator.
+
+This file contains the class SimulatedDongle, a virtual serial port
+that behaves like a DynaLoRa dongle with a finite buffer. Frames
+written to it wait in its buffer and are processed one by one at a
+fixed service rate (like the radio of the dongle); each one processed
+is answered with a response. When a frame arrives with the buffer full
+it's lost and the dongle answers with an Overflow message.
+
+It's used to measure the goodput of the TX pipeline (frames answered
+per second) with and without flow control, with the device in this
+process or in a worker process, and the time that closing a device
+takes. Can be run as a benchmark without GUI:
+
+    python -m dongle.utils.simulator [--frames N] [--service F/S]
+                                     [--buffer N] [--flow] [--isolated]
+    python -m dongle.utils.simulator --close N
+"""
+# Standard imports
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+
+class SimulatedDongle:
+    """
+    Virtual serial port with the behaviour of a dongle:
+    finite buffer, fixed service rate, a response for
+    every frame processed and Overflow messages for the
+    frames that don't fit in the buffer. Implements the
+    part of serial.Serial used by Device.
+    """
+#region Variables
+    # Seconds that readline waits when there's no data
+    timeout = 0.1
+
+    OVERFLOW = b"Overflow\r\n"
+
+    _buffer: deque = None
+    _size = 16
+    _service = 0.005
+    _lock: threading.Lock = None
+    _ready: threading.Condition = None
+    _output: queue.Queue = None
+    _closed: threading.Event = None
+    _thread: threading.Thread = None
+
+    # Clock of the dongle: offset (s) and drift (ppm) from the host
+    _offset = 0.0
+    _drift = 0.0
+    _begin = 0.0
+
+    # Statistics
+    received = 0
+    processed = 0
+    overflows = 0
+#endregion
+
+    def __init__(self, service=200, size=16, timeout=0.1, offset=0.0,
+                 drift=0.0):
+        """
+        Args:
+            service (float, optional): Frames processed per second.
+                                       Defaults to 200.
+            size (int, optional): Frames in the buffer. Defaults to 16.
+            timeout (float, optional): Seconds that a read waits.
+                                       Defaults to 0.1.
+            offset (float, optional): Seconds that the clock of the
+                                      dongle is ahead. Defaults to 0.
+            drift (float, optional): Drift of the clock of the dongle
+                                     (ppm). Defaults to 0.
+        """
+        self.name = "sim://dongle"
+        self.timeout = timeout
+        self._buffer = deque()
+        self._size = size
+        self._service = 1.0 / service
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._output = queue.Queue()
+        self._closed = threading.Event()
+        self.received = 0
+        self.processed = 0
+        self.overflows = 0
+        self._offset = offset
+        self._drift = drift
+        self._begin = time.time()
+
+        self._thread = threading.Thread(name="Simulated dongle",
+                                        target=self.__process, daemon=True)
+        self._thread.start()
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def inWaiting(self):
+        return 0
+
+    def write(self, data):
+        """
+        Receives a frame. Lost, with an Overflow message,
+        if the buffer is full.
+        """
+        with self._lock:
+            self.received += 1
+            if len(self._buffer) >= self._size:
+                self.overflows += 1
+                self._output.put(self.OVERFLOW)
+            else:
+                self._buffer.append(bytes(data))
+                self._ready.notify()
+
+        return len(data)
+
+    def __process(self):
+        deadline = time.monotonic()
+        while not self._closed.is_set():
+            with self._lock:
+                while not self._buffer and not self._closed.is_set():
+                    self._ready.wait(self.timeout)
+                if self._closed.is_set():
+                    break
+                frame = self._buffer[0]
+
+            # Fixed service time, keeping the pace of the radio
+            deadline = max(deadline + self._service, time.monotonic())
+            self._closed.wait(max(0, deadline - time.monotonic()))
+
+            with self._lock:
+                self._buffer.popleft()
+                self.processed += 1
+
+            fields = frame.split(b";")
+            command = fields[2] if len(fields) > 2 else b"ACK"
+            self._output.put(b"DLR;1;%s;OK;%.3f;EOR\r\n"
+                             % (command, self.GetTime()))
+
+    def GetTime(self):
+        """
+        Clock of the dongle, with its offset and drift.
+
+        Returns:
+            float: Epoch seconds
+        """
+        now = time.time()
+        return (now + self._offset
+                + (now - self._begin) * self._drift * 1e-6)
+
+    def readline(self, size=-1):
+        """
+        Returns the next answer of the dongle.
+
+        Returns:
+            bytes: Answer, or empty when there's none
+        """
+        try:
+            return self._output.get(timeout=self.timeout)
+        except queue.Empty:
+            return b""
+
+    def cancel_read(self):
+        # Wake up the read in progress, like serial.Serial does
+        self._closed.set()
+        self._output.put(b"")
+
+    def close(self):
+        self._closed.set()
+
+    def GetStats(self):
+        return {"received": self.received, "processed": self.processed,
+                "overflows": self.overflows}
+
+def benchmark(frames=2000, service=200, size=16, flow=False, payload=32):
+    """
+    Sends "frames" PLD_Q frames as fast as possible to a
+    simulated dongle through a Device, and measures the
+    goodput until every frame is answered or lost.
+
+    Returns:
+        dict: Frames answered, lost (Overflow), seconds and goodput
+    """
+    from dongle.device import Device
+    from dongle.utils.config import ConfigCache, AppConfig
+
+    cnf = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       '..', 'data/cnf'))
+    conf = ConfigCache().Load(cnf, "app.json", AppConfig)
+    conf.scheduler = dict(conf.scheduler, rate=10 * service, burst=size,
+                          queue=frames, dutyCycle=1.0,
+                          flowControl={"enabled": flow})
+
+    port = SimulatedDongle(service, size)
+    device = Device(conf, None, port=port)
+    frame = b"DLC;1;PLD_Q;" + b"x" * payload + b";0"
+
+    begin = time.perf_counter()
+    for _ in range(frames):
+        device.write_frame(frame)
+
+    scheduler = device.get_scheduler()
+    while True:
+        stats = port.GetStats()
+        if (stats["processed"] + stats["overflows"] >= frames
+                and scheduler.GetPending() == 0):
+            break
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - begin
+    metrics = scheduler.GetMetrics()
+    device.close()
+
+    return {"answered": stats["processed"], "lost": stats["overflows"],
+            "seconds": elapsed, "goodput": stats["processed"] / elapsed,
+            "window": metrics["window"]}
+
+def isolated_benchmark(frames=2000, service=200, size=16, flow=False,
+                       payload=32):
+    """
+    Like benchmark, but the Device runs in a worker process
+    (RemoteDevice) with the simulated dongle. Frames are
+    counted in this process, as they arrive through the
+    channel of the worker.
+
+    Returns:
+        dict: Frames answered, lost (Overflow), seconds, goodput
+              and messages per send of the channel
+    """
+    from functools import partial
+    from dongle.worker import RemoteDevice
+    from dongle.utils.config import ConfigCache, AppConfig
+    from dongle.utils.frames import FrameDecoder
+
+    cnf = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       '..', 'data/cnf'))
+    conf = ConfigCache().Load(cnf, "app.json", AppConfig)
+    conf.scheduler = dict(conf.scheduler, rate=10 * service, burst=size,
+                          queue=frames, dutyCycle=1.0,
+                          flowControl={"enabled": flow})
+
+    counts = {"response": 0, "overflow": 0}
+    done = threading.Event()
+    decoder = FrameDecoder()
+
+    def count(frame):
+        kind = decoder.Kind(frame)
+        if kind in counts:
+            counts[kind] += 1
+            if counts["response"] + counts["overflow"] >= frames:
+                done.set()
+
+    device = RemoteDevice(conf, None, port=partial(SimulatedDongle,
+                                                   service, size))
+    device.subscribe(count)
+    frame = b"DLC;1;PLD_Q;" + b"x" * payload + b";0"
+
+    begin = time.perf_counter()
+    for _ in range(frames):
+        device.write_frame(frame)
+    done.wait(frames / service * 10 + 10)
+    elapsed = time.perf_counter() - begin
+    stats = device.get_worker_stats()
+    device.close()
+
+    return {"answered": counts["response"], "lost": counts["overflow"],
+            "seconds": elapsed, "goodput": counts["response"] / elapsed,
+            "batch": stats["messages"] / max(stats["sends"], 1)}
+
+def close_benchmark(runs=20, timeout=1.0):
+    """
+    Measures the time from Device.close() until every
+    thread of the device ended, with reads that wait up
+    to "timeout" seconds.
+
+    Returns:
+        dict: Mean and max seconds, and threads left alive
+    """
+    from dongle.device import Device
+    from dongle.utils.config import ConfigCache, AppConfig
+
+    cnf = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       '..', 'data/cnf'))
+    conf = ConfigCache().Load(cnf, "app.json", AppConfig)
+
+    before = threading.active_count()
+    times = []
+    for _ in range(runs):
+        port = SimulatedDongle(timeout=timeout)
+        device = Device(conf, None, port=port)
+        # Let the reading thread block in a read
+        time.sleep(0.05)
+
+        begin = time.perf_counter()
+        device.close()
+        times.append(time.perf_counter() - begin)
+        port._thread.join(timeout)
+
+    return {"runs": runs, "mean": sum(times) / runs, "max": max(times),
+            "leaked": threading.active_count() - before}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Goodput benchmark against a simulated dongle")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--service", type=float, default=200,
+                        help="Frames processed per second by the dongle")
+    parser.add_argument("--buffer", type=int, default=16,
+                        help="Frames in the buffer of the dongle")
+    parser.add_argument("--flow", action="store_true",
+                        help="Enable the flow control")
+    parser.add_argument("--isolated", action="store_true",
+                        help="Run the device in a worker process")
+    parser.add_argument("--close", type=int, default=0,
+                        help="Measure the closing time over N devices")
+    args = parser.parse_args(argv)
+
+    if args.close:
+        result = close_benchmark(args.close)
+        print("close: mean {mean:.4f} s, max {max:.4f} s over {runs} runs, "
+              "{leaked} threads left".format(**result))
+        return
+
+    if args.isolated:
+        result = isolated_benchmark(args.frames, args.service, args.buffer,
+                                    args.flow)
+        print("{answered} answered, {lost} lost in {seconds:.2f} s: "
+              "{goodput:.1f} frames/s ({batch:.1f} frames per send)"
+              .format(**result))
+        return
+
+    result = benchmark(args.frames, args.service, args.buffer, args.flow)
+    print("{answered} answered, {lost} lost in {seconds:.2f} s: "
+          "{goodput:.1f} frames/s (window {window:.1f})".format(**result))
+
+if __name__ == "__main__":
+    sys.exit(main())
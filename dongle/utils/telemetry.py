@@ -0,0 +1,235 @@
+"""Telemetry.
+
+This file contains the classes that extract numeric values from the
+frames received (RSSI, SNR, frequency...) and store them to be plotted.
+Which fields are extracted is declared per command in "app.json", and
+the extraction runs in the reading thread of the device.
+
+Values are stored in NumPy ring buffers, and Decimate reduces a window
+of points to the min/max of each pixel column before drawing it.
+"""
+# Standard imports
+import time
+import threading
+
+# Third parties
+import numpy as np
+
+class RingBuffer:
+    """
+    Fixed size buffer of (time, value) points. When it's
+    full the oldest points are overwritten. Points are
+    appended in time order, so both parts of the ring
+    are sorted and a time window can be found with a
+    binary search.
+    """
+    _times = None
+    _values = None
+    _next = 0
+    _count = 0
+    _lock: threading.Lock = None
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Max number of points stored
+        """
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def Append(self, t, value):
+        """
+        Adds a new point.
+
+        Args:
+            t (float): Epoch Unix timestamp
+            value (float): Value of the point
+        """
+        with self._lock:
+            self._times[self._next] = t
+            self._values[self._next] = value
+            self._next = (self._next + 1) % len(self._times)
+            self._count = min(self._count + 1, len(self._times))
+
+    def Window(self, t0):
+        """
+        Gets the points newer than a time, in order. Only
+        the points of the window are copied.
+
+        Args:
+            t0 (float): First time of the window
+
+        Returns:
+            tuple: Arrays of times and values
+        """
+        with self._lock:
+            size = len(self._times)
+            if self._count < size:
+                parts = [(0, self._count)]
+            else:
+                parts = [(self._next, size), (0, self._next)]
+
+            times, values = [], []
+            for begin, end in parts:
+                first = begin + np.searchsorted(self._times[begin:end], t0)
+                times.append(self._times[first:end])
+                values.append(self._values[first:end])
+
+            return np.concatenate(times), np.concatenate(values)
+
+    def __len__(self):
+        return self._count
+
+def Decimate(times, values, t0, t1, columns):
+    """
+    Reduces the points of a window to the minimum and maximum
+    of each pixel column, so drawing the window costs the same
+    whatever the number of points.
+
+    Args:
+        times (np.ndarray): Sorted times
+        values (np.ndarray): Values
+        t0 (float): Time of the first column
+        t1 (float): Time of the last column
+        columns (int): Number of pixel columns
+
+    Returns:
+        tuple: Arrays of columns, minimums and maximums
+    """
+    if len(times) == 0 or columns <= 0 or t1 <= t0:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty, empty
+
+    cols = ((times - t0) * (columns / (t1 - t0))).astype(np.int64)
+    np.clip(cols, 0, columns - 1, out=cols)
+
+    # Times are sorted, so each column is a contiguous run
+    starts = np.flatnonzero(np.diff(cols, prepend=-1))
+
+    return (cols[starts],
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts))
+
+class Telemetry:
+    """
+    This class extracts the numeric fields of the frames
+    received from the device and stores them in one ring
+    buffer per series.
+
+    Rules are read from the "telemetry" entry of "app.json":
+
+        "fields": {
+            "F_Q": [{"name": "rssi", "index": 0, "scale": 1.0}]
+        }
+
+    where "index" is the position of the field in the
+    parameters of the command response.
+    """
+    # Default values of the configuration
+    DEFAULTS = {
+        "capacity": 1000000,
+        "window": 60,
+        "fps": 20,
+        "fields": {}
+    }
+
+    _conf = None
+    _rules = None
+    _series = None
+    _lock: threading.Lock = None
+
+    def __init__(self, conf=None):
+        """
+        Args:
+            conf (dict, optional): Telemetry configuration
+        """
+        self._conf = dict(self.DEFAULTS)
+        self._conf.update(conf or {})
+        self._series = {}
+        self._lock = threading.Lock()
+
+        # Rules by command, as (name, index, scale)
+        self._rules = {}
+        for command, fields in self._conf["fields"].items():
+            self._rules[command.encode()] = [(f["name"],
+                                              f["index"],
+                                              f.get("scale", 1.0))
+                                             for f in fields]
+
+    def Get(self, key):
+        return self._conf[key]
+
+    def GetSeries(self):
+        """
+        Returns:
+            dict: Ring buffers by series name
+        """
+        with self._lock:
+            return dict(self._series)
+
+    def __series(self, name):
+        buffer = self._series.get(name)
+        if buffer is None:
+            with self._lock:
+                buffer = RingBuffer(self._conf["capacity"])
+                self._series[name] = buffer
+
+        return buffer
+
+    def Extract(self, frame):
+        """
+        Reads the fields of a string-type response frame:
+        DLR;<number of params>;<command>;<params>;<timestamp>;EOR
+
+        Args:
+            frame (bytes): Validated frame
+
+        Returns:
+            list: (name, value) of the fields of the command
+                  (empty for commands without rules)
+        """
+        if not self._rules or not frame.startswith(b"DLR;"):
+            return []
+
+        fields = frame.split(b";")
+        if len(fields) < 4:
+            return []
+
+        rules = self._rules.get(fields[2])
+        if rules is None:
+            return []
+
+        values = []
+        params = fields[3:len(fields) - 2]
+        for name, index, scale in rules:
+            try:
+                values.append((name, float(params[index]) * scale))
+            except (IndexError, ValueError):
+                continue
+
+        return values
+
+    def Process(self, frame, t=None):
+        """
+        Extracts the fields of a response frame (see Extract)
+        and stores them.
+
+        Frames of commands without rules are ignored. Called
+        from the reading thread of the device.
+
+        Args:
+            frame (bytes): Validated frame
+            t (float, optional): Reception time. Defaults to now.
+        """
+        values = self.Extract(frame)
+        if not values:
+            return
+
+        if t is None:
+            t = time.time()
+
+        for name, value in values:
+            self.__series(name).Append(t, value)
@@ -0,0 +1,138 @@
+"""Serial transport profiles.
+
+This file contains the class PortProfile, which stores the settings
+used to open the serial port of a device. Baud rate, timeouts, driver
+buffer sizes, flow control and the low latency mode of the port are
+read from the device entry in "app.json".
+"""
+# Standard imports
+import sys
+
+# Third parties
+import serial
+
+class PortProfile:
+    """
+    Transport profile of a serial device. Stores the
+    settings used to open the port, so that probing a
+    port and opening the live connection use exactly
+    the same values.
+
+    Every value is optional in the configuration file,
+    the ones that are not present take the default value.
+    """
+#region Variables
+    # Default values of the profile
+    DEFAULTS = {
+        "baudrate": 115200,
+        "timeout": 1,
+        "write_timeout": None,
+        "inter_byte_timeout": None,
+        "rtscts": False,
+        "rx_buffer": 4096,
+        "tx_buffer": 4096,
+        "low_latency": False
+    }
+
+    # Time window (seconds) of data that each read tries to get
+    _readWindow = 0.01
+
+    # Limits of the reading chunk
+    _minChunk = 64
+
+    # Current settings
+    _settings = None
+#endregion
+
+    def __init__(self, conf=None):
+        """
+        Creates the profile from the "serial" entry of
+        a device in the configuration file.
+
+        Args:
+            conf (dict, optional): Serial settings. Defaults to None.
+        """
+        self._settings = dict(self.DEFAULTS)
+        if conf:
+            for key in conf:
+                if key not in self.DEFAULTS:
+                    raise ValueError("Unknown serial setting: " + key)
+
+                self._settings[key] = conf[key]
+
+    #------------------------------------------------
+    #--------------------Getters---------------------
+    #------------------------------------------------
+
+    def Get(self, key):
+        """
+        Access one setting of the profile.
+
+        Args:
+            key (str): Setting name
+
+        Returns:
+            Object: Value of the setting
+        """
+        return self._settings[key]
+
+    def GetChunkSize(self):
+        """
+        Calculates the number of bytes that the reading
+        loop should ask for on each read. It's the amount
+        of data that the link can deliver in the reading
+        window, limited by the size of the driver buffer.
+
+        Returns:
+            int: Number of bytes per read
+        """
+        # 10 bits per byte on the line (start + 8 data + stop)
+        perWindow = int(self._settings["baudrate"] / 10 * self._readWindow)
+
+        return max(self._minChunk, min(perWindow, self._settings["rx_buffer"]))
+
+    #------------------------------------------------
+    #--------------------Getters---------------------
+    #------------------------------------------------
+
+    def Open(self, port):
+        """
+        Opens a serial port using the settings of this
+        profile. Driver buffer sizes are only applied
+        where pyserial supports it (Windows), and the
+        low latency flag where the OS supports it (Linux).
+
+        Args:
+            port (str): Port to open
+
+        Raises:
+            serial.SerialException: When the port can't be opened.
+
+        Returns:
+            serial.Serial: Opened port
+        """
+        ser = serial.Serial()
+        ser.port = port
+        ser.baudrate = self._settings["baudrate"]
+        ser.timeout = self._settings["timeout"]
+        ser.write_timeout = self._settings["write_timeout"]
+        ser.inter_byte_timeout = self._settings["inter_byte_timeout"]
+        ser.rtscts = self._settings["rtscts"]
+        ser.open()
+
+        # Driver buffers (only available in Windows)
+        if hasattr(ser, "set_buffer_size"):
+            ser.set_buffer_size(rx_size=self._settings["rx_buffer"],
+                                tx_size=self._settings["tx_buffer"])
+
+        # ASYNC_LOW_LATENCY flag (only available in Linux). Not every
+        # driver supports it, so a failure only disables the mode.
+        if (self._settings["low_latency"]
+            and sys.platform.startswith("linux")
+            and hasattr(ser, "set_low_latency_mode")):
+            try:
+                ser.set_low_latency_mode(True)
+            except (OSError, ValueError) as e:
+                print("Low latency mode not available: " + str(e))
+
+        return ser
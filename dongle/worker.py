@@ -0,0 +1,622 @@
+"""Device worker process.
+
+This file contains RemoteDevice, a controller with the interface of
+Device that runs the Device in its own process. The worker process owns
+the serial port, the reading thread, the framing and the checksums, so
+its timing doesn't depend on the GIL of the GUI (log, plots, handlers),
+several dongles run on several cores, and a driver that crashes the
+worker doesn't take down the app.
+
+The processes talk through a multiprocessing Pipe. Messages are small
+tuples, sent in batches (a list per send) to save system calls:
+
+    GUI -> worker:  (WRITE, frame) | (TRACE, trace) | (CALL, id, name, args)
+    worker -> GUI:  (EVENT, code, data, kind, t, decoded, device, extra)
+                    | (STATE, connected, port, last)
+                    | (REPLY, id, result, error)
+
+Events are the ones that Device posts, by their code in _EVENTS, and
+they are posted to the GUI listener by the receiving thread of the GUI
+process, with the subscribers and telemetry called there too. The
+host stamps of the frames (time.monotonic_ns) are taken in the worker;
+the monotonic clock is the same for every process, so the latency
+spans measured by the GUI include the channel.
+
+Errors of a message don't end the worker: the exception of a call is
+raised again in the GUI process by the call, and the ones of the frames
+written are posted as writing errors.
+"""
+# Standard libraries
+import time
+import pickle
+import threading
+import itertools
+import multiprocessing as mp
+
+# External / Third parties libraries
+import wx
+
+# Local application
+import dongle.utils.events as ev
+from dongle.device import Device
+from dongle.utils.queues import BoundedQueue
+
+# Message types
+_WRITE = 0
+_TRACE = 1
+_CALL = 2
+_EVENT = 0
+_STATE = 1
+_REPLY = 2
+
+# Events forwarded from the worker, by code
+_EVENTS = (
+    ev.SerialCTrue, ev.SerialCError, ev.SerialCDisconnect, ev.SerialCFalse,
+    ev.SerialCLost, ev.SerialCReconnect, ev.SerialREvent, ev.SerialRError,
+    ev.SerialRMessage, ev.SerialRFrameErr, ev.SerialWEvent, ev.SerialWErr,
+    ev.SerialRRepeat, ev.SerialWRepeat
+)
+_codes = {e: i for i, e in enumerate(_EVENTS)}
+
+# Events of the connection, sent with the state of the device
+_connection = frozenset(_codes[e] for e in (
+    ev.SerialCTrue, ev.SerialCError, ev.SerialCDisconnect,
+    ev.SerialCLost, ev.SerialCReconnect))
+
+# Events with a frame received
+_frames = frozenset(_codes[e] for e in (
+    ev.SerialREvent, ev.SerialRMessage, ev.SerialRFrameErr))
+
+class _Channel:
+    """
+    Sending side of the pipe. Messages are queued and
+    sent by a thread in lists: when "batch" messages are
+    waiting, after "interval" seconds since the first
+    one, or at once when flushed (replies, states).
+    """
+#region Variables
+    _conn = None
+    _batch = 64
+    _interval = 0.002
+    _pending = None
+    _flush = False
+    _closed = False
+    _cond: threading.Condition = None
+    _thread: threading.Thread = None
+
+    # Statistics
+    sends = 0
+    messages = 0
+#endregion
+
+    def __init__(self, conn, batch=64, interval=0.002):
+        self._conn = conn
+        self._batch = batch
+        self._interval = interval
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(name="IPC sender",
+                                        target=self.__send, daemon=True)
+        self._thread.start()
+
+    def Put(self, message, flush=False):
+        with self._cond:
+            self._pending.append(message)
+            self._flush = self._flush or flush
+            if (len(self._pending) == 1 or self._flush
+                    or len(self._pending) >= self._batch):
+                self._cond.notify()
+
+    def __send(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+
+                # Give the batch time to fill
+                deadline = time.monotonic() + self._interval
+                while (len(self._pending) < self._batch and not self._flush
+                       and not self._closed):
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+
+                batch = self._pending[:self._batch]
+                del self._pending[:self._batch]
+                self._flush = self._flush and bool(self._pending)
+
+            try:
+                self._conn.send(batch)
+            except (OSError, EOFError):
+                # The other process is gone
+                break
+            self.sends += 1
+            self.messages += len(batch)
+
+    def Close(self, timeout=1.0):
+        """
+        Sends what is pending and stops the thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+def _calls(device, name, args):
+    """
+    Runs a call of the GUI process in the worker. Results
+    must be picklable, so the ones that aren't are turned
+    into plain values here.
+    """
+    if name == "stop_capture":
+        capture = device.stop_capture()
+        if capture is None:
+            return None
+        return (capture.path, capture.GetFrames())
+
+    if name == "metrics":
+        return device.get_scheduler().GetMetrics()
+
+    if name in ("get_reconnect_stats", "get_latency", "get_clock",
+                "get_aggregation", "get_queues", "schedule_repeat",
+                "cancel_repeat",
+                "get_port_data", "start_capture", "start_recording",
+                "stop_recording", "start_publishing", "stop_publishing",
+                "close"):
+        return getattr(device, name)(*args)
+
+    raise ValueError("Unknown call: " + name)
+
+def _error(e):
+    """
+    Exception of a call, as it's sent to the GUI process
+    (the ones that can't be pickled are sent as text).
+    """
+    try:
+        pickle.dumps(e)
+    except Exception:
+        return RuntimeError(str(e))
+    return e
+
+def _run(conn, configuration, last, batch, interval, port, protocol):
+    """
+    Main function of the worker process. Searches and
+    connects the device, then runs the messages of the
+    GUI process until the device is closed or the GUI
+    process ends.
+    """
+    channel = _Channel(conn, batch, interval)
+    device = None
+
+    def state():
+        return (_STATE, device is not None and device.is_connected(),
+                device and device.get_port(), device and device.get_last())
+
+    def forward(event, data):
+        code = _codes[event]
+        if code in _connection and device is not None:
+            channel.Put(state())
+        # Attributes of the summaries of repeated frames and of
+        # the commands repeated
+        extra = {name: data[name] for name in ("count", "last", "command")
+                 if name in data} or None
+        channel.Put((_EVENT, code, data.get("data"), data.get("kind"),
+                     data.get("t"), data.get("decoded"), data.get("device"),
+                     extra),
+                    code in _connection)
+
+    device = Device(configuration, forward, last=last,
+                    port=port() if port else None, protocol=protocol)
+    channel.Put(state(), True)
+
+    try:
+        while device.is_connected():
+            try:
+                if not conn.poll(0.1):
+                    continue
+                messages = conn.recv()
+            except (OSError, EOFError):
+                # GUI process ended
+                break
+
+            for message in messages:
+                try:
+                    if message[0] == _WRITE:
+                        device.write_frame(message[1])
+                    elif message[0] == _TRACE:
+                        device.write(message[1])
+                    else:
+                        _, ident, name, args = message
+                        channel.Put((_REPLY, ident,
+                                     _calls(device, name, args), None), True)
+                except Exception as e:
+                    # Sent to the GUI, a bad message doesn't end 
+                    # the worker (and the connection)
+                    if message[0] == _CALL:
+                        channel.Put((_REPLY, message[1], None, _error(e)),
+                                    True)
+                    else:
+                        forward(ev.SerialWErr, {"data": str(e)})
+    finally:
+        if device.is_connected():
+            device.close()
+        channel.Put(state(), True)
+        channel.Close()
+        conn.close()
+
+class _RemoteCapture:
+    """
+    Capture recorded by the worker process.
+    """
+    def __init__(self, path, frames):
+        self.path = path
+        self._frames = frames
+
+    def GetFrames(self):
+        return self._frames
+
+class _RemoteScheduler:
+    """
+    Access to the TX scheduler of the worker process.
+    """
+    def __init__(self, device):
+        self._device = device
+
+    def GetMetrics(self):
+        return self._device._call("metrics") or {}
+
+class RemoteDevice:
+    """
+    Controller of a device that runs in its own process.
+    It has the interface of Device, so the GUI uses both
+    the same way.
+
+    State (connected, port, last device) is kept updated
+    by the worker, the rest is asked with a call that
+    waits for the reply of the worker.
+    """
+#region Variables
+    # Default values of the "isolation" configuration
+    DEFAULTS = {
+        "enabled": False,
+        # Messages per send, and max seconds a message waits
+        "batch": 64,
+        "interval": 0.002,
+        # Seconds waiting for the worker to find the device
+        "startTimeout": 15.0,
+        # Seconds waiting for a call or for the worker to end
+        "callTimeout": 2.0
+    }
+
+    _process: mp.Process = None
+    _conn = None
+    _channel: _Channel = None
+    _receiver: threading.Thread = None
+    _listener = None
+    _telemetry = None
+    _subscribers = ()
+    _conf = None
+
+    # Bounded queue of the events to the listener
+    _pump: ev.EventPump = None
+
+    # State of the device, sent by the worker
+    _connected = False
+    _port = None
+    _last = None
+    _closing = False
+
+    # Calls waiting for their reply
+    _ids = None
+    _replies = None
+    _cond: threading.Condition = None
+#endregion
+
+    def __init__(self, configuration, listener, telemetry=None, last=None,
+                 port=None, protocol=None):
+        """
+        Starts the worker process, and waits until it has
+        searched the device (like the constructor of Device).
+
+        Args:
+            configuration (AppConfig): Compiled "app.json"
+            listener (wx.Window): Listener of the events
+            telemetry (Telemetry, optional): Telemetry extraction,
+                                             done in this process.
+            last (tuple, optional): (port, serial number) of the last
+                                    device, checked first.
+            port (callable, optional): Picklable factory of a port
+                                       object, opened in the worker
+                                       instead of searching (simulators).
+            protocol (Protocol, optional): Codecs of the commands, used
+                                           by the worker to encode.
+        """
+        self._conf = conf = dict(self.DEFAULTS, **configuration.isolation)
+        self._listener = listener
+        if listener is not None:
+            ui = configuration.queues.get("ui", {})
+            self._pump = ev.EventPump(listener,
+                                      BoundedQueue.FromConf(ui, "ui"),
+                                      ui.get("batch", 256))
+        self._telemetry = telemetry
+        self._last = last
+        self._ids = itertools.count()
+        self._replies = {}
+        self._cond = threading.Condition()
+
+        # Spawn on every system: no fork of a process with a GUI
+        ctx = mp.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(name="DynaLoRa device", target=_run,
+                                    args=(child, configuration, last,
+                                          conf["batch"], conf["interval"],
+                                          port, protocol),
+                                    daemon=True)
+        self._process.start()
+        child.close()
+
+        # Wait for the first state, the result of the search
+        deadline = time.monotonic() + conf["startTimeout"]
+        started = False
+        while not started and time.monotonic() < deadline:
+            try:
+                if not self._conn.poll(0.1):
+                    if not self._process.is_alive():
+                        break
+                    continue
+                messages = self._conn.recv()
+            except (OSError, EOFError):
+                break
+            for message in messages:
+                started = started or message[0] == _STATE
+                self.__dispatch(message)
+
+        if not self._connected:
+            self.__stop()
+            return
+
+        self._channel = _Channel(self._conn, conf["batch"], conf["interval"])
+        self._receiver = threading.Thread(name="IPC receiver",
+                                          target=self.__receive, daemon=True)
+        self._receiver.start()
+
+    def __dispatch(self, message):
+        """
+        Runs a message of the worker.
+        """
+        if message[0] == _EVENT:
+            _, code, data, kind, t, decoded, device, extra = message
+            if code in _frames:
+                if kind == "response" and self._telemetry:
+                    self._telemetry.Process(data)
+                for callback in self._subscribers:
+                    callback(data)
+            if self._listener is not None:
+                event = _EVENTS[code](data=data, kind=kind, t=t,
+                                      decoded=decoded, device=device)
+                if extra:
+                    for name, value in extra.items():
+                        setattr(event, name, value)
+                # Only the events with a frame can be dropped
+                self._pump.Post(event, code not in _frames and not extra)
+        elif message[0] == _STATE:
+            _, self._connected, port, last = message
+            if port is not None:
+                self._port = port
+                self._last = last
+        else:
+            _, ident, result, error = message
+            with self._cond:
+                self._replies[ident] = (result, error)
+                self._cond.notify_all()
+
+    def __receive(self):
+        while True:
+            try:
+                messages = self._conn.recv()
+            except (OSError, EOFError):
+                break
+            for message in messages:
+                self.__dispatch(message)
+
+        if self._connected and not self._closing:
+            # The worker died without closing the device
+            self._connected = False
+            if self._listener is not None:
+                self._pump.Post(ev.SerialCError(), True)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _call(self, name, *args):
+        """
+        Runs a method of the Device in the worker.
+
+        Returns:
+            Result of the call, or None if the worker didn't reply
+
+        Raises:
+            Exception: The one raised by the call in the worker
+        """
+        if self._channel is None or not self._process.is_alive():
+            return None
+
+        ident = next(self._ids)
+        self._channel.Put((_CALL, ident, name, args), True)
+        deadline = time.monotonic() + self._conf["callTimeout"]
+        with self._cond:
+            while ident not in self._replies:
+                left = deadline - time.monotonic()
+                if left <= 0 or not self._receiver.is_alive():
+                    return None
+                self._cond.wait(left)
+            result, error = self._replies.pop(ident)
+        if error is not None:
+            raise error
+        return result
+
+    def __stop(self):
+        """
+        Waits for the worker to end, and kills it if it
+        doesn't. Closes the pipe.
+        """
+        self._process.join(self._conf["callTimeout"])
+        if self._process.is_alive():
+            print("Worker not stopped, terminating it")
+            self._process.terminate()
+            self._process.join(self._conf["callTimeout"])
+        self._conn.close()
+
+    def close(self):
+        """
+        Closes the device in the worker, and ends it.
+        """
+        if self._closing:
+            return
+
+        self._closing = True
+        try:
+            self._call("close")
+        finally:
+            if self._channel:
+                self._channel.Close()
+            if self._receiver \
+                    and self._receiver is not threading.current_thread():
+                self._receiver.join(self._conf["callTimeout"])
+            self.__stop()
+            self._connected = False
+
+    def test_connection(self):
+        return self._process.is_alive()
+
+    def is_connected(self):
+        return self._connected
+
+    def get_port(self):
+        return self._port
+
+    def get_last(self):
+        return self._last
+
+    def get_port_data(self):
+        if not self.is_connected():
+            return "No device connected"
+        return self._call("get_port_data")
+
+    def get_reconnect_stats(self):
+        return self._call("get_reconnect_stats") or {
+            "reconnects": 0, "last": 0.0, "mean": 0.0, "max": 0.0,
+            "buffered": 0, "dropped": 0}
+
+    def get_latency(self):
+        return self._call("get_latency") or {}
+
+    def get_aggregation(self):
+        return self._call("get_aggregation")
+
+    def get_clock(self):
+        return self._call("get_clock") or {}
+
+    def get_queues(self):
+        """
+        Queues of the events in this process, and of the
+        recorder in the worker.
+
+        Returns:
+            list: BoundedQueue.GetStats of each queue
+        """
+        stats = [self._pump.GetStats()] if self._pump else []
+        return stats + (self._call("get_queues") or [])
+
+    def get_scheduler(self):
+        return _RemoteScheduler(self)
+
+    def get_worker_stats(self):
+        """
+        Statistics of the channel to the worker.
+
+        Returns:
+            dict: Process id, sends and messages sent to the worker
+        """
+        channel = self._channel
+        return {"pid": self._process.pid,
+                "sends": channel.sends if channel else 0,
+                "messages": channel.messages if channel else 0}
+
+    def subscribe(self, callback):
+        self._subscribers = self._subscribers + (callback,)
+
+    def unsubscribe(self, callback):
+        self._subscribers = tuple(c for c in self._subscribers
+                                  if c != callback)
+
+    def start_capture(self, path):
+        self._call("start_capture", path)
+
+    def stop_capture(self):
+        capture = self._call("stop_capture")
+        if capture is None:
+            return None
+        return _RemoteCapture(*capture)
+
+    def start_recording(self, path, conf=None):
+        self._call("start_recording", path, conf)
+
+    def stop_recording(self):
+        return self._call("stop_recording")
+
+    def start_publishing(self, name=None, slots=65536, slotSize=256):
+        return self._call("start_publishing", name, slots, slotSize)
+
+    def stop_publishing(self):
+        self._call("stop_publishing")
+
+    def schedule_repeat(self, frame, period):
+        """
+        Sends a command periodically from the scheduler of
+        the worker.
+
+        Returns:
+            int: Id of the repeat, or None if the worker didn't
+                 answer
+        """
+        return self._call("schedule_repeat", frame, period)
+
+    def cancel_repeat(self, id):
+        self._call("cancel_repeat", id)
+
+    def write(self, trace):
+        """
+        Sends a trace, encoded by the worker.
+        """
+        self.__send((_TRACE, trace))
+
+    def write_frame(self, data):
+        """
+        Sends a frame already encoded.
+        """
+        self.__send((_WRITE, bytes(data)))
+
+    def __send(self, message):
+        if self.is_connected() and self._channel is not None:
+            self._channel.Put(message)
+        elif self._listener is not None:
+            wx.PostEvent(self._listener, ev.SerialCFalse())
+
+def open_device(configuration, listener, telemetry=None, last=None,
+                protocol=None):
+    """
+    Creates the controller of a device, in this process
+    or in a worker process, as set in the "isolation"
+    entry of the configuration.
+
+    Returns:
+        Device/RemoteDevice: Controller of the device
+    """
+    if configuration.isolation.get("enabled"):
+        return RemoteDevice(configuration, listener, telemetry, last,
+                            protocol=protocol)
+    return Device(configuration, listener, telemetry, last=last,
+                  protocol=protocol)
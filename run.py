@@ -1,8 +1,12 @@
 # Main entry point of the app
 # Basically initializes the app and the MainWindow,
 # prepares to listen for user events.
+import multiprocessing
+
 import dongle
 import dongle.app as app
 
 if __name__ == "__main__":
+    # Needed by the worker processes of the devices in the frozen app
+    multiprocessing.freeze_support()
     app.run()
\ No newline at end of file
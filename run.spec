@@ -7,7 +7,7 @@ block_cipher = None
 a = Analysis(['run.py'],
            pathex=[],
            binaries=[],
-           datas=[('./dongle/data/cnf/app.json', './dongle/data/cnf/'), ('./dongle/data/cnf/dongle_ui.json', './dongle/data/cnf/'), ('./dongle/data/cnf/bhDynamics.ico', './dongle/data/cnf/'), ('./dongle/data/cnf/banner.png', './dongle/data/cnf/')],
+           datas=[('./dongle/data/cnf/app.json', './dongle/data/cnf/'), ('./dongle/data/cnf/dongle_ui.json', './dongle/data/cnf/'), ('./dongle/data/cnf/protocol.json', './dongle/data/cnf/'), ('./dongle/data/cnf/bhDynamics.ico', './dongle/data/cnf/'), ('./dongle/data/cnf/banner.png', './dongle/data/cnf/')],
            hiddenimports=['uuid', 'time', 'decimal', 'serial', 'threading'],
            hookspath=[],
            runtime_hooks=[],